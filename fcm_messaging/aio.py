@@ -0,0 +1,187 @@
+"""
+asyncio-native versions of the send functions, for ASGI deployments.
+Audiences are resolved with the async ORM and the chunks are sent with the Admin SDK async API, which
+multiplexes the FCM HTTP v1 requests over the HTTP/2 connection pool shared by each Firebase app.
+At most FCM_MESSAGING_ASYNC_CONCURRENCY chunks are in flight at once. Only the certificate lookup,
+logging and pruning still run in a worker thread.
+"""
+
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from firebase_admin import messaging
+
+from .audience import AudienceNormalizer, aadmin_tokens, aiter_username_tokens
+from .metrics import atimed_iter, record_sends, timed, timed_iter
+from .ratelimit import PRIORITY_BULK, PRIORITY_HIGH, RateLimitExceeded, aacquire
+from .retry import aretry_failed
+from .utils import (
+    MULTICAST_MAX_TOKENS,
+    MulticastResponse,
+    format_batch_response,
+    get_firebase_app,
+    log_fcm_response,
+    prune_invalid_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASYNC_CONCURRENCY = 8
+
+
+async def asend_message_tokens(title, body, tokens):
+    """Sends a notification to a list of FCM tokens."""
+    normalizer = AudienceNormalizer()
+    return await _asend(title, body, normalizer.tokens(tokens), "No valid tokens found", normalizer=normalizer)
+
+
+async def asend_message_token(title, body, token):
+    """Sends a notification to a single FCM token."""
+    app, message = await sync_to_async(get_firebase_app)()
+    if app is None:
+        return False, message
+    try:
+        message = messaging.Message(notification=messaging.Notification(title=title, body=body), token=token)
+
+        async def send(tokens):
+            with timed("rate_limit"):
+                if not await aacquire(1, PRIORITY_HIGH):
+                    raise RateLimitExceeded()
+            with timed("fcm_round_trip"):
+                return (await messaging.send_each_async([message], app=app)).responses
+
+        responses, retried = await aretry_failed([token], await send([token]), send, time.monotonic())
+        response = MulticastResponse(responses, [token], retried=retried)
+        record_sends(response)
+        await sync_to_async(log_fcm_response)(message_title=title, message_body=body, response=response)
+        await sync_to_async(prune_invalid_tokens)([token], response)
+        if not response.responses[0].success:
+            return False, "Notification sending failed"
+        return True, response.responses[0].message_id
+    except Exception:
+        logger.exception("Failed to send notification to token")
+        return False, "Notification sending failed"
+
+
+async def asend_message_usernames(title, body, usernames):
+    """Sends a notification to a list of usernames."""
+    normalizer = AudienceNormalizer()
+    recipients = []
+
+    async def tokens():
+        async for recipient in normalizer.arecipients(aiter_username_tokens(usernames)):
+            recipients.append(recipient)
+            yield recipient.token
+
+    return await _asend(
+        title,
+        body,
+        tokens(),
+        "No valid tokens found for the given usernames.",
+        recipients=recipients,
+        normalizer=normalizer,
+    )
+
+
+async def asend_message_admin(title, body):
+    normalizer = AudienceNormalizer()
+    recipients = list(normalizer.recipients(await aadmin_tokens()))
+    tokens = [recipient.token for recipient in recipients]
+    return await _asend(
+        title,
+        body,
+        tokens,
+        "No valid tokens found",
+        recipients=recipients,
+        normalizer=normalizer,
+        priority=PRIORITY_HIGH,
+    )
+
+
+async def _asend(title, body, tokens, no_tokens_message, recipients=None, normalizer=None, priority=PRIORITY_BULK):
+    app, message = await sync_to_async(get_firebase_app)()
+    if app is None:
+        return False, message
+    try:
+        response = await asend_multicast(
+            messaging.Notification(title=title, body=body), tokens, app=app, priority=priority
+        )
+
+        if not response.responses:
+            return False, no_tokens_message
+
+        response.recipients = recipients
+        response.removed = normalizer.removed if normalizer else 0
+        success = await sync_to_async(log_fcm_response)(message_title=title, message_body=body, response=response)
+        await sync_to_async(prune_invalid_tokens)(response.tokens, response)
+        return success, format_batch_response(response)
+    except Exception:
+        logger.exception("Failed to send notification")
+        return False, "Notification sending failed"
+
+
+async def asend_multicast(notification, tokens, app=None, priority=PRIORITY_BULK):
+    """
+    Async version of `utils.send_multicast`, `tokens` may be a sync or async iterable.
+    The audience is consumed lazily: a new chunk is only read once one of the
+    FCM_MESSAGING_ASYNC_CONCURRENCY chunks in flight has completed.
+    Tokens that failed with a transient error are then re-sent (see retry.aretry_failed).
+    """
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(getattr(settings, "FCM_MESSAGING_ASYNC_CONCURRENCY", DEFAULT_ASYNC_CONCURRENCY))
+
+    async def send(tokens, sent_tokens):
+        tasks = []
+        async for chunk in _achunked(tokens, MULTICAST_MAX_TOKENS):
+            sent_tokens.extend(chunk)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(_asend_multicast_chunk(notification, chunk, app, priority, semaphore)))
+        return [r for response in await asyncio.gather(*tasks) for r in response.responses]
+
+    async def resend(tokens):
+        return await send(tokens, [])
+
+    sent_tokens = []
+    audience = atimed_iter(tokens, "audience") if hasattr(tokens, "__aiter__") else timed_iter(tokens, "audience")
+    responses = await send(audience, sent_tokens)
+    responses, retried = await aretry_failed(sent_tokens, responses, resend, started)
+    response = MulticastResponse(responses, sent_tokens, retried=retried)
+    record_sends(response)
+    return response
+
+
+async def _asend_multicast_chunk(notification, tokens, app, priority, semaphore):
+    with timed("build"):
+        multicast_message = messaging.MulticastMessage(notification=notification, tokens=tokens)
+    try:
+        with timed("rate_limit"):
+            if not await aacquire(len(tokens), priority):
+                raise RateLimitExceeded()
+        with timed("fcm_round_trip"):
+            return await messaging.send_each_for_multicast_async(multicast_message, app=app)
+    except Exception as e:
+        # A failed chunk must not discard the results of the other chunks, report it per token instead
+        return messaging.BatchResponse([messaging.SendResponse(None, e) for _ in tokens])
+    finally:
+        semaphore.release()
+
+
+async def _achunked(items, size):
+    chunk = []
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    else:
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
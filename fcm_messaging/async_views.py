@@ -0,0 +1,139 @@
+"""
+Async counterparts of the send-notification views, for ASGI deployments.
+They take the same JSON bodies and return the same responses as the views in views.py, but await the
+send functions of aio.py instead of holding a worker thread for the duration of the send.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .aio import asend_message_admin, asend_message_token, asend_message_tokens, asend_message_usernames
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with coroutine handlers. The project's authentication, permission and throttle classes run as
+    in the sync views (in a thread, since they may query the database), so unauthenticated or forbidden
+    requests get the same 401/403 responses, and session-authenticated requests the same CSRF check.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = self.http_method_not_allowed
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class SendNotificationToTokensView(AsyncAPIView):
+    async def post(self, request):
+        tokens = request.data.get("tokens")  # Expecting a list of tokens
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if not all([tokens, title, body]):
+            return Response(
+                {"success": False, "error": "tokens, title, and body are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not isinstance(tokens, list):
+            return Response(
+                {"success": False, "error": "tokens must be a list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        success, message = await asend_message_tokens(title, body, tokens)
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
+
+
+class SendNotificationToTokenView(AsyncAPIView):
+    async def post(self, request):
+        device_token = request.data.get("token")
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if not all([device_token, title, body]):
+            return Response(
+                {"success": False, "error": "token, title, and body are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        success, message = await asend_message_token(title, body, device_token)
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
+
+
+class SendNotificationToUsernamesView(AsyncAPIView):
+    async def post(self, request):
+        usernames = request.data.get("usernames")  # Expecting a list of usernames
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if not all([usernames, title, body]):
+            return Response(
+                {"success": False, "error": "usernames, title, and body are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not isinstance(usernames, list):
+            return Response(
+                {"success": False, "error": "usernames must be a list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        success, message = await asend_message_usernames(title, body, usernames)
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
+
+
+class SendNotificationToUsernameView(AsyncAPIView):
+    async def post(self, request):
+        username = request.data.get("username")
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if not all([username, title, body]):
+            return Response(
+                {"success": False, "error": "username, title, and body are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        success, message = await asend_message_usernames(title, body, [username])
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
+
+
+class SendNotificationAdminView(AsyncAPIView):
+    async def post(self, request):
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if not all([title, body]):
+            return Response(
+                {"success": False, "error": "title, and body are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        success, message = await asend_message_admin(title, body)
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
@@ -0,0 +1,190 @@
+"""
+Audience resolution for the send path.
+Only active devices are returned and only the columns the sender needs are fetched; the queries are
+backed by the (username, is_active) and (is_dashboard_login, is_active) indexes of UserDevice.
+
+The active tokens of every username and the admin tokens are kept in the Django cache for
+FCM_MESSAGING_AUDIENCE_CACHE_TTL seconds (0 disables it), so repeated sends to the same users skip the
+database. Saving or deleting a UserDevice invalidates its entries once the change is committed (see
+signals.py), so a send running in the meantime cannot cache the previous tokens again; bulk writes, which
+bypass the signals, call `invalidate_audience_cache` themselves, also on commit. A send that read the
+devices just before the commit may still cache them, for at most the TTL.
+"""
+
+import hashlib
+import re
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserDevice
+
+# Usernames per IN list and rows fetched per cursor round trip when streaming an audience
+USERNAME_CHUNK_SIZE = 1000
+ITERATOR_CHUNK_SIZE = 2000
+
+DEFAULT_AUDIENCE_CACHE_TTL = 300
+USERNAME_TOKENS_CACHE_KEY = "fcm_messaging:username_devices:{}"
+ADMIN_TOKENS_CACHE_KEY = "fcm_messaging:admin_devices"
+
+# A device an audience resolves to, carried along the send so results map back to users and devices
+Recipient = namedtuple("Recipient", ["token", "username", "uuid", "platform"])
+RECIPIENT_FIELDS = list(Recipient._fields)
+
+# FCM registration tokens are URL-safe base64 with a ":" separating the instance id
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_:\-]{1,4096}")
+
+
+def active_devices():
+    return UserDevice.objects.filter(is_active=True)
+
+
+def audience_cache_ttl():
+    return getattr(settings, "FCM_MESSAGING_AUDIENCE_CACHE_TTL", DEFAULT_AUDIENCE_CACHE_TTL)
+
+
+def username_tokens_key(username):
+    # usernames may hold characters or lengths cache backends reject in keys
+    return USERNAME_TOKENS_CACHE_KEY.format(hashlib.sha256(username.encode()).hexdigest())
+
+
+def invalidate_audience_cache(usernames=(), admins=True):
+    """Drops the cached tokens of the given usernames and, unless admins is False, the admin tokens."""
+    keys = [username_tokens_key(username) for username in set(usernames) if username]
+    if admins:
+        keys.append(ADMIN_TOKENS_CACHE_KEY)
+    cache.delete_many(keys)
+
+
+def _username_tokens_query(usernames):
+    return active_devices().filter(username__in=usernames).values_list(*RECIPIENT_FIELDS)
+
+
+def _group_tokens(usernames, rows):
+    """Groups recipient rows into the (token, uuid, platform) list of every username, empty without devices."""
+    devices = {username: [] for username in usernames}
+    for token, username, uuid, platform in rows:
+        devices.setdefault(username, []).append((token, uuid, platform))
+    return devices
+
+
+def _cached_rows(keys, cached, fetched):
+    for key, username in keys.items():
+        for token, uuid, platform in cached[key] if key in cached else fetched.get(username, []):
+            yield Recipient(token, username, uuid, platform)
+
+
+class AudienceNormalizer:
+    """
+    Normalizes an audience before it is sent to, in one pass with set lookups: tokens are stripped, and
+    empty, malformed and already seen tokens are dropped. `removed` counts the dropped tokens.
+    """
+
+    def __init__(self):
+        self.removed = 0
+        self._tokens = set()
+
+    def _accept(self, token):
+        if not isinstance(token, str) or not TOKEN_PATTERN.fullmatch(token) or token in self._tokens:
+            self.removed += 1
+            return False
+        self._tokens.add(token)
+        return True
+
+    def tokens(self, tokens):
+        """Yields the normalized tokens of any iterable of tokens."""
+        for token in tokens:
+            token = token.strip() if isinstance(token, str) else token
+            if self._accept(token):
+                yield token
+
+    def recipients(self, recipients):
+        """Yields the Recipients of any iterable of Recipients whose token is kept."""
+        for recipient in recipients:
+            if self._accept(recipient.token):
+                yield recipient
+
+    async def arecipients(self, recipients):
+        """Async version of `recipients`, for an async iterable."""
+        async for recipient in recipients:
+            if self._accept(recipient.token):
+                yield recipient
+
+
+def iter_username_tokens(usernames, chunk_size=USERNAME_CHUNK_SIZE):
+    """
+    Streams the Recipients (token, username, uuid, platform) of the active devices of the given usernames.
+    Usernames are resolved in bounded IN lists and rows are read off a cursor, so memory stays flat
+    for any audience size. Only the usernames missing from the audience cache are queried.
+    """
+    ttl = audience_cache_ttl()
+    usernames = iter(usernames)
+    while chunk := list(islice(usernames, chunk_size)):
+        if not ttl:
+            yield from map(Recipient._make, _username_tokens_query(chunk).iterator(chunk_size=ITERATOR_CHUNK_SIZE))
+            continue
+
+        keys = {username_tokens_key(username): username for username in chunk}
+        cached = cache.get_many(keys)
+        missing = [username for key, username in keys.items() if key not in cached]
+        fetched = {}
+        if missing:
+            fetched = _group_tokens(missing, _username_tokens_query(missing).iterator(chunk_size=ITERATOR_CHUNK_SIZE))
+            cache.set_many({username_tokens_key(username): tokens for username, tokens in fetched.items()}, ttl)
+        yield from _cached_rows(keys, cached, fetched)
+
+
+def admin_tokens():
+    """Returns the Recipients of the active devices logged in to the dashboard."""
+    ttl = audience_cache_ttl()
+    if ttl:
+        devices = cache.get(ADMIN_TOKENS_CACHE_KEY)
+        if devices is not None:
+            return devices
+
+    rows = active_devices().filter(is_dashboard_login=True).values_list(*RECIPIENT_FIELDS)
+    devices = [Recipient._make(row) for row in rows]
+    if ttl:
+        cache.set(ADMIN_TOKENS_CACHE_KEY, devices, ttl)
+    return devices
+
+
+async def aiter_username_tokens(usernames, chunk_size=USERNAME_CHUNK_SIZE):
+    """
+    Async version of `iter_username_tokens`, using the async ORM and cache API.
+    Each IN list is fetched at once, values_list().aiterator() runs its query synchronously on Django 4.2.
+    """
+    ttl = audience_cache_ttl()
+    usernames = iter(usernames)
+    while chunk := list(islice(usernames, chunk_size)):
+        if not ttl:
+            async for row in _username_tokens_query(chunk):
+                yield Recipient._make(row)
+            continue
+
+        keys = {username_tokens_key(username): username for username in chunk}
+        cached = await cache.aget_many(keys)
+        missing = [username for key, username in keys.items() if key not in cached]
+        fetched = {}
+        if missing:
+            fetched = _group_tokens(missing, [row async for row in _username_tokens_query(missing)])
+            await cache.aset_many({username_tokens_key(username): tokens for username, tokens in fetched.items()}, ttl)
+        for row in _cached_rows(keys, cached, fetched):
+            yield row
+
+
+async def aadmin_tokens():
+    """Async version of `admin_tokens`, using the async ORM and cache API."""
+    ttl = audience_cache_ttl()
+    if ttl:
+        devices = await cache.aget(ADMIN_TOKENS_CACHE_KEY)
+        if devices is not None:
+            return devices
+
+    rows = active_devices().filter(is_dashboard_login=True).values_list(*RECIPIENT_FIELDS)
+    devices = [Recipient._make(row) async for row in rows]
+    if ttl:
+        await cache.aset(ADMIN_TOKENS_CACHE_KEY, devices, ttl)
+    return devices
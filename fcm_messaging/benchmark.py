@@ -0,0 +1,151 @@
+"""
+End-to-end throughput benchmark of the send path, run against the fake FCM server of fakefcm.py by the
+`fcm_benchmark` command. For every audience size it reports sends per second, the p50/p99 latency of a
+whole send call, the database queries per send and the peak Python memory of a send. Memory is traced
+on an extra, untimed send since tracemalloc slows down everything it traces.
+"""
+
+import json
+import math
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from . import aio, async_views
+from .audience import invalidate_audience_cache
+from .models import FCMLog, FCMLogEntry, UserDevice
+from .transport import aclose_async_connections
+from .utils import get_firebase_app, send_message_tokens, send_message_usernames
+from .views import SendNotificationToTokensView, SendNotificationToUsernamesView
+
+BENCHMARK_PREFIX = "fcm-bench-"
+DEVICE_BATCH_SIZE = 10000
+
+
+def on_own_event_loop(send):
+    """
+    Runs an async send on a new event loop per call, from the calling thread like a WSGI server would, so
+    its queries run on the connection of that thread.
+    """
+
+    async def send_and_close(*args):
+        try:
+            return await send(*args)
+        finally:
+            app, _ = get_firebase_app()
+            await aclose_async_connections(app)
+
+    return async_to_sync(send_and_close)
+
+
+SEND_FUNCTIONS = {
+    ("tokens", False): send_message_tokens,
+    ("tokens", True): on_own_event_loop(aio.asend_message_tokens),
+    ("usernames", False): send_message_usernames,
+    ("usernames", True): on_own_event_loop(aio.asend_message_usernames),
+}
+SEND_VIEWS = {
+    ("tokens", False): SendNotificationToTokensView.as_view(),
+    ("tokens", True): on_own_event_loop(async_views.SendNotificationToTokensView.as_view()),
+    ("usernames", False): SendNotificationToUsernamesView.as_view(),
+    ("usernames", True): on_own_event_loop(async_views.SendNotificationToUsernamesView.as_view()),
+}
+
+
+def benchmark_tokens(size):
+    return [f"{BENCHMARK_PREFIX}token-{i}" for i in range(size)]
+
+
+def create_benchmark_devices(size):
+    """Registers `size` users with one device each and returns their usernames."""
+    usernames = []
+    for start in range(0, size, DEVICE_BATCH_SIZE):
+        devices = [
+            UserDevice(username=f"{BENCHMARK_PREFIX}user-{i}", uuid="bench", token=f"{BENCHMARK_PREFIX}token-{i}")
+            for i in range(start, min(start + DEVICE_BATCH_SIZE, size))
+        ]
+        UserDevice.objects.bulk_create(devices)
+        batch_usernames = [device.username for device in devices]
+        invalidate_audience_cache(batch_usernames, admins=False)
+        usernames.extend(batch_usernames)
+    return usernames
+
+
+def delete_benchmark_data(after_log_id=None):
+    """
+    Deletes the benchmark devices and, with after_log_id, the FCM logs of benchmark sends written since.
+    Logs of other sends, e.g. of other processes while the benchmark ran, are kept.
+    """
+    UserDevice.objects.filter(username__startswith=BENCHMARK_PREFIX).delete()
+    if after_log_id is not None:
+        log_ids = (
+            FCMLogEntry.objects.filter(log_id__gt=after_log_id, token__startswith=BENCHMARK_PREFIX)
+            .values_list("log_id", flat=True)
+            .distinct()
+        )
+        FCMLog.objects.filter(id__in=list(log_ids)).delete()
+
+
+def make_sender(audience, recipients, use_async=False, via_view=False):
+    """Returns a callable sending one notification to `recipients` and returning (success, detail)."""
+    key = (audience, use_async)
+    if not via_view:
+        send = SEND_FUNCTIONS[key]
+        return lambda: send("Benchmark", "Benchmark notification", recipients)
+
+    view = SEND_VIEWS[key]
+    body = json.dumps({audience: recipients, "title": "Benchmark", "body": "Benchmark notification"})
+
+    def send_through_view():
+        request = RequestFactory().post("/", data=body, content_type="application/json")
+        response = view(request)
+        data = response.data if hasattr(response, "data") else json.loads(response.content)
+        return data.get("success", False), data.get("detail", data.get("error"))
+
+    return send_through_view
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def run_benchmark(send, size, repeat=3):
+    """Measures `repeat` timed runs of `send` to an audience of `size` tokens, plus one traced for memory."""
+    tracemalloc.start()
+    try:
+        send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durations = []
+    queries = []
+    sent = failed = retried = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            _, detail = send()
+            durations.append(time.perf_counter() - started)
+        queries.append(len(captured))
+        if isinstance(detail, dict):
+            sent += detail.get("success_count", 0)
+            failed += detail.get("failure_count", 0)
+            retried += detail.get("retried_count", 0)
+
+    return {
+        "size": size,
+        "sends_per_sec": round((sent + failed) / sum(durations), 1),
+        "p50_ms": round(percentile(durations, 50) * 1000, 1),
+        "p99_ms": round(percentile(durations, 99) * 1000, 1),
+        "queries_per_send": round(sum(queries) / repeat, 1),
+        "peak_memory_mb": round(peak / 2**20, 1),
+        "success": sent,
+        "failure": failed,
+        "retried": retried,
+    }
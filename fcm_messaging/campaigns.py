@@ -0,0 +1,222 @@
+"""
+Campaigns spread a send to many usernames over a time window instead of sending it at once. The audience
+is split into batches of FCM_MESSAGING_CAMPAIGN_BATCH_SIZE usernames, released at even intervals over the
+window as ScheduledNotification rows by the `fcm_dispatch_scheduled` command:
+
+    FCM_MESSAGING_CAMPAIGN_BATCH_SIZE = 500
+    FCM_MESSAGING_QUIET_HOURS = ("22:00", "08:00")  # local time without releases, default None
+    FCM_MESSAGING_DEFAULT_TIMEZONE = None  # timezone of the users without one, defaults to TIME_ZONE
+
+With `by_timezone`, the users are bucketed by the timezone of their most recently updated device and every
+bucket gets its window at the same local time. Quiet hours pause the window of a bucket: the batches that
+would fall into them are released once they end, at the same intervals, so the window ends that much later.
+"""
+
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+
+try:
+    import zoneinfo
+except ImportError:  # Python 3.8
+    from backports import zoneinfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+from .models import Campaign, ScheduledNotification, UserDevice
+from .utils import chunked
+
+DEFAULT_CAMPAIGN_BATCH_SIZE = 500
+TIMEZONE_QUERY_BATCH_SIZE = 1000
+
+
+def default_timezone():
+    name = getattr(settings, "FCM_MESSAGING_DEFAULT_TIMEZONE", None)
+    return get_zone(name, timezone.get_default_timezone())
+
+
+def get_zone(name, default):
+    """The ZoneInfo of an IANA timezone name, `default` when it is empty or unknown."""
+    if not name:
+        return default
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return default
+
+
+def parse_quiet_hours(quiet_hours):
+    """(start, end) times from a pair of times or "HH:MM" strings, None for no quiet hours."""
+    if not quiet_hours:
+        return None
+    start, end = (value if isinstance(value, time) else time.fromisoformat(value) for value in quiet_hours)
+    return (start, end) if start != end else None
+
+
+def in_quiet_hours(local_time, quiet):
+    start, end = quiet
+    if start < end:
+        return start <= local_time < end
+    # the quiet hours wrap around midnight
+    return local_time >= start or local_time < end
+
+
+def _next_local(moment, at, zone):
+    """First instant after `moment` whose wall-clock time in `zone` is `at`, in UTC."""
+    local = moment.astimezone(zone)
+    candidate = datetime.combine(local.date(), at, tzinfo=zone)
+    if candidate <= local:
+        candidate = datetime.combine(local.date() + timedelta(days=1), at, tzinfo=zone)
+    return candidate.astimezone(dt_timezone.utc)
+
+
+def release_times(start, window, count, zone, quiet=None):
+    """
+    Yields the due times of `count` batches spread evenly over `window` seconds from `start`, skipping the
+    quiet hours of `zone`.
+    """
+    step = timedelta(seconds=window / count) if count else timedelta(0)
+    moment = start.astimezone(dt_timezone.utc)
+    remaining = timedelta(0)
+    for _ in range(count):
+        while quiet:
+            if in_quiet_hours(moment.astimezone(zone).time(), quiet):
+                moment = _next_local(moment, quiet[1], zone)
+                continue
+            quiet_start = _next_local(moment, quiet[0], zone)
+            if moment + remaining < quiet_start:
+                break
+            remaining -= quiet_start - moment
+            moment = quiet_start
+        moment += remaining
+        yield moment
+        remaining = step
+
+
+def user_timezones(usernames):
+    """Timezone name of every username that has one, from its most recently updated active device."""
+    zones = {}
+    for chunk in chunked(usernames, TIMEZONE_QUERY_BATCH_SIZE):
+        rows = (
+            UserDevice.objects.filter(username__in=chunk, is_active=True, timezone__isnull=False)
+            .order_by("username", "-updated_at")
+            .values_list("username", "timezone")
+        )
+        for username, name in rows:
+            zones.setdefault(username, name)
+    return zones
+
+
+def bucket_window(starts_at, window, zone, by_timezone, now):
+    """
+    Start and length in seconds of the window of a timezone bucket. A window that already started is
+    shortened to its remaining part. A window that is already over starts now, or with `by_timezone` at
+    the same local time the next day.
+    """
+    start = starts_at
+    local_start = timezone.localtime(starts_at, default_timezone()).replace(tzinfo=None)
+    if by_timezone:
+        start = timezone.make_aware(local_start, zone)
+    if start + timedelta(seconds=window) <= now:
+        if not by_timezone:
+            return now, window
+        start = timezone.make_aware(local_start + timedelta(days=1), zone)
+    if start < now:
+        return now, (start + timedelta(seconds=window) - now).total_seconds()
+    return start, window
+
+
+def create_campaign(title, body, usernames, starts_at, window, by_timezone=False, quiet_hours=None, batch_size=None):
+    """
+    Plans a campaign and schedules its batches.
+    - starts_at: aware datetime, with `by_timezone` its wall-clock time in the default timezone is used in
+      every timezone
+    - window: seconds the batches of every bucket are spread over
+    - quiet_hours: (start, end) pair, None for FCM_MESSAGING_QUIET_HOURS and an empty value for none
+    """
+    if quiet_hours is None:
+        quiet_hours = getattr(settings, "FCM_MESSAGING_QUIET_HOURS", None)
+    quiet = parse_quiet_hours(quiet_hours)
+    batch_size = batch_size or getattr(settings, "FCM_MESSAGING_CAMPAIGN_BATCH_SIZE", DEFAULT_CAMPAIGN_BATCH_SIZE)
+    usernames = list(dict.fromkeys(username for username in usernames if username))
+
+    default = default_timezone()
+    buckets = {}
+    if by_timezone:
+        names = user_timezones(usernames)
+        for username in usernames:
+            zone = get_zone(names.get(username), default)
+            buckets.setdefault(zone.key, (zone, []))[1].append(username)
+    else:
+        buckets[default.key] = (default, usernames)
+
+    now = timezone.now()
+    with transaction.atomic():
+        campaign = Campaign.objects.create(
+            title=title,
+            body=body,
+            starts_at=starts_at,
+            window=window,
+            by_timezone=by_timezone,
+            quiet_start=quiet[0] if quiet else None,
+            quiet_end=quiet[1] if quiet else None,
+            recipient_count=len(usernames),
+        )
+        batches = []
+        for zone, bucket in buckets.values():
+            start, length = bucket_window(starts_at, window, zone, by_timezone, now)
+            bucket_batches = list(chunked(bucket, batch_size))
+            for batch, due_at in zip(bucket_batches, release_times(start, length, len(bucket_batches), zone, quiet)):
+                batches.append(
+                    ScheduledNotification(
+                        kind="usernames",
+                        payload={"title": title, "body": body, "usernames": batch},
+                        send_at=due_at,
+                        due_at=due_at,
+                        campaign=campaign,
+                    )
+                )
+        ScheduledNotification.objects.bulk_create(batches, batch_size=1000)
+        campaign.batch_count = len(batches)
+        campaign.save(update_fields=["batch_count"])
+    return campaign
+
+
+def cancel_campaign(campaign):
+    """Cancels the batches of a campaign that were not released yet and returns how many."""
+    return campaign.batches.filter(status=ScheduledNotification.Status.SCHEDULED).update(
+        status=ScheduledNotification.Status.CANCELLED, finished_at=timezone.now()
+    )
+
+
+def campaign_progress(campaign):
+    """Batch counts per status, delivery counts so far, next release time and overall status of a campaign."""
+    Status = ScheduledNotification.Status
+    batches = dict.fromkeys(Status.values, 0)
+    success_count = failure_count = 0
+    rows = (
+        campaign.batches.order_by()
+        .values("status")
+        .annotate(count=Count("id"), success=Sum("success_count"), failure=Sum("failure_count"))
+    )
+    for row in rows:
+        batches[row["status"]] = row["count"]
+        success_count += row["success"] or 0
+        failure_count += row["failure"] or 0
+
+    if batches[Status.SCHEDULED] + batches[Status.RUNNING] == 0:
+        campaign_status = "cancelled" if batches[Status.CANCELLED] else "finished"
+    elif batches[Status.SUCCEEDED] + batches[Status.FAILED] + batches[Status.RUNNING] == 0:
+        campaign_status = "scheduled"
+    else:
+        campaign_status = "running"
+
+    return {
+        "status": campaign_status,
+        "batches": batches,
+        "success_count": success_count,
+        "failure_count": failure_count,
+        "next_release_at": campaign.batches.filter(status=Status.SCHEDULED).aggregate(next=Min("due_at"))["next"],
+    }
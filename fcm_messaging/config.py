@@ -0,0 +1,70 @@
+"""
+Public Firebase web config served to clients bootstrapping messaging.
+The config is cached in the process and in the shared Django cache together with its ETag, and both are
+invalidated once a saved FCMCertificate is committed (see signals.py). Every request only reads the current
+ETag from the shared cache to check that the copy held by the process is still current. The shared entries
+expire after FIREBASE_CONFIG_CACHE_TIMEOUT in any case, so a copy loaded during a concurrent save does not
+outlive it for long.
+"""
+
+import hashlib
+import json
+import threading
+
+from django.core.cache import cache
+
+from .models import FCMCertificate
+
+FIREBASE_CONFIG_CACHE_KEY = "fcm_messaging:firebase_config"
+FIREBASE_CONFIG_ETAG_CACHE_KEY = "fcm_messaging:firebase_config_etag"
+FIREBASE_CONFIG_CACHE_TIMEOUT = 3600
+
+# process-wide copy of the cached config entry
+_firebase_config = {"entry": None}
+_firebase_config_lock = threading.Lock()
+
+
+def _load_firebase_config():
+    cert_instance = FCMCertificate.objects.first()
+    if cert_instance is None:
+        return None
+    data = {
+        "firebase_config": cert_instance.firebase_config,
+        "vapid_key": cert_instance.vapid_key,
+    }
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return {
+        "data": data,
+        "etag": f'"{digest[:32]}"',
+        "last_modified": int(cert_instance.updated_at.timestamp()) if cert_instance.updated_at else None,
+    }
+
+
+def get_firebase_config():
+    """
+    Returns the cached config entry: a dict with the response `data`, its `etag` and `last_modified`
+    timestamp, or None when no certificate is configured.
+    """
+    etag = cache.get(FIREBASE_CONFIG_ETAG_CACHE_KEY)
+    entry = _firebase_config["entry"]
+    if etag is not None and entry is not None and entry["etag"] == etag:
+        return entry
+
+    with _firebase_config_lock:
+        entry = cache.get(FIREBASE_CONFIG_CACHE_KEY)
+        if entry is None or entry["etag"] != etag:
+            entry = _load_firebase_config()
+            if entry is None:
+                return None
+            cache.set_many(
+                {FIREBASE_CONFIG_CACHE_KEY: entry, FIREBASE_CONFIG_ETAG_CACHE_KEY: entry["etag"]},
+                FIREBASE_CONFIG_CACHE_TIMEOUT,
+            )
+        _firebase_config["entry"] = entry
+    return entry
+
+
+def invalidate_firebase_config():
+    """Drops the cached config so every process reloads it on its next request."""
+    cache.delete_many([FIREBASE_CONFIG_CACHE_KEY, FIREBASE_CONFIG_ETAG_CACHE_KEY])
+    _firebase_config["entry"] = None
@@ -0,0 +1,155 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+
+from .audience import invalidate_audience_cache
+from .models import TopicMembership, UserDevice
+from .topics import memberships_by_device
+from .utils import manage_topic
+
+logger = logging.getLogger(__name__)
+
+# Optional fields of a device registration, in addition to username, uuid and token
+DEVICE_FIELDS = ["platform", "is_dashboard_login", "is_active", "os_version", "device_model", "timezone", "locale"]
+BULK_UPSERT_BATCH_SIZE = 1000
+
+
+def bulk_upsert_devices(records):
+    """
+    Registers or updates devices in bulk.
+    - records: list of dicts with username, uuid, token and any of DEVICE_FIELDS
+    The last record wins when several records share a token or a (username, uuid) device. A token that moves
+    to another user or device is reassigned atomically: the device row holding the token is updated and any
+    other row of the target device is replaced. Optional fields left out keep their stored value, is_active
+    defaults to True since a registered token is live. The records are written in batches, all in a single
+    transaction: a failing batch leaves none of them applied. The audience cache of every affected username
+    is invalidated once the transaction is committed, and the topic subscriptions of the changed tokens are
+    updated (see TopicCalls). Returns (upserted, replaced) counts.
+    """
+    by_token = {record["token"]: record for record in records}
+    by_device = {(record["username"], record["uuid"]): record for record in by_token.values()}
+    records = list(by_device.values())
+
+    upserted = replaced = 0
+    usernames = set()
+    topic_calls = TopicCalls()
+    with transaction.atomic():
+        for start in range(0, len(records), BULK_UPSERT_BATCH_SIZE):
+            batch = records[start : start + BULK_UPSERT_BATCH_SIZE]
+            batch_replaced, batch_usernames = _upsert_batch(batch, topic_calls)
+            upserted += len(batch)
+            replaced += batch_replaced
+            usernames |= batch_usernames
+        # after the commit, so that a concurrent send cannot cache the devices as they were before it
+        transaction.on_commit(lambda: invalidate_audience_cache(usernames))
+        transaction.on_commit(topic_calls.run)
+    return upserted, replaced
+
+
+def _upsert_batch(records, topic_calls):
+    tokens = [record["token"] for record in records]
+    devices = {(record["username"], record["uuid"]) for record in records}
+
+    existing_by_token = {row["token"]: row for row in UserDevice.objects.filter(token__in=tokens).values()}
+    existing_by_device = {
+        (row["username"], row["uuid"]): row
+        for row in UserDevice.objects.filter(username__in={username for username, _ in devices}).values()
+        if (row["username"], row["uuid"]) in devices
+    }
+
+    moved, other = [], []
+    replaced_ids = []
+    detached_ids = []  # rows whose token leaves the device it was subscribed for
+    rotated = {}  # device id: new token
+    for record in records:
+        device = (record["username"], record["uuid"])
+        current = existing_by_device.get(device)
+        if record["token"] in existing_by_token:
+            # the token row is moved to this device, a different row of the device would violate (username, uuid)
+            if current and current["token"] != record["token"]:
+                replaced_ids.append(current["id"])
+            token_row = existing_by_token[record["token"]]
+            if (token_row["username"], token_row["uuid"]) != device:
+                detached_ids.append(token_row["id"])
+            moved.append(_build_device(record, current or token_row))
+        else:
+            # new device or a token rotation of an existing one
+            if current:
+                rotated[current["id"]] = record["token"]
+            other.append(_build_device(record, current))
+
+    topic_calls.detach(replaced_ids + detached_ids)
+    topic_calls.rotate(rotated)
+    if replaced_ids:
+        UserDevice.objects.filter(id__in=replaced_ids).delete()
+    # the previous owners of moved tokens lose them
+    usernames = {username for username, _ in devices} | {row["username"] for row in existing_by_token.values()}
+
+    update_fields = ["username", "uuid", "token", *DEVICE_FIELDS, "updated_at"]
+    if moved:
+        UserDevice.objects.bulk_create(
+            moved,
+            update_conflicts=True,
+            unique_fields=["token"],
+            update_fields=[f for f in update_fields if f != "token"],
+        )
+    if other:
+        UserDevice.objects.bulk_create(
+            other,
+            update_conflicts=True,
+            unique_fields=["username", "uuid"],
+            update_fields=[f for f in update_fields if f not in ("username", "uuid")],
+        )
+    return len(replaced_ids), usernames
+
+
+class TopicCalls:
+    """
+    Topic (un)subscriptions following token changes, collected while the devices are written and made
+    once they are committed:
+    - a device whose token rotated is subscribed with its new token and its old token is unsubscribed
+    - a token moving to another user or device, or whose device row is replaced, is unsubscribed and the
+      memberships it was subscribed for are dropped right away, so that the new owner never inherits them
+    Memberships left stale by a failed call are re-subscribed by fcm_reconcile_topics.
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(list)  # (action, topic): tokens
+
+    def detach(self, device_ids):
+        for memberships in memberships_by_device(device_ids).values():
+            for topic, token in memberships:
+                self.calls["unsubscribe", topic].append(token)
+        TopicMembership.objects.filter(device_id__in=device_ids).delete()
+
+    def rotate(self, new_tokens):
+        """new_tokens: the new token of every device id whose token rotated."""
+        for device_id, memberships in memberships_by_device(list(new_tokens)).items():
+            for topic, token in memberships:
+                self.calls["subscribe", topic].append(new_tokens[device_id])
+                self.calls["unsubscribe", topic].append(token)
+
+    def run(self):
+        for (action, topic), tokens in self.calls.items():
+            try:
+                manage_topic(action, topic, tokens)
+            except Exception:
+                logger.exception("Failed to %s %s tokens to topic %s", action, len(tokens), topic)
+
+
+def update_topic_subscriptions(device_id, new_token):
+    """Moves the topic subscriptions of a device to its new token once the change is committed."""
+    topic_calls = TopicCalls()
+    topic_calls.rotate({device_id: new_token})
+    transaction.on_commit(topic_calls.run)
+
+
+def _build_device(record, current):
+    values = {"username": record["username"], "uuid": record["uuid"], "token": record["token"], "is_active": True}
+    for field in DEVICE_FIELDS:
+        if field in record:
+            values[field] = record[field]
+        elif current and field != "is_active":
+            values[field] = current[field]
+    return UserDevice(**values)
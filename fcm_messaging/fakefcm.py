@@ -0,0 +1,237 @@
+"""
+Local stand-in for the FCM HTTP v1 send and topic subscription endpoints, to run the send path end to
+end without Firebase, e.g. for benchmarks (see the `fcm_benchmark` command) or a staging stack. Faults
+are injected per request:
+
+    FakeFCMServer(
+        latency=0.0,  # seconds added to every request
+        jitter=0.0,  # up to this many extra seconds, uniformly distributed
+        error_rate=0.0,  # share of tokens rejected as UNREGISTERED, when sending and in topic management
+        unavailable_rate=0.0,  # share of requests failing with 503 UNAVAILABLE
+        burst_every=0,  # out of every `burst_every` requests, the last `burst_length` ones ...
+        burst_length=0,  # ... fail with 429 QUOTA_EXCEEDED
+        retry_after=1,  # Retry-After of the 429 responses, in seconds
+        seed=None,
+    )
+
+Run it with `python manage.py fcm_fake_server` and pass its URL to `fcm_benchmark --fake-url`, or point
+an app at it in tests with `firebase_app_override(fake_firebase_app(url))`. Requests to the fake server
+are not authenticated. The plugin's own Firebase app never sends to it.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import firebase_admin
+from firebase_admin import credentials, messaging
+from google.auth.credentials import AnonymousCredentials
+
+from . import utils
+from .transport import FCM_HOST, configure_transport, transport_options
+
+FAKE_FCM_APP_NAME = "fcm_messaging-fake"
+
+DEFAULT_FAKE_FCM = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "error_rate": 0.0,
+    "unavailable_rate": 0.0,
+    "burst_every": 0,
+    "burst_length": 0,
+    "retry_after": 1,
+    "seed": None,
+}
+
+
+def fcm_error(status_code, status, error_code, message):
+    """Error body of the FCM HTTP v1 API, as parsed by the Admin SDK."""
+    return {
+        "error": {
+            "code": status_code,
+            "message": message,
+            "status": status,
+            "details": [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": error_code}],
+        }
+    }
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        path = urlsplit(self.path).path
+        fault = self.server.delay_and_pick_fault()
+
+        if fault == "quota":
+            body = fcm_error(429, "RESOURCE_EXHAUSTED", "QUOTA_EXCEEDED", "Quota exceeded.")
+            self._reply(429, body, {"Retry-After": str(self.server.options["retry_after"])})
+        elif fault == "unavailable":
+            self._reply(503, fcm_error(503, "UNAVAILABLE", "UNAVAILABLE", "The service is currently unavailable."))
+        elif method == "POST" and path.endswith("/messages:send"):
+            self._send_message(path)
+        elif "/registrations/" in path and "/topicSubscriptions" in path:
+            self._manage_topic()
+        else:
+            self._reply(404, fcm_error(404, "NOT_FOUND", "UNSPECIFIED_ERROR", f"Unknown path {path}."))
+
+    def _send_message(self, path):
+        if self.server.token_rejected():
+            self._reply(404, fcm_error(404, "NOT_FOUND", "UNREGISTERED", "Requested entity was not found."))
+            return
+        project = path.split("/")[3]
+        self._reply(200, {"name": f"projects/{project}/messages/{self.server.next_message_id()}"})
+
+    def _manage_topic(self):
+        # the v1 topic API (un)subscribes one token per request
+        if self.server.token_rejected():
+            self._reply(404, fcm_error(404, "NOT_FOUND", "UNREGISTERED", "Requested entity was not found."))
+            return
+        self._reply(200, {})
+
+    def _reply(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeFCMServer(ThreadingHTTPServer):
+    """Threaded fake FCM server, see the module docstring for the options."""
+
+    daemon_threads = True
+    # the default backlog of 5 resets connections under concurrent sends
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        super().__init__((host, port), FakeFCMHandler)
+        self.options = {**DEFAULT_FAKE_FCM, **{k: v for k, v in options.items() if v is not None}}
+        self.random = random.Random(self.options["seed"])
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves requests from a background thread and returns the URL of the server."""
+        threading.Thread(target=self.serve_forever, name="fake-fcm", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def delay_and_pick_fault(self):
+        """Sleeps for the configured latency and returns the fault of a request: None, "quota" or "unavailable"."""
+        options = self.options
+        with self._lock:
+            index = self.stats["requests"]
+            self.stats["requests"] += 1
+            delay = options["latency"] + self.random.uniform(0, options["jitter"])
+            burst_every = options["burst_every"]
+            fault = None
+            if burst_every and index % burst_every >= burst_every - options["burst_length"]:
+                fault = "quota"
+            elif self.random.random() < options["unavailable_rate"]:
+                fault = "unavailable"
+            self.stats[fault or "served"] += 1
+        if delay:
+            time.sleep(delay)
+        return fault
+
+    def token_rejected(self):
+        with self._lock:
+            rejected = self.random.random() < self.options["error_rate"]
+            if rejected:
+                self.stats["rejected_tokens"] += 1
+        return rejected
+
+    def next_message_id(self):
+        with self._lock:
+            self.stats["messages"] += 1
+            return self.stats["messages"]
+
+
+class AnonymousCredential(credentials.Base):
+    """Firebase credential that does not authenticate requests, for apps talking to a fake server."""
+
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+def use_fake_fcm(app, url):
+    """
+    Points the messaging service of a Firebase app at a fake FCM server and stops authenticating its requests.
+    Only this app is affected, for sends as well as topic management.
+    """
+    service = messaging._get_messaging_service(app)
+    service._fcm_url = f"{url}/v1/projects/{service._project_id}/messages:send"
+    service._fcm_topic_url = f"{url}/v1/projects/{service._project_id}/registrations"
+
+    session = service._client.session
+    session.credentials = AnonymousCredentials()
+    # keep the pool and retry policy of configure_transport
+    session.mount(url, session.get_adapter(FCM_HOST))
+    service._async_client._async_client.auth = None
+
+
+@contextmanager
+def firebase_app_override(app):
+    """Makes every send of this process use `app` instead of the app of the stored certificate."""
+    get_app = utils._get_firebase_app
+    utils._get_firebase_app = lambda: (app, None)
+    try:
+        yield app
+    finally:
+        utils._get_firebase_app = get_app
+
+
+def fake_firebase_app(url, name=FAKE_FCM_APP_NAME):
+    """Creates a Firebase app that sends to a fake FCM server, no certificate needed."""
+    app = firebase_admin.initialize_app(
+        AnonymousCredential(),
+        options={"projectId": "fake-project", "httpTimeout": transport_options()["timeout"]},
+        name=name,
+    )
+    configure_transport(app)
+    use_fake_fcm(app, url)
+    return app
+
+
+def add_fake_fcm_arguments(parser):
+    """Command line options of the fake server faults, shared by the commands starting one."""
+    parser.add_argument("--latency", type=float, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, help="Up to this many extra seconds per request.")
+    parser.add_argument("--error-rate", type=float, help="Share of tokens rejected as UNREGISTERED.")
+    parser.add_argument("--unavailable-rate", type=float, help="Share of requests failing with 503.")
+    parser.add_argument("--burst-every", type=int, help="Length of the 429 burst cycle, in requests.")
+    parser.add_argument("--burst-length", type=int, help="Requests failing with 429 per cycle.")
+    parser.add_argument("--retry-after", type=int, help="Retry-After of the 429 responses, in seconds.")
+    parser.add_argument("--seed", type=int, help="Seed of the fault injection.")
+
+
+def fake_fcm_options(options):
+    return {name: options.get(name) for name in DEFAULT_FAKE_FCM}
@@ -0,0 +1,202 @@
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SendJob
+from .utils import (
+    reporting_progress,
+    send_message_admin,
+    send_message_template,
+    send_message_token,
+    send_message_tokens,
+    send_message_topic,
+    send_message_usernames,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds without progress after which a running job is considered abandoned by its worker
+DEFAULT_JOB_TIMEOUT = 900
+# Claims after which an abandoned job fails instead of being queued again
+DEFAULT_JOB_MAX_ATTEMPTS = 3
+# Seconds between two writes of the counts of a running job
+PROGRESS_INTERVAL = 1.0
+# Distinct errors kept in the stored result of a job
+MAX_RESULT_ERRORS = 10
+
+# Execution step of every job kind, called with the job payload
+SEND_FUNCTIONS = {
+    "tokens": lambda p: send_message_tokens(p["title"], p["body"], p["tokens"]),
+    "token": lambda p: send_message_token(p["title"], p["body"], p["token"]),
+    "usernames": lambda p: send_message_usernames(p["title"], p["body"], p["usernames"]),
+    "admin": lambda p: send_message_admin(p["title"], p["body"]),
+    "group": lambda p: send_message_topic(p["title"], p["body"], p["topic"]),
+    "template": lambda p: send_message_template(
+        p["template_id"], p.get("tokens"), p.get("usernames"), p.get("context"), p.get("variables")
+    ),
+}
+
+
+def enqueue_send_job(kind, **payload):
+    """Queues a send for the `fcm_send_worker` command and returns the SendJob."""
+    if kind not in SEND_FUNCTIONS:
+        raise ValueError(f"Unknown send job kind: {kind}")
+    return SendJob.objects.create(kind=kind, payload=payload, total_count=expected_count(kind, payload))
+
+
+def expected_count(kind, payload):
+    """Number of messages a send will make, None when it depends on the devices registered at send time."""
+    if kind == "tokens":
+        return len(payload["tokens"])
+    elif kind == "template" and payload.get("usernames") is None:
+        return len(payload.get("tokens") or [])
+    elif kind in ("token", "group"):
+        return 1
+    return None
+
+
+def execute_send(kind, payload):
+    """Runs the send function of a job kind and returns its (success, detail) result."""
+    return SEND_FUNCTIONS[kind](payload)
+
+
+def claim_send_jobs(limit):
+    """
+    Marks up to `limit` pending jobs as running and returns them.
+    Rows locked by another worker are skipped, so several workers can drain the queue in parallel.
+    Jobs abandoned by a worker that stopped are queued again first (see reclaim_stale_jobs).
+    """
+    reclaim_stale_jobs(SendJob, SendJob.Status.PENDING)
+    with transaction.atomic():
+        job_ids = list(
+            SendJob.objects.select_for_update(skip_locked=True)
+            .filter(status=SendJob.Status.PENDING)
+            .order_by("id")
+            .values_list("id", flat=True)[:limit]
+        )
+        claim_jobs(SendJob.objects.filter(id__in=job_ids))
+    return list(SendJob.objects.filter(id__in=job_ids).order_by("id"))
+
+
+def claim_jobs(queryset):
+    """Marks the jobs of `queryset` as running for a new attempt, with their counts reset."""
+    now = timezone.now()
+    return queryset.update(
+        status=queryset.model.Status.RUNNING,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F("attempts") + 1,
+        success_count=0,
+        failure_count=0,
+    )
+
+
+def reclaim_stale_jobs(model, requeue_status):
+    """
+    Puts back in `requeue_status` the running rows of `model` (SendJob or ScheduledNotification) without
+    progress for FCM_MESSAGING_JOB_TIMEOUT seconds, i.e. whose worker stopped. Rows claimed
+    FCM_MESSAGING_JOB_MAX_ATTEMPTS times already are marked failed instead.
+    Returns the number of rows queued again.
+    """
+    timeout = getattr(settings, "FCM_MESSAGING_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
+    max_attempts = getattr(settings, "FCM_MESSAGING_JOB_MAX_ATTEMPTS", DEFAULT_JOB_MAX_ATTEMPTS)
+    now = timezone.now()
+    stale = model.objects.filter(status=model.Status.RUNNING, heartbeat_at__lt=now - timedelta(seconds=timeout))
+
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=model.Status.FAILED,
+        finished_at=now,
+        result={"success": False, "detail": f"The worker running the send stopped {max_attempts} times."},
+    )
+    requeued = stale.update(status=requeue_status)
+    if failed or requeued:
+        logger.warning("Reclaimed %s abandoned %s rows, %s of them failed.", failed + requeued, model.__name__, failed)
+    return requeued
+
+
+class JobProgress:
+    """
+    Adds the counts of the chunks sent by a running job to its row, at most every PROGRESS_INTERVAL
+    seconds, and refreshes its heartbeat. Writes are skipped once the job was reclaimed by another worker.
+    """
+
+    def __init__(self, job):
+        self.rows = type(job).objects.filter(pk=job.pk, status=job.Status.RUNNING, attempts=job.attempts)
+        self.success_count = 0
+        self.failure_count = 0
+        self.flushed_at = time.monotonic()
+
+    def __call__(self, success_count, failure_count):
+        self.success_count += success_count
+        self.failure_count += failure_count
+        if time.monotonic() - self.flushed_at >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        success_count, failure_count = self.success_count, self.failure_count
+        self.success_count = self.failure_count = 0
+        try:
+            return self.rows.update(
+                success_count=F("success_count") + success_count,
+                failure_count=F("failure_count") + failure_count,
+                heartbeat_at=timezone.now(),
+            )
+        except Exception:
+            # Progress is informational, a failed write must not abort the send
+            logger.exception("Failed to record the progress of a send job.")
+            return None
+
+
+def run_send_job(job):
+    """
+    Executes a claimed job and records its final status, success/failure counts and a summary of its
+    result (see summarize_detail). The counts are updated as its chunks complete (see JobProgress). A job
+    reclaimed by another worker since it was claimed is skipped, and so is its final write.
+    Also runs ScheduledNotification rows, which share the fields and statuses involved.
+    """
+    progress = JobProgress(job)
+    if progress.flush() == 0:
+        logger.warning("Skipped %s, reclaimed by another worker.", job)
+        return job
+
+    try:
+        with reporting_progress(progress):
+            success, detail = execute_send(job.kind, job.payload)
+    except Exception as e:
+        success, detail = False, f"Notification sending failed: {str(e)}"
+
+    if isinstance(detail, dict) and "success_count" in detail:
+        job.success_count = detail["success_count"]
+        job.failure_count = detail["failure_count"]
+        job.total_count = job.success_count + job.failure_count
+    elif job.total_count == 1:
+        job.success_count = 1 if success else 0
+        job.failure_count = 0 if success else 1
+
+    job.status = job.Status.SUCCEEDED if success else job.Status.FAILED
+    job.result = {"success": success, "detail": summarize_detail(detail)}
+    job.finished_at = timezone.now()
+    fields = ["status", "total_count", "success_count", "failure_count", "result", "finished_at"]
+    if not progress.rows.update(**{field: getattr(job, field) for field in fields}):
+        logger.warning("Dropped the result of %s, reclaimed by another worker while sending.", job)
+    return job
+
+
+def summarize_detail(detail):
+    """
+    Keeps the counts of a send result and the number of failures per error, instead of the response of
+    every token, so the stored result stays small whatever the audience size.
+    """
+    if not isinstance(detail, dict) or "responses" not in detail:
+        return detail
+    summary = {key: value for key, value in detail.items() if key.endswith("_count")}
+    errors = Counter(r["error"] for r in detail["responses"] if r["error"])
+    summary["errors"] = dict(errors.most_common(MAX_RESULT_ERRORS))
+    return summary
@@ -0,0 +1,80 @@
+import firebase_admin
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from fcm_messaging.benchmark import (
+    benchmark_tokens,
+    create_benchmark_devices,
+    delete_benchmark_data,
+    make_sender,
+    run_benchmark,
+)
+from fcm_messaging.fakefcm import (
+    FakeFCMServer,
+    add_fake_fcm_arguments,
+    fake_fcm_options,
+    fake_firebase_app,
+    firebase_app_override,
+)
+from fcm_messaging.models import FCMLog
+
+COLUMNS = [
+    "size",
+    "sends_per_sec",
+    "p50_ms",
+    "p99_ms",
+    "queries_per_send",
+    "peak_memory_mb",
+    "success",
+    "failure",
+    "retried",
+]
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the send path against a local fake FCM server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1,100,10000", help="Comma-separated audience sizes (up to 1000000).")
+        parser.add_argument("--repeat", type=int, default=3, help="Timed sends per audience size.")
+        parser.add_argument("--audience", choices=["tokens", "usernames"], default="tokens")
+        parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio send path.")
+        parser.add_argument("--view", action="store_true", help="Send through the send views instead of utils.")
+        parser.add_argument("--fake-url", help="URL of a running fcm_fake_server, instead of an in-process one.")
+        parser.add_argument("--keep-data", action="store_true", help="Keep the benchmark devices and FCM logs.")
+        add_fake_fcm_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of integers.")
+
+        server = None
+        url = options["fake_url"]
+        if not url:
+            server = FakeFCMServer(**fake_fcm_options(options))
+            url = server.start()
+        app = fake_firebase_app(url)
+        last_log = FCMLog.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+        self.stdout.write("\t".join(COLUMNS))
+        try:
+            # logs are written inline so their queries and memory count towards the send
+            with firebase_app_override(app), override_settings(FCM_MESSAGING_ASYNC_LOG=False):
+                for size in sizes:
+                    if options["audience"] == "usernames":
+                        delete_benchmark_data()
+                        recipients = create_benchmark_devices(size)
+                    else:
+                        recipients = benchmark_tokens(size)
+                    send = make_sender(options["audience"], recipients, options["use_async"], options["view"])
+                    result = run_benchmark(send, size, options["repeat"])
+                    self.stdout.write("\t".join(str(result[column]) for column in COLUMNS))
+        finally:
+            firebase_admin.delete_app(app)
+            if server is not None:
+                server.stop()
+                self.stdout.write(f"Fake FCM server: {dict(server.stats)}")
+            if not options["keep_data"]:
+                delete_benchmark_data(after_log_id=last_log)
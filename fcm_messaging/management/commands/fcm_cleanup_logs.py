@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from fcm_messaging.retention import DEFAULT_CLEANUP_BATCH_SIZE, cleanup_fcm_logs
+
+
+class Command(BaseCommand):
+    help = "Deletes FCM logs older than the retention window, optionally rolling them up into daily totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Retention window, defaults to FCM_MESSAGING_LOG_RETENTION_DAYS.")
+        parser.add_argument(
+            "--batch-size", type=int, default=DEFAULT_CLEANUP_BATCH_SIZE, help="Rows deleted per transaction."
+        )
+        parser.add_argument("--rollup", action="store_true", help="Add the deleted rows to the daily aggregates.")
+        parser.add_argument("--interval", type=float, help="Keep running and clean up every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            # drop connections broken or past CONN_MAX_AGE, as the request cycle does
+            close_old_connections()
+            deleted = cleanup_fcm_logs(days=options["days"], batch_size=options["batch_size"], rollup=options["rollup"])
+            self.stdout.write(f"Deleted {deleted} FCM logs")
+
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
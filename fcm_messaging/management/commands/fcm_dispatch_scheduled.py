@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from fcm_messaging.jobs import run_send_job
+from fcm_messaging.scheduling import claim_due_notifications, next_due_at
+
+
+class Command(BaseCommand):
+    help = "Sends the scheduled notifications as they come due."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10, help="Number of due notifications claimed at once.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Longest wait when nothing is due.")
+        parser.add_argument("--once", action="store_true", help="Exit once nothing is due.")
+
+    def handle(self, *args, **options):
+        while True:
+            # drop connections broken or past CONN_MAX_AGE, as the request cycle does
+            close_old_connections()
+            notifications = claim_due_notifications(options["batch_size"])
+            if not notifications:
+                if options["once"]:
+                    return
+                due_at = next_due_at()
+                wait = options["sleep"]
+                if due_at is not None:
+                    wait = min(max((due_at - timezone.now()).total_seconds(), 0), wait)
+                time.sleep(wait)
+                continue
+
+            for notification in notifications:
+                notification = run_send_job(notification)
+                counts = f"{notification.success_count} sent, {notification.failure_count} failed"
+                self.stdout.write(f"{notification}: {counts}")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from fcm_messaging.fakefcm import FakeFCMServer, add_fake_fcm_arguments, fake_fcm_options
+
+
+class Command(BaseCommand):
+    help = "Runs a local fake of the FCM send and topic management endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        add_fake_fcm_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = FakeFCMServer(options["host"], options["port"], **fake_fcm_options(options))
+        self.stdout.write(f"Fake FCM server listening on {server.url}, pass it to fcm_benchmark --fake-url")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.stats['requests']} requests")
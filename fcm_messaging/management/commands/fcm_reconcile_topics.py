@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from fcm_messaging.topics import stale_topic_memberships
+from fcm_messaging.utils import manage_topic
+
+
+class Command(BaseCommand):
+    help = "Re-subscribes devices whose token changed since they were subscribed to a topic."
+
+    def handle(self, *args, **options):
+        topics = stale_topic_memberships().values_list("topic", flat=True).distinct()
+        for topic in list(topics):
+            tokens = list(stale_topic_memberships().filter(topic=topic).values_list("device__token", flat=True))
+            success, detail = manage_topic("subscribe", topic, tokens)
+            if isinstance(detail, dict):
+                self.stdout.write(f"{topic}: {detail['success_count']} re-subscribed, {detail['failure_count']} failed")
+            else:
+                self.stderr.write(f"{topic}: {detail}")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from fcm_messaging.jobs import claim_send_jobs, run_send_job
+
+
+class Command(BaseCommand):
+    help = "Drains the queue of notification send jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10, help="Number of jobs claimed at once.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            # drop connections broken or past CONN_MAX_AGE, as the request cycle does
+            close_old_connections()
+            jobs = claim_send_jobs(options["batch_size"])
+            if not jobs:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            for job in jobs:
+                job = run_send_job(job)
+                self.stdout.write(f"{job}: {job.success_count} sent, {job.failure_count} failed")
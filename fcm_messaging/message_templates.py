@@ -0,0 +1,245 @@
+"""
+NotificationTemplates compiled into reusable `messaging` objects. A template is compiled once per process
+(its platform configs and the notification of every variant that has no $variables left) and kept until
+it is saved again, which the NotificationTemplate signals publish through the shared cache once the save is
+committed. The published versions expire after TEMPLATE_VERSION_CACHE_TIMEOUT, after which every process
+checks its copy against the database again.
+
+A send binds the compiled template to its `context`, the variables common to the whole send, and only the
+variables of every recipient (e.g. $username) are substituted per token. Chunks whose tokens all get the
+same content are still sent as one MulticastMessage.
+"""
+
+import threading
+from itertools import islice
+from string import Template
+
+from django.core.cache import cache
+from firebase_admin import messaging
+
+from .models import NotificationTemplate, UserDevice
+
+TEMPLATE_VERSION_CACHE_KEY = "fcm_messaging:template_version:{}"
+TEMPLATE_VERSION_CACHE_TIMEOUT = 3600
+
+# keys of the platform overrides passed on to the notification of each platform
+ANDROID_NOTIFICATION_FIELDS = ("channel_id", "image", "icon", "color", "sound", "tag", "click_action")
+APS_FIELDS = ("badge", "sound", "category", "thread_id", "mutable_content", "content_available")
+WEBPUSH_NOTIFICATION_FIELDS = ("icon", "image", "badge", "tag", "require_interaction")
+
+# process-wide compiled templates by id
+_compiled_templates = {}
+_compiled_templates_lock = threading.Lock()
+
+
+def _pick(options, fields):
+    return {field: options[field] for field in fields if options.get(field) is not None}
+
+
+def android_config(options):
+    if not options:
+        return None
+    notification = _pick(options, ANDROID_NOTIFICATION_FIELDS)
+    return messaging.AndroidConfig(
+        collapse_key=options.get("collapse_key"),
+        priority=options.get("priority"),
+        ttl=options.get("ttl"),
+        notification=messaging.AndroidNotification(**notification) if notification else None,
+    )
+
+
+def apns_config(options):
+    if not options:
+        return None
+    aps = _pick(options, APS_FIELDS)
+    return messaging.APNSConfig(
+        headers=options.get("headers"),
+        payload=messaging.APNSPayload(aps=messaging.Aps(**aps)) if aps else None,
+        fcm_options=messaging.APNSFCMOptions(image=options["image"]) if options.get("image") else None,
+    )
+
+
+def webpush_config(options):
+    if not options:
+        return None
+    notification = _pick(options, WEBPUSH_NOTIFICATION_FIELDS)
+    return messaging.WebpushConfig(
+        headers=options.get("headers"),
+        notification=messaging.WebpushNotification(**notification) if notification else None,
+        fcm_options=messaging.WebpushFCMOptions(link=options["link"]) if options.get("link") else None,
+    )
+
+
+def has_variables(text):
+    return Template.pattern.search(text) is not None
+
+
+class CompiledVariant:
+    """Title, body and data of one locale, with the Notification prebuilt when nothing is left to substitute."""
+
+    def __init__(self, title, body, data, image):
+        self.title = Template(title)
+        self.body = Template(body)
+        self.data = {key: Template(str(value)) for key, value in data.items()}
+        self.image = image
+        self.static = not any(has_variables(text) for text in [title, body, *map(str, data.values())])
+        self.notification = None
+        self.static_data = None
+        if self.static:
+            self.notification = messaging.Notification(title=title, body=body, image=image)
+            self.static_data = {key: str(value) for key, value in data.items()} or None
+
+    def bind(self, context):
+        """The variant with the variables of `context` substituted."""
+        if self.static or not context:
+            return self
+        return CompiledVariant(
+            self.title.safe_substitute(context),
+            self.body.safe_substitute(context),
+            {key: value.safe_substitute(context) for key, value in self.data.items()},
+            self.image,
+        )
+
+    def render(self, variables):
+        """Notification and data of one recipient."""
+        if self.static:
+            return self.notification, self.static_data
+        notification = messaging.Notification(
+            title=self.title.safe_substitute(variables), body=self.body.safe_substitute(variables), image=self.image
+        )
+        return notification, {key: value.safe_substitute(variables) for key, value in self.data.items()} or None
+
+
+class CompiledTemplate:
+    def __init__(self, template, variants, version):
+        self.id = template.pk
+        self.name = template.name
+        self.version = version
+        self.default_locale = template.default_locale.lower()
+        self.variants = {
+            variant.locale.lower(): CompiledVariant(variant.title, variant.body, template.data, template.image)
+            for variant in variants
+        }
+        if not self.variants:
+            raise ValueError(f"Notification template {template.name!r} has no variants.")
+        # fail on invalid platform overrides now rather than on every chunk: serializing a Message encodes
+        # it like a send does
+        try:
+            self.android = android_config(template.android)
+            self.apns = apns_config(template.apns)
+            self.webpush = webpush_config(template.webpush)
+            str(messaging.Message(topic="validation", android=self.android, apns=self.apns, webpush=self.webpush))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Notification template {template.name!r} has invalid platform overrides: {e}") from e
+
+    @property
+    def localized(self):
+        return len(self.variants) > 1
+
+    def default_variant(self):
+        return self.variants.get(self.default_locale) or next(iter(self.variants.values()))
+
+    def variant(self, locale):
+        """Variant of a locale, falling back to its language (pt-BR to pt) and then to the default locale."""
+        if locale:
+            locale = locale.lower().replace("_", "-")
+            variant = self.variants.get(locale) or self.variants.get(locale.split("-")[0])
+            if variant is not None:
+                return variant
+        return self.default_variant()
+
+    def bind(self, context):
+        return BoundTemplate(self, context or {})
+
+
+class BoundTemplate:
+    """A compiled template bound to the context of one send, building the messages of its chunks."""
+
+    def __init__(self, template, context):
+        self.template = template
+        self.context = context
+        self.locales = {}  # device locale by token
+        self._variants = {}
+
+    def variant(self, locale):
+        variant = self.template.variant(locale)
+        bound = self._variants.get(id(variant))
+        if bound is None:
+            bound = self._variants[id(variant)] = variant.bind(self.context)
+        return bound
+
+    def track_locales(self, tokens, chunk_size):
+        """
+        Yields the tokens of any iterable, looking up the locale of their devices one chunk ahead of the send,
+        from the thread consuming the audience. Templates with a single variant need no lookup.
+        """
+        if not self.template.localized:
+            yield from tokens
+            return
+        iterator = iter(tokens)
+        while chunk := list(islice(iterator, chunk_size)):
+            self.locales.update(device_locales(chunk))
+            yield from chunk
+
+    def build(self, tokens, variables_for):
+        """
+        Messages of a chunk of tokens: one MulticastMessage when every token gets the same content, else one
+        Message per token. `variables_for(token)` returns the variables of a recipient.
+        """
+        template = self.template
+        variants = [self.variant(self.locales.get(token)) for token in tokens]
+        first = variants[0]
+        if first.static and all(variant is first for variant in variants):
+            return messaging.MulticastMessage(
+                tokens=tokens,
+                notification=first.notification,
+                data=first.static_data,
+                android=template.android,
+                apns=template.apns,
+                webpush=template.webpush,
+            )
+
+        messages = []
+        for token, variant in zip(tokens, variants):
+            notification, data = variant.render({} if variant.static else variables_for(token))
+            messages.append(
+                messaging.Message(
+                    token=token,
+                    notification=notification,
+                    data=data,
+                    android=template.android,
+                    apns=template.apns,
+                    webpush=template.webpush,
+                )
+            )
+        return messages
+
+
+def device_locales(tokens):
+    return dict(UserDevice.objects.filter(token__in=tokens, locale__isnull=False).values_list("token", "locale"))
+
+
+def get_compiled_template(template_id):
+    """
+    Returns the CompiledTemplate of a NotificationTemplate id, compiling it when this process holds no copy
+    of its current version. Raises NotificationTemplate.DoesNotExist or ValueError for invalid templates.
+    """
+    key = TEMPLATE_VERSION_CACHE_KEY.format(template_id)
+    version = cache.get(key)
+    compiled = _compiled_templates.get(template_id)
+    if version is not None and compiled is not None and compiled.version == version:
+        return compiled
+
+    with _compiled_templates_lock:
+        template = NotificationTemplate.objects.get(pk=template_id)
+        version = template.updated_at.isoformat()
+        compiled = CompiledTemplate(template, list(template.variants.all()), version)
+        _compiled_templates[template_id] = compiled
+        cache.set(key, version, TEMPLATE_VERSION_CACHE_TIMEOUT)
+    return compiled
+
+
+def invalidate_template(template_id):
+    """Drops the compiled copies of a template so every process compiles it again on its next send."""
+    cache.delete(TEMPLATE_VERSION_CACHE_KEY.format(template_id))
+    _compiled_templates.pop(template_id, None)
@@ -0,0 +1,180 @@
+"""
+Timings of the phases of a send and counters of the tokens it handled, reported to a pluggable backend:
+
+    FCM_MESSAGING_METRICS = "fcm_messaging.metrics.PrometheusMetrics"  # dotted path of the backend, None to disable
+
+A backend implements `observe(phase, seconds)` and `increment(counter, value)`. The phases are
+firebase_app, audience (resolving and normalizing the tokens), build (message construction), rate_limit
+(waiting for capacity), fcm_round_trip (per chunk), log_write and prune. The counters are sent, failed,
+retried and pruned tokens.
+The default PrometheusMetrics keeps histograms and counters in the process and renders them in the
+Prometheus text format for the `metrics/` endpoint, so every worker process is scraped separately.
+"""
+
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_METRICS = "fcm_messaging.metrics.PrometheusMetrics"
+
+COUNTERS = ("sent", "failed", "retried", "pruned")
+
+# upper bounds in seconds of the histogram buckets, from a cached audience lookup to a throttled 500-token chunk
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# process-wide backend and the setting it was created from
+_metrics = {"path": None, "backend": None}
+_metrics_lock = threading.Lock()
+
+
+class MetricsBackend:
+    """Interface of the metrics backends, the base implementation drops everything."""
+
+    def observe(self, phase, seconds):
+        pass
+
+    def increment(self, counter, value=1):
+        pass
+
+
+class PrometheusMetrics(MetricsBackend):
+    """In-process histograms of the phase timings and token counters, rendered in the Prometheus text format."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}  # phase: {"buckets": per-bucket (non-cumulative) counts, "sum", "count"}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._histograms[phase] = histogram
+            histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def increment(self, counter, value=1):
+        if value:
+            with self._lock:
+                self._counters[counter] += value
+
+    def render(self):
+        with self._lock:
+            histograms = {
+                phase: {**histogram, "buckets": list(histogram["buckets"])}
+                for phase, histogram in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP fcm_messaging_phase_seconds Duration of the phases of FCM sends.",
+            "# TYPE fcm_messaging_phase_seconds histogram",
+        ]
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for phase, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, histogram["buckets"]):
+                cumulative += count
+                lines.append(f'fcm_messaging_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'fcm_messaging_phase_seconds_sum{{phase="{phase}"}} {histogram["sum"]:.6f}')
+            lines.append(f'fcm_messaging_phase_seconds_count{{phase="{phase}"}} {histogram["count"]}')
+
+        lines += [
+            "# HELP fcm_messaging_tokens_total Tokens handled by FCM sends, by outcome.",
+            "# TYPE fcm_messaging_tokens_total counter",
+        ]
+        for counter in sorted({*COUNTERS, *counters}):
+            lines.append(f'fcm_messaging_tokens_total{{outcome="{counter}"}} {counters.get(counter, 0)}')
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics():
+    """Returns the metrics backend of this process, None when metrics are disabled."""
+    path = getattr(settings, "FCM_MESSAGING_METRICS", DEFAULT_METRICS)
+    if path != _metrics["path"]:
+        with _metrics_lock:
+            if path != _metrics["path"]:
+                _metrics.update(path=path, backend=import_string(path)() if path else None)
+    return _metrics["backend"]
+
+
+@contextmanager
+def timed(phase):
+    """Observes the time spent in the block as `phase`."""
+    backend = get_metrics()
+    if backend is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        backend.observe(phase, time.perf_counter() - started)
+
+
+def timed_iter(items, phase):
+    """
+    Yields the items of any iterable and, once it is exhausted, observes the time spent producing them as
+    `phase`. Used on lazily resolved audiences, whose queries run while the send consumes them.
+    """
+    backend = get_metrics()
+    if backend is None:
+        yield from items
+        return
+    iterator = iter(items)
+    elapsed = 0.0
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - started
+        yield item
+    backend.observe(phase, elapsed)
+
+
+async def atimed_iter(items, phase):
+    """Async version of `timed_iter`, for async iterables."""
+    backend = get_metrics()
+    iterator = items.__aiter__()
+    elapsed = 0.0
+    while True:
+        started = time.perf_counter()
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - started
+        yield item
+    if backend is not None:
+        backend.observe(phase, elapsed)
+
+
+def increment(counter, value=1):
+    backend = get_metrics()
+    if backend is not None:
+        backend.increment(counter, value)
+
+
+def record_sends(response):
+    """Counts the sent, failed and retried tokens of a BatchResponse (retries of a MulticastResponse)."""
+    backend = get_metrics()
+    if backend is None:
+        return
+    backend.increment("sent", response.success_count)
+    backend.increment("failed", response.failure_count)
+    backend.increment("retried", getattr(response, "retried", 0))
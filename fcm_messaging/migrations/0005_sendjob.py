@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0004_rename_is_dashbaord_login_userdevice_is_dashboard_login'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('total_count', models.IntegerField(null=True)),
+                ('success_count', models.IntegerField(default=0)),
+                ('failure_count', models.IntegerField(default=0)),
+                ('result', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='fcm_sendjob_status_idx')],
+            },
+        ),
+    ]
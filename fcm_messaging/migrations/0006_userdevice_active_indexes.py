@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0005_sendjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userdevice',
+            index=models.Index(fields=['username', 'is_active'], name='fcm_device_username_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userdevice',
+            index=models.Index(condition=models.Q(('is_dashboard_login', True)), fields=['is_dashboard_login', 'is_active'], name='fcm_device_dashboard_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0006_userdevice_active_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FCMLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=255, null=True)),
+                ('username', models.CharField(max_length=255, null=True)),
+                ('success', models.BooleanField()),
+                ('message_id', models.CharField(max_length=255, null=True)),
+                ('error', models.TextField(null=True)),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='fcm_messaging.fcmlog')),
+            ],
+        ),
+    ]
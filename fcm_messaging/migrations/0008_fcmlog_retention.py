@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0007_fcmlogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FCMLogDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('log_count', models.IntegerField(default=0)),
+                ('success_count', models.IntegerField(default=0)),
+                ('failure_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='fcmlog',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0008_fcmlog_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255)),
+                ('synced_token', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_memberships', to='fcm_messaging.userdevice')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['topic'], name='fcm_membership_topic_idx')],
+                'unique_together': {('device', 'topic')},
+            },
+        ),
+    ]
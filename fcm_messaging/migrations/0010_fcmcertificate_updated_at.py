@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0009_topicmembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fcmcertificate',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
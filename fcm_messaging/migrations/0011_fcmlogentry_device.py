@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0010_fcmcertificate_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fcmlogentry',
+            name='error_code',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='fcmlogentry',
+            name='platform',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='fcmlogentry',
+            name='uuid',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fcmlogentry',
+            index=models.Index(fields=['username', 'id'], name='fcm_logentry_username_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0011_fcmlogentry_device'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='scheduled', max_length=16)),
+                ('send_at', models.DateTimeField()),
+                ('due_at', models.DateTimeField()),
+                ('total_count', models.IntegerField(null=True)),
+                ('success_count', models.IntegerField(default=0)),
+                ('failure_count', models.IntegerField(default=0)),
+                ('result', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'scheduled')), fields=['due_at'], name='fcm_scheduled_due_idx')],
+            },
+        ),
+    ]
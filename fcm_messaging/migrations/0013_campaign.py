@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0012_schedulednotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('starts_at', models.DateTimeField()),
+                ('window', models.PositiveIntegerField()),
+                ('by_timezone', models.BooleanField(default=False)),
+                ('quiet_start', models.TimeField(null=True)),
+                ('quiet_end', models.TimeField(null=True)),
+                ('recipient_count', models.IntegerField(default=0)),
+                ('batch_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userdevice',
+            name='timezone',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='campaign',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='fcm_messaging.campaign'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0013_campaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('default_locale', models.CharField(default='en', max_length=16)),
+                ('image', models.URLField(null=True)),
+                ('data', models.JSONField(default=dict)),
+                ('android', models.JSONField(default=dict)),
+                ('apns', models.JSONField(default=dict)),
+                ('webpush', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userdevice',
+            name='locale',
+            field=models.CharField(max_length=16, null=True),
+        ),
+        migrations.CreateModel(
+            name='NotificationTemplateVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('locale', models.CharField(max_length=16)),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='fcm_messaging.notificationtemplate')),
+            ],
+            options={
+                'unique_together': {('template', 'locale')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0014_notificationtemplate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sendjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
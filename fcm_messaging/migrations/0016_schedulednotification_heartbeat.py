@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fcm_messaging', '0015_sendjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='heartbeat_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(condition=models.Q(('status', 'running')), fields=['heartbeat_at'], name='fcm_scheduled_heartbeat_idx'),
+        ),
+    ]
@@ -41,6 +41,8 @@ class UserDevice(models.Model):
     # --- Optional Device Info ---
     os_version = models.CharField(max_length=255, null=True)  # 16
     device_model = models.CharField(max_length=255, null=True)  # S22
+    timezone = models.CharField(max_length=64, null=True)  # IANA name, e.g. Europe/Paris
+    locale = models.CharField(max_length=16, null=True)  # e.g. pt-BR, picks the variant of templated sends
 
     # --- Timestamps ---
     created_at = models.DateTimeField(auto_now_add=True)
@@ -50,6 +52,14 @@ class UserDevice(models.Model):
         # A user should only have one entry per physical device_id.
         # This prevents a user from registering the same phone multiple times.
         unique_together = ("username", "uuid")
+        indexes = [
+            models.Index(fields=["username", "is_active"], name="fcm_device_username_idx"),
+            models.Index(
+                fields=["is_dashboard_login", "is_active"],
+                name="fcm_device_dashboard_idx",
+                condition=models.Q(is_dashboard_login=True),
+            ),
+        ]
         verbose_name = "User Device"
         verbose_name_plural = "User Devices"
 
@@ -57,7 +67,26 @@ class UserDevice(models.Model):
         return f"{self.username}'s {self.platform} device"
 
     # TODO: cron job to remove stale tokens?
-    # TODO: remove bad tokens when getting error from API
+    # Tokens rejected by the FCM API are pruned by utils.prune_invalid_tokens
+
+
+class TopicMembership(models.Model):
+    """A device subscribed to a topic (group) through this app."""
+
+    device = models.ForeignKey(UserDevice, on_delete=models.CASCADE, related_name="topic_memberships")
+    topic = models.CharField(max_length=255)
+    # token the device was subscribed with, a membership is stale once the device token changed
+    synced_token = models.CharField(max_length=255)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("device", "topic")
+        indexes = [models.Index(fields=["topic"], name="fcm_membership_topic_idx")]
+
+    def __str__(self):
+        return f"{self.device} in {self.topic}"
 
 
 class FCMLog(models.Model):
@@ -72,13 +101,199 @@ class FCMLog(models.Model):
     failure_count = models.IntegerField()
     responses = models.JSONField()  # Detailed results
 
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    # Sends are logged as this header row plus one FCMLogEntry per device, the legacy
+    # usernames/tokens/responses fields are only filled by older rows and can be derived
+    # from the entries with the methods below.
+
+    def get_usernames(self):
+        entries = self.entries.exclude(username=None).order_by("id").values_list("username", flat=True)
+        return ", ".join(dict.fromkeys(entries)) or self.usernames
+
+    def get_tokens(self):
+        return ", ".join(self.entries.exclude(token=None).order_by("id").values_list("token", flat=True)) or self.tokens
+
+    def get_responses(self):
+        responses = [
+            {"success": True, "message_id": message_id} if success else {"success": False, "error": error}
+            for success, message_id, error in self.entries.order_by("id").values_list("success", "message_id", "error")
+        ]
+        return responses or self.responses
+
+
+class FCMLogEntry(models.Model):
+    """Result of a logged send for a single device."""
+
+    log = models.ForeignKey(FCMLog, on_delete=models.CASCADE, related_name="entries")
+    token = models.CharField(max_length=255, null=True)
+    username = models.CharField(max_length=255, null=True)
+    uuid = models.CharField(max_length=255, null=True)
+    platform = models.CharField(max_length=255, null=True)
+    success = models.BooleanField()
+    message_id = models.CharField(max_length=255, null=True)
+    error = models.TextField(null=True)
+    error_code = models.CharField(max_length=64, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["username", "id"], name="fcm_logentry_username_idx")]
+
+
+class FCMLogDailyAggregate(models.Model):
+    """Daily totals of the FCMLog rows removed by the `fcm_cleanup_logs` command."""
+
+    date = models.DateField(unique=True)
+    log_count = models.IntegerField(default=0)
+    success_count = models.IntegerField(default=0)
+    failure_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"FCM logs of {self.date}"
+
+
+class SendJob(models.Model):
+    """A queued notification send, executed by the `fcm_send_worker` management command."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    kind = models.CharField(max_length=32)  # tokens, token, usernames, admin, group
+    payload = models.JSONField()  # arguments of the send function
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+
+    total_count = models.IntegerField(null=True)
+    success_count = models.IntegerField(default=0)
+    failure_count = models.IntegerField(default=0)
+    result = models.JSONField(null=True)  # counts and errors of the send, see jobs.summarize_detail
+
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)  # last progress of the worker running it
+    finished_at = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)  # number of times a worker claimed it
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"], name="fcm_sendjob_status_idx")]
+
+    def __str__(self):
+        return f"{self.kind} send job #{self.pk} ({self.status})"
+
+
+class Campaign(models.Model):
+    """
+    A send to many usernames spread over a time window, released in ScheduledNotification batches.
+    With `by_timezone`, the window starts at the wall-clock time of `starts_at` in the timezone of every
+    user. No batch is released during the quiet hours of its timezone.
+    """
+
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+
+    starts_at = models.DateTimeField()
+    window = models.PositiveIntegerField()  # seconds the batches of every timezone are spread over
+    by_timezone = models.BooleanField(default=False)
+    quiet_start = models.TimeField(null=True)  # local time, the quiet hours may wrap around midnight
+    quiet_end = models.TimeField(null=True)
+
+    recipient_count = models.IntegerField(default=0)
+    batch_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Campaign #{self.pk} {self.title!r}"
+
+
+class ScheduledNotification(models.Model):
+    """A send planned for `due_at`, executed by the `fcm_dispatch_scheduled` management command."""
+
+    class Status(models.TextChoices):
+        SCHEDULED = "scheduled"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+        CANCELLED = "cancelled"
+
+    kind = models.CharField(max_length=32)  # tokens, token, usernames, admin, group
+    payload = models.JSONField()  # arguments of the send function
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.SCHEDULED)
+
+    send_at = models.DateTimeField()  # requested send time
+    due_at = models.DateTimeField()  # send_at plus the jitter spreading the sends scheduled for the same time
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, null=True, related_name="batches")
+
+    total_count = models.IntegerField(null=True)
+    success_count = models.IntegerField(default=0)
+    failure_count = models.IntegerField(default=0)
+    result = models.JSONField(null=True)  # counts and errors of the send, see jobs.summarize_detail
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)  # last progress of the dispatcher running it
+    finished_at = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)  # number of times a dispatcher claimed it
+
+    class Meta:
+        indexes = [
+            # only the rows still waiting are looked up by due time
+            models.Index(
+                fields=["due_at"],
+                name="fcm_scheduled_due_idx",
+                condition=models.Q(status="scheduled"),
+            ),
+            # and only the running ones by heartbeat, to reclaim those of a stopped dispatcher
+            models.Index(
+                fields=["heartbeat_at"],
+                name="fcm_scheduled_heartbeat_idx",
+                condition=models.Q(status="running"),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} notification #{self.pk} due {self.due_at:%Y-%m-%d %H:%M:%S} ({self.status})"
+
+
+class NotificationTemplate(models.Model):
+    """
+    A reusable notification with per-locale title/body variants, a data payload and platform overrides.
+    Texts and data values may hold $variables, substituted at send time (see message_templates.py).
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    default_locale = models.CharField(max_length=16, default="en")
+    image = models.URLField(null=True)
+    data = models.JSONField(default=dict)  # data payload, every value is sent as a string
+    android = models.JSONField(default=dict)  # priority, ttl, collapse_key, channel_id, image, sound, ...
+    apns = models.JSONField(default=dict)  # headers, badge, sound, category, thread_id, image, ...
+    webpush = models.JSONField(default=dict)  # headers, icon, image, badge, link
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class NotificationTemplateVariant(models.Model):
+    template = models.ForeignKey(NotificationTemplate, on_delete=models.CASCADE, related_name="variants")
+    locale = models.CharField(max_length=16)  # e.g. en, pt-BR
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+
+    class Meta:
+        unique_together = ("template", "locale")
+
+    def __str__(self):
+        return f"{self.template_id} ({self.locale})"
 
 
 class FCMCertificate(models.Model):
     certificate_json = models.JSONField()
     firebase_config = models.JSONField()
     vapid_key = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def clean(self):
         # if self.name and FCMCertificate.objects.filter(name=self.name).exists() and not self.pk:
@@ -0,0 +1,117 @@
+"""
+Client-side governor of the FCM send quota, shared by every process through the Django cache.
+Each send takes one token per message from a bucket of `rate` tokens refilled every second. Bulk sends
+may only use the bucket up to `1 - reserve` of its size, so admin and single-token (transactional)
+sends still get through while a campaign saturates the quota:
+
+    FCM_MESSAGING_RATE_LIMIT = {
+        "rate": 10000,  # messages per second for the whole project (the default FCM quota is 600k/minute)
+        "reserve": 0.2,  # share of the rate only high-priority sends may use
+        "max_wait": 30,  # seconds a send waits for capacity before failing with RESOURCE_EXHAUSTED
+    }
+
+Sends are not limited when the setting is unset. The bucket lives in the default cache, which must be
+shared between processes (e.g. Redis or Memcached) for the limit to be global.
+"""
+
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from firebase_admin import exceptions
+
+PRIORITY_HIGH = "high"
+PRIORITY_BULK = "bulk"
+
+DEFAULT_RATE_LIMIT = {
+    "rate": 10000,
+    "reserve": 0.2,
+    "max_wait": 30,
+}
+
+RATE_LIMIT_CACHE_KEY = "fcm_messaging:rate_limit:{}"
+
+
+class RateLimitExceeded(exceptions.ResourceExhaustedError):
+    """Raised when a send could not get capacity within `max_wait`, retried like a 429 from FCM."""
+
+    def __init__(self):
+        super().__init__("Client-side FCM rate limit exceeded")
+
+
+def rate_limit_options():
+    options = getattr(settings, "FCM_MESSAGING_RATE_LIMIT", None)
+    if not options:
+        return None
+    return {**DEFAULT_RATE_LIMIT, **options}
+
+
+def lane_capacity(options, priority):
+    """Number of tokens of the bucket a lane may use every second."""
+    if priority == PRIORITY_HIGH:
+        return options["rate"]
+    return max(int(options["rate"] * (1 - options["reserve"])), 1)
+
+
+def _take(count, capacity):
+    """
+    Takes up to `count` tokens from the bucket of the current second without filling it past `capacity`.
+    Returns the number of tokens taken and the seconds until the bucket is refilled.
+    """
+    now = time.time()
+    window = int(now)
+    key = RATE_LIMIT_CACHE_KEY.format(window)
+    cache.add(key, 0, timeout=2)
+    try:
+        used = cache.incr(key, count)
+    except ValueError:
+        # the key expired in between, the next window is about to start
+        return 0, window + 1 - now
+
+    taken = max(min(count, capacity - (used - count)), 0)
+    if taken < count:
+        try:
+            cache.decr(key, count - taken)
+        except ValueError:
+            # the key expired since the incr, seed it again with what the bucket holds without the excess
+            cache.add(key, used - (count - taken), timeout=2)
+    return taken, window + 1 - now
+
+
+def acquire(count, priority=PRIORITY_BULK):
+    """
+    Blocks until `count` messages may be sent in the given lane.
+    Returns False if that would take longer than `max_wait`, True right away when sends are not limited.
+    """
+    options = rate_limit_options()
+    if options is None:
+        return True
+    capacity = lane_capacity(options, priority)
+    deadline = time.monotonic() + options["max_wait"]
+    while count:
+        taken, refill = _take(count, capacity)
+        count -= taken
+        if count:
+            if time.monotonic() + refill > deadline:
+                return False
+            time.sleep(refill)
+    return True
+
+
+async def aacquire(count, priority=PRIORITY_BULK):
+    """Async version of `acquire`."""
+    options = rate_limit_options()
+    if options is None:
+        return True
+    capacity = lane_capacity(options, priority)
+    deadline = time.monotonic() + options["max_wait"]
+    while count:
+        taken, refill = await sync_to_async(_take)(count, capacity)
+        count -= taken
+        if count:
+            if time.monotonic() + refill > deadline:
+                return False
+            await asyncio.sleep(refill)
+    return True
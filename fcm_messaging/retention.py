@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import FCMLog, FCMLogDailyAggregate, FCMLogEntry
+
+DEFAULT_LOG_RETENTION_DAYS = 30
+DEFAULT_CLEANUP_BATCH_SIZE = 1000
+
+
+def cleanup_fcm_logs(days=None, batch_size=DEFAULT_CLEANUP_BATCH_SIZE, rollup=False):
+    """
+    Deletes the FCMLog rows (and their entries) older than `days`, FCM_MESSAGING_LOG_RETENTION_DAYS by default.
+    Rows are deleted in batches of `batch_size`, each in its own short transaction, so the table is never
+    locked for long: the entries of a batch of logs first, `batch_size` entries at a time, then the logs.
+    With `rollup`, the success/failure counts of the deleted rows are added to FCMLogDailyAggregate in the
+    transaction deleting them. Returns the number of deleted FCMLog rows.
+    """
+    if days is None:
+        days = getattr(settings, "FCM_MESSAGING_LOG_RETENTION_DAYS", DEFAULT_LOG_RETENTION_DAYS)
+    cutoff = timezone.now() - timedelta(days=days)
+
+    deleted = 0
+    while True:
+        log_ids = list(
+            FCMLog.objects.filter(created_at__lt=cutoff).order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not log_ids:
+            return deleted
+
+        # a log of a large send has an entry per device, deleting them through the cascade would delete
+        # millions of rows in the transaction of a single batch
+        while _delete_log_entries(log_ids, batch_size):
+            pass
+
+        with transaction.atomic():
+            if rollup:
+                _rollup_logs(log_ids)
+            FCMLog.objects.filter(id__in=log_ids).delete()
+        deleted += len(log_ids)
+
+
+def _delete_log_entries(log_ids, batch_size):
+    entry_ids = list(FCMLogEntry.objects.filter(log_id__in=log_ids).values_list("id", flat=True)[:batch_size])
+    if entry_ids:
+        FCMLogEntry.objects.filter(id__in=entry_ids).delete()
+    return len(entry_ids)
+
+
+def _rollup_logs(log_ids):
+    days = (
+        FCMLog.objects.filter(id__in=log_ids)
+        .annotate(date=TruncDate("created_at"))
+        .values("date")
+        .annotate(log_count=Count("id"), success_count=Sum("success_count"), failure_count=Sum("failure_count"))
+    )
+    for day in days:
+        FCMLogDailyAggregate.objects.get_or_create(date=day["date"])
+        FCMLogDailyAggregate.objects.filter(date=day["date"]).update(
+            log_count=F("log_count") + day["log_count"],
+            success_count=F("success_count") + day["success_count"],
+            failure_count=F("failure_count") + day["failure_count"],
+        )
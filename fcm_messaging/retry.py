@@ -0,0 +1,116 @@
+"""
+Per-token retries of transient FCM errors.
+Only the tokens whose response failed with a retryable error are re-sent, after a jittered exponential
+backoff that honors the Retry-After header, until FCM_MESSAGING_RETRY["max_retries"] is reached or the
+next attempt would end past the send deadline:
+
+    FCM_MESSAGING_RETRY = {
+        "max_retries": 3,
+        "base_delay": 0.5,  # seconds, doubled on every retry
+        "max_delay": 30,
+        "deadline": 60,  # seconds since the start of the send
+    }
+"""
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from firebase_admin import exceptions
+
+# UNAVAILABLE, INTERNAL and RESOURCE_EXHAUSTED (429, including QUOTA_EXCEEDED)
+RETRYABLE_ERRORS = (exceptions.UnavailableError, exceptions.InternalError, exceptions.ResourceExhaustedError)
+
+DEFAULT_RETRY = {
+    "max_retries": 3,
+    "base_delay": 0.5,
+    "max_delay": 30,
+    "deadline": 60,
+}
+
+
+def retry_options():
+    return {**DEFAULT_RETRY, **getattr(settings, "FCM_MESSAGING_RETRY", {})}
+
+
+def retryable_indexes(responses):
+    return [i for i, resp in enumerate(responses) if not resp.success and isinstance(resp.exception, RETRYABLE_ERRORS)]
+
+
+def retry_after(error):
+    """Seconds requested by the Retry-After header of the error's HTTP response, if any."""
+    response = getattr(error, "http_response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def retry_delay(attempt, errors, options):
+    """Full-jitter exponential backoff for the given attempt (0-based), never shorter than Retry-After."""
+    backoff = min(options["base_delay"] * 2**attempt, options["max_delay"])
+    delay = random.uniform(0, backoff)
+    return max([delay] + [retry_after(e) for e in errors])
+
+
+def _next_retry(responses, attempt, started, options):
+    """Returns the indexes to retry and the delay before doing so, or None when retrying is over."""
+    if attempt >= options["max_retries"]:
+        return None
+    indexes = retryable_indexes(responses)
+    if not indexes:
+        return None
+    delay = retry_delay(attempt, {responses[i].exception for i in indexes}, options)
+    if time.monotonic() - started + delay > options["deadline"]:
+        return None
+    return indexes, delay
+
+
+def _replace(responses, indexes, retried):
+    for i, resp in zip(indexes, retried):
+        responses[i] = resp
+
+
+def retry_failed(tokens, responses, resend, started):
+    """
+    Re-sends the tokens whose SendResponse failed with a retryable error.
+    - tokens, responses: the tokens and the SendResponses lining up with them
+    - resend: callable taking a list of tokens and returning the SendResponses lining up with them
+    - started: time.monotonic() at the start of the send, the deadline counts from there
+    Returns the final SendResponses and the number of retries (one per re-sent token).
+    """
+    options = retry_options()
+    responses = list(responses)
+    retried = 0
+    attempt = 0
+    while (retry := _next_retry(responses, attempt, started, options)) is not None:
+        indexes, delay = retry
+        time.sleep(delay)
+        _replace(responses, indexes, resend([tokens[i] for i in indexes]))
+        retried += len(indexes)
+        attempt += 1
+    return responses, retried
+
+
+async def aretry_failed(tokens, responses, resend, started):
+    """Async version of `retry_failed`, `resend` is a coroutine function."""
+    options = retry_options()
+    responses = list(responses)
+    retried = 0
+    attempt = 0
+    while (retry := _next_retry(responses, attempt, started, options)) is not None:
+        indexes, delay = retry
+        await asyncio.sleep(delay)
+        _replace(responses, indexes, await resend([tokens[i] for i in indexes]))
+        retried += len(indexes)
+        attempt += 1
+    return responses, retried
@@ -0,0 +1,80 @@
+"""
+Scheduled and delayed sends. A ScheduledNotification is due at its requested `send_at` plus a random
+jitter of up to `jitter` seconds, so the sends scheduled for the same time (e.g. the top of the hour) are
+spread out instead of all hitting FCM at once:
+
+    FCM_MESSAGING_SCHEDULE_JITTER = 0  # default jitter in seconds of the schedules that do not set one
+
+Due rows are claimed in batches by the `fcm_dispatch_scheduled` command and sent with the same send
+functions as the queued SendJobs (see jobs.py). Like those, rows left running by a dispatcher that stopped
+are scheduled again after FCM_MESSAGING_JOB_TIMEOUT seconds.
+"""
+
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import SEND_FUNCTIONS, claim_jobs, expected_count, reclaim_stale_jobs
+from .models import ScheduledNotification
+
+DEFAULT_SCHEDULE_JITTER = 0
+
+
+def schedule_notification(kind, send_at, jitter=None, **payload):
+    """Schedules a send of the given job kind at `send_at` (an aware datetime) and returns the row."""
+    if kind not in SEND_FUNCTIONS:
+        raise ValueError(f"Unknown send job kind: {kind}")
+    if jitter is None:
+        jitter = getattr(settings, "FCM_MESSAGING_SCHEDULE_JITTER", DEFAULT_SCHEDULE_JITTER)
+
+    return ScheduledNotification.objects.create(
+        kind=kind,
+        payload=payload,
+        send_at=send_at,
+        due_at=send_at + timedelta(seconds=random.uniform(0, jitter)) if jitter else send_at,
+        total_count=expected_count(kind, payload),
+    )
+
+
+def cancel_scheduled_notification(pk):
+    """
+    Cancels a scheduled send unless a dispatcher already claimed it.
+    Returns whether the send was cancelled.
+    """
+    return bool(
+        ScheduledNotification.objects.filter(pk=pk, status=ScheduledNotification.Status.SCHEDULED).update(
+            status=ScheduledNotification.Status.CANCELLED, finished_at=timezone.now()
+        )
+    )
+
+
+def claim_due_notifications(limit):
+    """
+    Marks up to `limit` due notifications as running and returns them, the most overdue first.
+    Rows locked by another dispatcher are skipped, so several dispatchers can drain them in parallel.
+    Rows abandoned by a dispatcher that stopped are scheduled again first (see jobs.reclaim_stale_jobs).
+    """
+    reclaim_stale_jobs(ScheduledNotification, ScheduledNotification.Status.SCHEDULED)
+    now = timezone.now()
+    with transaction.atomic():
+        notification_ids = list(
+            ScheduledNotification.objects.select_for_update(skip_locked=True)
+            .filter(status=ScheduledNotification.Status.SCHEDULED, due_at__lte=now)
+            .order_by("due_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        claim_jobs(ScheduledNotification.objects.filter(id__in=notification_ids))
+    return list(ScheduledNotification.objects.filter(id__in=notification_ids).order_by("due_at"))
+
+
+def next_due_at():
+    """Due time of the next scheduled notification, None when nothing is scheduled."""
+    return (
+        ScheduledNotification.objects.filter(status=ScheduledNotification.Status.SCHEDULED)
+        .order_by("due_at")
+        .values_list("due_at", flat=True)
+        .first()
+    )
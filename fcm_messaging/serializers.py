@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from .models import FCMCertificate, FCMLog, UserDevice
+from .campaigns import get_zone
+from .models import Campaign, FCMCertificate, FCMLogEntry, ScheduledNotification, SendJob, UserDevice
 
 
 class FCMCertificateSerializer(serializers.ModelSerializer):
@@ -10,12 +11,107 @@ class FCMCertificateSerializer(serializers.ModelSerializer):
 
 
 class UserDeviceSerializer(serializers.ModelSerializer):
+    def __init__(self, *args, fields=None, **kwargs):
+        """`fields` optionally restricts the output to a subset of the serializer fields."""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = UserDevice
-        fields = ["username", "token", "uuid", "platform", "is_dashboard_login", "is_active", "os_version", "device_model"]
+        fields = [
+            "username",
+            "token",
+            "uuid",
+            "platform",
+            "is_dashboard_login",
+            "is_active",
+            "os_version",
+            "device_model",
+            "timezone",
+            "locale",
+        ]
+
+
+class UserDeviceRecordSerializer(UserDeviceSerializer):
+    """
+    One device of a bulk registration. Uniqueness is not validated: registering an existing device or token
+    updates it (see devices.bulk_upsert_devices).
+    """
+
+    def validate_timezone(self, value):
+        if value is not None and get_zone(value, None) is None:
+            raise serializers.ValidationError(f"Unknown timezone: {value}")
+        return value
+
+    class Meta(UserDeviceSerializer.Meta):
+        validators = []
+        extra_kwargs = {
+            "token": {"validators": []},
+            "uuid": {"required": True, "allow_null": False},
+        }
+
+
+class FCMLogEntrySerializer(serializers.ModelSerializer):
+    message_title = serializers.CharField(source="log.message_title", read_only=True)
+    created_at = serializers.DateTimeField(source="log.created_at", read_only=True)
+
+    class Meta:
+        model = FCMLogEntry
+        fields = ["log_id", "message_title", "created_at", "uuid", "platform", "success", "message_id", "error_code"]
+
+
+class SendJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SendJob
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "total_count",
+            "success_count",
+            "failure_count",
+            "result",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
+class ScheduledNotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScheduledNotification
+        fields = [
+            "id",
+            "kind",
+            "payload",
+            "status",
+            "send_at",
+            "due_at",
+            "total_count",
+            "success_count",
+            "failure_count",
+            "result",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
 
 
-class FCMLogSerializer(serializers.ModelSerializer):
+class CampaignSerializer(serializers.ModelSerializer):
     class Meta:
-        model = FCMLog
-        fields = ["usernames", "tokens", "message_title", "message_body", "success_count", "failure_count", "responses", "created_at"]
+        model = Campaign
+        fields = [
+            "id",
+            "title",
+            "body",
+            "starts_at",
+            "window",
+            "by_timezone",
+            "quiet_start",
+            "quiet_end",
+            "recipient_count",
+            "batch_count",
+            "created_at",
+        ]
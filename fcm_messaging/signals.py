@@ -1,11 +1,48 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import FCMCertificate, FCMLog
+from .audience import invalidate_audience_cache
+from .config import invalidate_firebase_config
+from .message_templates import invalidate_template
+from .models import FCMCertificate, FCMLog, NotificationTemplate, NotificationTemplateVariant, UserDevice
+from .utils import certificate_fingerprint, invalidate_firebase_app
+
+
+@receiver(post_save, sender=UserDevice)
+@receiver(post_delete, sender=UserDevice)
+def invalidate_user_device_audience(sender, instance, **kwargs):
+    username = instance.username
+    transaction.on_commit(lambda: invalidate_audience_cache([username]))
+
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def invalidate_notification_template(sender, instance, **kwargs):
+    template_id = instance.pk
+    transaction.on_commit(lambda: invalidate_template(template_id))
+
+
+@receiver(post_save, sender=NotificationTemplateVariant)
+@receiver(post_delete, sender=NotificationTemplateVariant)
+def invalidate_notification_template_variant(sender, instance, **kwargs):
+    # a new version of the template, so that the processes holding the previous one compile it again
+    NotificationTemplate.objects.filter(pk=instance.template_id).update(updated_at=timezone.now())
+    template_id = instance.template_id
+    transaction.on_commit(lambda: invalidate_template(template_id))
 
 
 @receiver(post_save, sender=FCMCertificate)
 def log_fcm_certificate_changes(sender, instance, created, **kwargs):
+    try:
+        fingerprint = certificate_fingerprint(instance.certificate_json)
+    except (TypeError, ValueError):
+        fingerprint = None
+    # once committed, so that no process re-creates its app or caches the config from the previous certificate
+    transaction.on_commit(lambda: invalidate_firebase_app(fingerprint))
+    transaction.on_commit(invalidate_firebase_config)
+
     log_message = "FCMCertificate was created" if created else "FCMCertificate was updated"
     FCMLog.objects.create(
         usernames="N/A",
@@ -14,7 +51,8 @@ def log_fcm_certificate_changes(sender, instance, created, **kwargs):
         success_count=0,
         failure_count=0,
         responses={
-            "certificate_json": instance.certificate_json,
+            # never copy the private key into the logs, the fingerprint is enough to tell certificates apart
+            "certificate_fingerprint": fingerprint,
             "firebase_config": instance.firebase_config,
             "vapid_key": instance.vapid_key,
         },
@@ -1,3 +1,1111 @@
-# from django.test import TestCase
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import firebase_admin
+from asgiref.sync import sync_to_async
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from firebase_admin import messaging
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.permissions import IsAuthenticated
+
+from .aio import asend_message_tokens, asend_message_usernames
+from .async_views import AsyncAPIView
+from .audience import AudienceNormalizer, Recipient, admin_tokens, iter_username_tokens
+from .campaigns import create_campaign, parse_quiet_hours, release_times
+from .devices import bulk_upsert_devices
+from .fakefcm import FakeFCMServer, fake_firebase_app, firebase_app_override
+from .jobs import (
+    JobProgress,
+    claim_send_jobs,
+    enqueue_send_job,
+    execute_send,
+    reclaim_stale_jobs,
+    run_send_job,
+    summarize_detail,
+)
+from .message_templates import get_compiled_template
+from .models import (
+    FCMCertificate,
+    FCMLog,
+    FCMLogDailyAggregate,
+    FCMLogEntry,
+    NotificationTemplate,
+    NotificationTemplateVariant,
+    ScheduledNotification,
+    SendJob,
+    TopicMembership,
+    UserDevice,
+)
+from .ratelimit import PRIORITY_BULK, PRIORITY_HIGH, RATE_LIMIT_CACHE_KEY, acquire, lane_capacity, rate_limit_options
+from .retention import cleanup_fcm_logs
+from .scheduling import claim_due_notifications, schedule_notification
+from .topics import stale_topic_memberships, topic_audience_size
+from .transport import TRANSPORT_RETRIES, aclose_async_connections, transport_options, transport_stats
+from .utils import (
+    CERTIFICATE_FINGERPRINT_CACHE_KEY,
+    MAX_PENDING_LOG_ENTRIES,
+    MULTICAST_MAX_TOKENS,
+    MulticastResponse,
+    certificate_fingerprint,
+    dispatch_chunks,
+    get_firebase_app,
+    log_fcm_response,
+    manage_topic,
+    send_executor,
+    send_message_usernames,
+    send_multicast,
+)
+
+
+_app_names = count()
+
+
+def make_tokens(size, prefix="token"):
+    return [f"{prefix}-{i}" for i in range(size)]
+
+
+@override_settings(
+    ROOT_URLCONF="fcm_messaging.urls",
+    FCM_MESSAGING_ASYNC_LOG=False,
+    FCM_MESSAGING_RETRY={"base_delay": 0.01, "max_delay": 0.05},
+)
+class FakeFCMTestCase(TestCase):
+    """Sends every test to a fake FCM server started with `fake_fcm_options`."""
+
+    fake_fcm_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeFCMServer(seed=0, **cls.fake_fcm_options)
+        cls.app = fake_firebase_app(cls.server.start(), name=f"fcm_messaging-test-{next(_app_names)}")
+
+    @classmethod
+    def tearDownClass(cls):
+        firebase_admin.delete_app(cls.app)
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.server.stats.clear()
+        override = firebase_app_override(self.app)
+        override.__enter__()
+        self.addCleanup(override.__exit__, None, None, None)
+
+    def create_devices(self, username, size, **fields):
+        return UserDevice.objects.bulk_create(
+            UserDevice(username=username, uuid=f"{username}-{i}", token=f"{username}-token-{i}", **fields)
+            for i in range(size)
+        )
+
+
+class DispatchChunksTests(TestCase):
+    def test_chunks_are_returned_in_order(self):
+        def send_chunk(chunk):
+            # later chunks complete first
+            time.sleep(0.02 if chunk[0] == 0 else 0)
+            return list(chunk)
+
+        collected = []
+        dispatched, results = dispatch_chunks(iter(range(25)), 10, send_chunk, on_result=collected.append)
+
+        self.assertEqual(dispatched, list(range(25)))
+        self.assertEqual(results, [list(range(10)), list(range(10, 20)), list(range(20, 25))])
+        self.assertEqual(collected, results)
+
+    def test_items_are_consumed_lazily(self):
+        consumed = []
+
+        def items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        threads = set()
+
+        def send_chunk(chunk):
+            threads.add(threading.get_ident())
+            return len(consumed)
+
+        _, max_workers = send_executor()
+        _, results = dispatch_chunks(items(), 10, send_chunk)
+        # the audience is consumed at most two chunks per worker ahead of the chunk being sent
+        self.assertEqual(len(results), 100)
+        self.assertTrue(all(seen <= (i + 2 * max_workers) * 10 for i, seen in enumerate(results)))
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_sends_share_one_worker_pool(self):
+        executor, max_workers = send_executor()
+        threads = set()
+
+        def send_chunk(chunk):
+            threads.add(threading.get_ident())
+            time.sleep(0.001)
+            return chunk
+
+        for _ in range(3):
+            dispatch_chunks(range(50), 1, send_chunk)
+
+        self.assertIs(send_executor()[0], executor)
+        self.assertLessEqual(len(threads), max_workers)
+
+
+class SendMulticastTests(FakeFCMTestCase):
+    def test_responses_line_up_with_the_tokens_of_every_chunk(self):
+        tokens = make_tokens(2 * MULTICAST_MAX_TOKENS + 1)
+        response = send_multicast(messaging.Notification(title="t", body="b"), iter(tokens), app=self.app)
+
+        self.assertEqual(response.tokens, tokens)
+        self.assertEqual(len(response.responses), len(tokens))
+        self.assertEqual(response.success_count, len(tokens))
+        self.assertEqual(self.server.stats["messages"], len(tokens))
+        self.assertEqual(len({r.message_id for r in response.responses}), len(tokens))
+
+    def test_empty_audience_sends_nothing(self):
+        response = send_multicast(messaging.Notification(title="t", body="b"), iter([]), app=self.app)
+        self.assertEqual(response.responses, [])
+        self.assertEqual(self.server.stats["requests"], 0)
+
+
+class SendJobTests(FakeFCMTestCase):
+    def test_counts_are_updated_as_chunks_complete(self):
+        tokens = make_tokens(2 * MULTICAST_MAX_TOKENS + 1)
+        job = enqueue_send_job("tokens", title="t", body="b", tokens=tokens)
+        [job] = claim_send_jobs(10)
+
+        counts = []
+        flush = JobProgress.flush
+
+        def recording_flush(progress):
+            updated = flush(progress)
+            counts.append(SendJob.objects.values_list("success_count", flat=True).get(pk=job.pk))
+            return updated
+
+        with mock.patch("fcm_messaging.jobs.PROGRESS_INTERVAL", 0), mock.patch.object(
+            JobProgress, "flush", recording_flush
+        ):
+            job = run_send_job(job)
+
+        # the heartbeat written when the job starts, then one write per chunk
+        self.assertEqual(counts, [0, 500, 1000, 1001])
+
+        self.assertEqual(job.status, SendJob.Status.SUCCEEDED)
+        self.assertEqual((job.total_count, job.success_count, job.failure_count), (len(tokens), len(tokens), 0))
+
+    def test_result_keeps_the_counts_and_errors_only(self):
+        error = "Requested entity was not found."
+        detail = {
+            "success_count": 1,
+            "failure_count": 2,
+            "retried_count": 0,
+            "responses": [
+                {"success": True, "message_id": "m1", "error": None},
+                {"success": False, "message_id": None, "error": error},
+                {"success": False, "message_id": None, "error": error},
+            ],
+        }
+        self.assertEqual(
+            summarize_detail(detail),
+            {"success_count": 1, "failure_count": 2, "retried_count": 0, "errors": {error: 2}},
+        )
+        self.assertEqual(summarize_detail("No valid tokens found"), "No valid tokens found")
+
+    def test_abandoned_jobs_are_queued_again_then_failed(self):
+        job = enqueue_send_job("admin", title="t", body="b")
+        for attempt in range(1, 4):
+            self.assertEqual([j.attempts for j in claim_send_jobs(10)], [attempt])
+            SendJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(reclaim_stale_jobs(SendJob, SendJob.Status.PENDING), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SendJob.Status.FAILED)
+
+    def test_reclaimed_jobs_are_skipped(self):
+        job = enqueue_send_job("admin", title="t", body="b")
+        [claimed] = claim_send_jobs(10)
+        SendJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        reclaim_stale_jobs(SendJob, SendJob.Status.PENDING)
+
+        run_send_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SendJob.Status.PENDING)
+        self.assertEqual(self.server.stats["requests"], 0)
+
+    def test_result_of_a_job_reclaimed_while_sending_is_dropped(self):
+        job = enqueue_send_job("tokens", title="t", body="b", tokens=make_tokens(3))
+        [claimed] = claim_send_jobs(10)
+
+        def reclaimed_send(kind, payload):
+            SendJob.objects.filter(pk=job.pk).update(status=SendJob.Status.PENDING)
+            return execute_send(kind, payload)
+
+        with mock.patch("fcm_messaging.jobs.execute_send", reclaimed_send):
+            run_send_job(claimed)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (SendJob.Status.PENDING, None))
+
+    def test_views_queue_sends_for_the_worker(self):
+        data = {"title": "t", "body": "b", "tokens": make_tokens(3), "async": True}
+        response = self.client.post("/send-notification-tokens/", data, content_type="application/json")
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(self.server.stats["requests"], 0)
+
+        # the command would close the connection of the test transaction
+        with mock.patch("fcm_messaging.management.commands.fcm_send_worker.close_old_connections"):
+            call_command("fcm_send_worker", "--once", stdout=StringIO())
+
+        job = self.client.get(f"/send-jobs/{response.json()['job_id']}/").json()
+        self.assertEqual((job["status"], job["success_count"]), (SendJob.Status.SUCCEEDED, 3))
+        self.assertEqual(self.server.stats["messages"], 3)
+
+
+def service_account(client_email="fcm@test-project.iam.gserviceaccount.com"):
+    """Service account certificate with a freshly generated key, never used to authenticate."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return {
+        "type": "service_account",
+        "project_id": "test-project",
+        "private_key_id": "test-key",
+        "private_key": private_key.decode(),
+        "client_email": client_email,
+        "client_id": "1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+
+
+class FirebaseAppTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.certificate_json = service_account()
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.dict(
+            "fcm_messaging.utils._firebase_app", {"app": None, "fingerprint": None, "stale": False}
+        )
+        self.firebase_app = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.delete_app)
+
+    def delete_app(self):
+        if self.firebase_app["app"] is not None:
+            firebase_admin.delete_app(self.firebase_app["app"])
+
+    def create_certificate(self):
+        return FCMCertificate.objects.create(
+            certificate_json=self.certificate_json, firebase_config={"apiKey": "key"}, vapid_key="vapid"
+        )
+
+    def test_app_is_reused_while_the_certificate_is_unchanged(self):
+        self.create_certificate()
+        app, error = get_firebase_app()
+        self.assertIsNone(error)
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_firebase_app()[0], app)
+
+    def test_rotated_certificate_is_applied_once_committed(self):
+        certificate = self.create_certificate()
+        app, _ = get_firebase_app()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            certificate.certificate_json = service_account("rotated@test-project.iam.gserviceaccount.com")
+            certificate.save()
+            self.assertIs(get_firebase_app()[0], app)
+
+        with mock.patch("fcm_messaging.utils._retire_firebase_app") as retire:
+            for callback in callbacks:
+                callback()
+            rotated, _ = get_firebase_app()
+
+        self.assertIsNot(rotated, app)
+        # in-flight sends keep the replaced app until it is retired
+        retire.assert_called_once_with(app)
+        firebase_admin.delete_app(app)
+
+    def test_missing_fingerprint_is_checked_against_the_certificate(self):
+        self.create_certificate()
+        app, _ = get_firebase_app()
+        cache.delete(CERTIFICATE_FINGERPRINT_CACHE_KEY)
+
+        with self.assertNumQueries(1):
+            self.assertIs(get_firebase_app()[0], app)
+        self.assertEqual(cache.get(CERTIFICATE_FINGERPRINT_CACHE_KEY), certificate_fingerprint(self.certificate_json))
+
+    def test_missing_certificate_is_reported(self):
+        app, error = get_firebase_app()
+        self.assertIsNone(app)
+        self.assertIn("No FCM certificate found", error)
+
+
+class PruneTests(FakeFCMTestCase):
+    fake_fcm_options = {"error_rate": 1.0}
+
+    def test_unregistered_tokens_are_deactivated(self):
+        self.create_devices("alice", 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            success, detail = send_message_usernames("t", "b", ["alice"])
+
+        self.assertFalse(success)
+        self.assertEqual(detail["failure_count"], 3)
+        self.assertFalse(UserDevice.objects.filter(username="alice", is_active=True).exists())
+
+    @override_settings(FCM_MESSAGING_PRUNE_TOKENS="delete")
+    def test_unregistered_tokens_are_deleted(self):
+        self.create_devices("bob", 2)
+        send_message_usernames("t", "b", ["bob"])
+        self.assertFalse(UserDevice.objects.filter(username="bob").exists())
+
+    @override_settings(FCM_MESSAGING_PRUNE_TOKENS=None)
+    def test_pruning_can_be_disabled(self):
+        self.create_devices("carol", 2)
+        send_message_usernames("t", "b", ["carol"])
+        self.assertEqual(UserDevice.objects.filter(username="carol", is_active=True).count(), 2)
+
+
+class QuotaPruneTests(FakeFCMTestCase):
+    fake_fcm_options = {"burst_every": 1, "burst_length": 1, "retry_after": 0}
+
+    @override_settings(FCM_MESSAGING_RETRY={"max_retries": 1, "base_delay": 0.01})
+    def test_transient_errors_never_prune(self):
+        self.create_devices("dave", 2)
+        success, detail = send_message_usernames("t", "b", ["dave"])
+
+        self.assertFalse(success)
+        self.assertEqual(detail["failure_count"], 2)
+        self.assertEqual(UserDevice.objects.filter(username="dave", is_active=True).count(), 2)
+
+
+class AudienceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_only_active_devices_are_targeted(self):
+        UserDevice.objects.create(username="alice", uuid="phone", token="t1", is_dashboard_login=True)
+        UserDevice.objects.create(username="alice", uuid="tablet", token="t2", is_dashboard_login=True, is_active=False)
+
+        self.assertEqual([r.token for r in iter_username_tokens(["alice"])], ["t1"])
+        self.assertEqual([r.token for r in admin_tokens()], ["t1"])
+
+    def test_usernames_are_resolved_in_bounded_in_lists(self):
+        UserDevice.objects.bulk_create(UserDevice(username=f"user-{i}", uuid="phone", token=f"t{i}") for i in range(5))
+        usernames = (f"user-{i}" for i in range(5))
+
+        with self.assertNumQueries(3):
+            tokens = [r.token for r in iter_username_tokens(usernames, chunk_size=2)]
+        self.assertEqual(sorted(tokens), [f"t{i}" for i in range(5)])
+
+
+class LogTests(TestCase):
+    @override_settings(FCM_MESSAGING_ASYNC_LOG=False)
+    def test_one_entry_is_written_per_token(self):
+        response = MulticastResponse(
+            [
+                messaging.SendResponse({"name": "projects/p/messages/1"}, None),
+                messaging.SendResponse(None, messaging.UnregisteredError("Requested entity was not found.")),
+            ],
+            ["t1", "t2"],
+        )
+        self.assertTrue(log_fcm_response("b", response, usernames=["alice", "bob"], message_title="t"))
+
+        log = FCMLog.objects.get()
+        self.assertEqual((log.message_title, log.success_count, log.failure_count), ("t", 1, 1))
+        self.assertEqual(
+            list(log.entries.order_by("id").values_list("token", "username", "success", "message_id", "error_code")),
+            [("t1", "alice", True, "projects/p/messages/1", None), ("t2", "bob", False, None, "UNREGISTERED")],
+        )
+
+    @override_settings(FCM_MESSAGING_ASYNC_LOG=True)
+    def test_logs_are_written_inline_when_the_queue_is_full(self):
+        response = MulticastResponse([messaging.SendResponse({"name": "projects/p/messages/1"}, None)], ["t1"])
+        with mock.patch.dict(
+            "fcm_messaging.utils._pending_log_entries", {"count": MAX_PENDING_LOG_ENTRIES}
+        ), mock.patch("fcm_messaging.utils._log_executor") as log_executor:
+            log_fcm_response("b", response)
+
+        log_executor.submit.assert_not_called()
+        self.assertEqual(FCMLog.objects.get().entries.count(), 1)
+
+
+class RetentionTests(TestCase):
+    def create_log(self, days_ago, success_count, failure_count):
+        log = FCMLog.objects.create(
+            message_body="b", success_count=success_count, failure_count=failure_count, responses=[]
+        )
+        FCMLog.objects.filter(pk=log.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        FCMLogEntry.objects.bulk_create(
+            FCMLogEntry(log=log, token=f"t{i}", success=i < success_count)
+            for i in range(success_count + failure_count)
+        )
+        return log
+
+    def test_old_logs_are_deleted_in_batches_with_their_entries(self):
+        for _ in range(3):
+            self.create_log(40, 2, 1)
+        recent = self.create_log(1, 1, 0)
+
+        self.assertEqual(cleanup_fcm_logs(days=30, batch_size=2), 3)
+        self.assertEqual(list(FCMLog.objects.values_list("id", flat=True)), [recent.pk])
+        self.assertEqual(list(FCMLogEntry.objects.values_list("log_id", flat=True)), [recent.pk])
+
+    def test_deleted_logs_are_rolled_up_per_day(self):
+        self.create_log(40, 2, 1)
+        self.create_log(40, 3, 0)
+        self.create_log(1, 1, 1)
+
+        cleanup_fcm_logs(days=30, rollup=True)
+        aggregate = FCMLogDailyAggregate.objects.get()
+        self.assertEqual((aggregate.log_count, aggregate.success_count, aggregate.failure_count), (2, 5, 1))
+
+    def test_command_reports_the_deleted_logs(self):
+        self.create_log(40, 1, 0)
+        out = StringIO()
+        # the command would close the connection of the test transaction
+        with mock.patch("fcm_messaging.management.commands.fcm_cleanup_logs.close_old_connections"):
+            call_command("fcm_cleanup_logs", "--days", "30", "--rollup", stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), "Deleted 1 FCM logs")
+        self.assertEqual(FCMLogDailyAggregate.objects.get().log_count, 1)
+
+
+@override_settings(ROOT_URLCONF="fcm_messaging.urls")
+class DeviceListTests(TestCase):
+    def setUp(self):
+        UserDevice.objects.bulk_create(
+            UserDevice(username=f"user-{i}", uuid="phone", token=f"t{i}", platform="ios" if i % 2 else "android")
+            for i in range(5)
+        )
+
+    def test_pages_follow_the_cursor(self):
+        usernames = []
+        params = {"limit": 2}
+        while True:
+            page = self.client.get("/devices/", params).json()
+            usernames += [device["username"] for device in page["results"]]
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+
+        self.assertEqual(usernames, [f"user-{i}" for i in range(5)])
+
+    def test_devices_are_filtered_and_restricted_to_fields(self):
+        response = self.client.get("/devices/", {"platform": "ios", "fields": "username,platform", "limit": 10})
+        self.assertEqual(
+            response.json()["results"],
+            [{"username": "user-1", "platform": "ios"}, {"username": "user-3", "platform": "ios"}],
+        )
+
+        response = self.client.get("/devices/", {"fields": "username,password"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_listing_is_streamed_as_a_json_list(self):
+        UserDevice.objects.filter(username="user-0").update(is_active=False)
+        response = self.client.get("/devices/", {"is_active": "false"})
+
+        self.assertTrue(response.streaming)
+        devices = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([device["username"] for device in devices], ["user-0"])
+
+    def test_ndjson_export(self):
+        response = self.client.get("/devices/", {"export": "ndjson", "fields": "token"})
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"token": f"t{i}"} for i in range(5)])
+
+
+@override_settings(ROOT_URLCONF="fcm_messaging.urls")
+class BulkDeviceTests(TestCase):
+    def post(self, devices):
+        return self.client.post("/devices/bulk/", {"devices": devices}, content_type="application/json")
+
+    def test_devices_are_registered_and_updated(self):
+        UserDevice.objects.create(username="alice", uuid="phone", token="old", platform="android")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(
+                [
+                    {"username": "alice", "uuid": "phone", "token": "new"},
+                    {"username": "bob", "uuid": "phone", "token": "bob-1", "timezone": "Europe/Paris"},
+                ]
+            )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["upserted"], 2)
+        alice = UserDevice.objects.get(username="alice")
+        self.assertEqual((alice.token, alice.platform), ("new", "android"))
+        self.assertEqual(UserDevice.objects.get(username="bob").timezone, "Europe/Paris")
+
+    def test_token_moves_to_another_device(self):
+        UserDevice.objects.create(username="alice", uuid="phone", token="shared")
+        response = self.post([{"username": "bob", "uuid": "phone", "token": "shared"}])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(UserDevice.objects.values_list("username", "token")), [("bob", "shared")])
+
+    def test_invalid_rows_are_reported_and_nothing_is_written(self):
+        response = self.post(
+            [
+                {"username": "alice", "uuid": "phone", "token": "t1"},
+                {"username": "bob", "uuid": "phone", "token": "t2", "timezone": "Mars/Olympus"},
+                {"username": "carol", "token": "t3"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["invalid_indexes"], [1, 2])
+        self.assertEqual(set(response.json()["errors"]), {"1", "2"})
+        self.assertFalse(UserDevice.objects.exists())
+
+    def test_empty_and_oversized_requests_are_rejected(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        devices = [{"username": "u", "uuid": str(i), "token": f"t{i}"} for i in range(10001)]
+        self.assertEqual(self.post(devices).status_code, 400)
+
+
+class TopicTests(FakeFCMTestCase):
+    fake_fcm_options = {"error_rate": 0.5}
+
+    def test_tokens_are_managed_in_bounded_calls(self):
+        tokens = make_tokens(7)
+        with mock.patch("fcm_messaging.utils.TOPIC_MANAGEMENT_MAX_TOKENS", 3):
+            success, detail = manage_topic("subscribe", "news", iter(tokens))
+
+        # the v1 topic API takes one request per token
+        self.assertEqual(self.server.stats["requests"], 7)
+        self.assertEqual(detail["success_count"] + detail["failure_count"], 7)
+        self.assertEqual(detail["failure_count"], self.server.stats["rejected_tokens"])
+        self.assertEqual(FCMLog.objects.get().failure_count, detail["failure_count"])
+
+    def test_errors_are_mapped_back_to_their_tokens(self):
+        tokens = make_tokens(7)
+
+        def subscribe(chunk, topic, app=None):
+            # rejects the odd tokens
+            results = [{"error": "NOT_FOUND"} if int(token.split("-")[1]) % 2 else {} for token in chunk]
+            return messaging.TopicManagementResponse({"results": results})
+
+        with mock.patch("fcm_messaging.utils.TOPIC_MANAGEMENT_MAX_TOKENS", 3), mock.patch.object(
+            messaging, "subscribe_to_topic", subscribe
+        ):
+            success, detail = manage_topic("subscribe", "news", tokens)
+
+        self.assertTrue(success)
+        self.assertEqual((detail["success_count"], detail["failure_count"]), (4, 3))
+        errors = [(error["index"], error["token"]) for error in detail["errors"]]
+        self.assertEqual(errors, [(1, "token-1"), (3, "token-3"), (5, "token-5")])
+
+    def test_usernames_without_devices_are_not_found(self):
+        data = {"usernames": ["nobody"], "group_name": "news", "action": "subscribe"}
+        response = self.client.post("/group/", data, content_type="application/json")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.server.stats["requests"], 0)
+
+
+class TopicMembershipTests(FakeFCMTestCase):
+    def test_subscriptions_are_mirrored(self):
+        self.create_devices("alice", 2)
+        data = {"usernames": ["alice"], "group_name": "news", "action": "subscribe"}
+        self.assertEqual(self.client.post("/group/", data, content_type="application/json").status_code, 200)
+        self.assertEqual(self.client.get("/group/", {"group_name": "news"}).json()["device_count"], 2)
+
+        data["action"] = "unsubscribe"
+        self.assertEqual(self.client.post("/group/", data, content_type="application/json").status_code, 200)
+        self.assertEqual(topic_audience_size("news"), 0)
+
+    def test_subscriptions_follow_a_token_rotation(self):
+        [device] = self.create_devices("alice", 1)
+        manage_topic("subscribe", "news", [device.token])
+
+        data = {"username": "alice", "uuid": device.uuid, "token": "alice-rotated"}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/device/", data, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        memberships = list(TopicMembership.objects.values_list("topic", "synced_token"))
+        self.assertEqual(memberships, [("news", "alice-rotated")])
+        # the new token was subscribed and the old one unsubscribed
+        self.assertEqual(self.server.stats["requests"], 3)
+
+    def test_memberships_stay_with_the_device_a_token_leaves(self):
+        UserDevice.objects.create(username="alice", uuid="phone", token="shared")
+        manage_topic("subscribe", "news", ["shared"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_upsert_devices([{"username": "bob", "uuid": "phone", "token": "shared"}])
+
+        self.assertFalse(TopicMembership.objects.exists())
+        self.assertEqual(self.server.stats["requests"], 2)
+
+    def test_changed_tokens_are_subscribed_again(self):
+        self.create_devices("alice", 2)
+        manage_topic("subscribe", "news", ["alice-token-0", "alice-token-1"])
+        UserDevice.objects.filter(token="alice-token-0").update(token="alice-token-2")
+
+        out = StringIO()
+        call_command("fcm_reconcile_topics", stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), "news: 1 re-subscribed, 0 failed")
+        self.assertFalse(stale_topic_memberships().exists())
+
+
+class AsyncSendTests(FakeFCMTestCase):
+    async def test_tokens_are_sent(self):
+        try:
+            success, detail = await asend_message_tokens("t", "b", make_tokens(3) + ["token-0", ""])
+        finally:
+            # pooled connections are bound to the event loop of the test, which is closed once it returns
+            await aclose_async_connections(self.app)
+
+        self.assertTrue(success)
+        self.assertEqual((detail["success_count"], detail["removed_count"]), (3, 2))
+        self.assertEqual(self.server.stats["messages"], 3)
+
+    async def test_usernames_are_sent(self):
+        await sync_to_async(self.create_devices)("alice", 2)
+        try:
+            success, detail = await asend_message_usernames("t", "b", ["alice", "nobody"])
+        finally:
+            await aclose_async_connections(self.app)
+
+        self.assertTrue(success)
+        self.assertEqual(detail["success_count"], 2)
+        self.assertEqual(await FCMLog.objects.acount(), 1)
+
+    async def test_usernames_without_devices_send_nothing(self):
+        success, detail = await asend_message_usernames("t", "b", ["nobody"])
+
+        self.assertEqual((success, detail), (False, "No valid tokens found for the given usernames."))
+        self.assertEqual(self.server.stats["requests"], 0)
+
+
+class AsyncViewTests(FakeFCMTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(AsyncAPIView, "permission_classes", [IsAuthenticated])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("staff", password="secret")
+        self.data = {"title": "t", "body": "b", "tokens": make_tokens(3)}
+
+    def post(self, client, **kwargs):
+        return client.post("/async/send-notification-tokens/", self.data, content_type="application/json", **kwargs)
+
+    def test_anonymous_requests_are_forbidden(self):
+        self.assertEqual(self.post(self.client).status_code, 403)
+        self.assertEqual(self.server.stats["requests"], 0)
+
+    def test_unauthenticated_requests_get_a_challenge(self):
+        with mock.patch.object(AsyncAPIView, "authentication_classes", [BasicAuthentication]):
+            response = self.post(self.client)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("WWW-Authenticate", response)
+
+    def test_session_requests_are_csrf_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.post(client).status_code, 403)
+
+    async def test_authenticated_requests_are_sent(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        try:
+            response = await self.post(self.async_client)
+        finally:
+            await aclose_async_connections(self.app)
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()["success"])
+        self.assertEqual(response.json()["detail"]["success_count"], 3)
+        self.assertEqual(self.server.stats["messages"], 3)
+        self.assertEqual(await FCMLog.objects.acount(), 1)
+
+
+class TransportTests(FakeFCMTestCase):
+    def test_connections_are_reused_across_sends(self):
+        before = transport_stats(self.app)["sync"]
+        for _ in range(2):
+            send_multicast(messaging.Notification(title="t", body="b"), make_tokens(20), app=self.app)
+        after = transport_stats(self.app)["sync"]
+
+        self.assertEqual(after["requests"] - before["requests"], 40)
+        self.assertLessEqual(after["connections"] - before["connections"], 20)
+
+    def test_transport_only_retries_without_per_token_retries(self):
+        self.assertEqual(transport_options()["retries"], 0)
+        with override_settings(FCM_MESSAGING_RETRY={"max_retries": 0}):
+            self.assertEqual(transport_options()["retries"], TRANSPORT_RETRIES)
+        with override_settings(FCM_MESSAGING_TRANSPORT={"retries": 2}):
+            self.assertEqual(transport_options()["retries"], 2)
+
+    def test_stats_endpoint(self):
+        response = self.client.get("/transport-stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"sync", "async"})
+
+
+class RetryTests(FakeFCMTestCase):
+    # one request out of every four is rejected with 429
+    fake_fcm_options = {"burst_every": 4, "burst_length": 1, "retry_after": 0}
+
+    def test_transient_errors_are_retried_per_token(self):
+        tokens = make_tokens(10)
+        response = send_multicast(messaging.Notification(title="t", body="b"), tokens, app=self.app)
+
+        self.assertEqual(response.tokens, tokens)
+        self.assertEqual(response.success_count, len(tokens))
+        self.assertGreater(response.retried, 0)
+        self.assertEqual(self.server.stats["quota"], response.retried)
+
+    @override_settings(FCM_MESSAGING_RETRY={"max_retries": 0})
+    def test_final_outcome_is_reported_without_retries(self):
+        response = send_multicast(messaging.Notification(title="t", body="b"), make_tokens(10), app=self.app)
+        self.assertEqual(response.retried, 0)
+        self.assertEqual(response.failure_count, 2)
+        errors = [r.exception for r in response.responses if r.exception]
+        self.assertTrue(all(isinstance(error, messaging.QuotaExceededError) for error in errors))
+
+
+@override_settings(FCM_MESSAGING_RATE_LIMIT={"rate": 10, "reserve": 0.2, "max_wait": 0})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # every call falls in the bucket of the same second
+        patcher = mock.patch("fcm_messaging.ratelimit.time.time", return_value=1000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_sends_leave_the_reserve_to_high_priority_sends(self):
+        self.assertEqual(lane_capacity(rate_limit_options(), PRIORITY_BULK), 8)
+        self.assertTrue(acquire(8))
+        self.assertFalse(acquire(1))
+        self.assertTrue(acquire(2, PRIORITY_HIGH))
+        self.assertFalse(acquire(1, PRIORITY_HIGH))
+
+    def test_bucket_is_seeded_again_when_it_expires_before_the_excess_is_returned(self):
+        key = RATE_LIMIT_CACHE_KEY.format(1000)
+        self.assertTrue(acquire(6))
+
+        def expire(*args, **kwargs):
+            cache.delete(key)
+            raise ValueError(f"Key '{key}' not found")
+
+        with mock.patch.object(cache, "decr", side_effect=expire):
+            self.assertFalse(acquire(4))
+        # the 2 tokens taken before the excess was returned
+        self.assertEqual(cache.get(key), 8)
+
+    @override_settings(FCM_MESSAGING_RATE_LIMIT=None)
+    def test_sends_are_not_limited_by_default(self):
+        self.assertTrue(acquire(10**6))
+
+
+class AudienceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_username_tokens_are_cached_until_a_device_changes(self):
+        device = UserDevice.objects.create(username="alice", uuid="phone", token="t1")
+        UserDevice.objects.create(username="alice", uuid="tablet", token="t2", is_active=False)
+
+        self.assertEqual([r.token for r in iter_username_tokens(["alice"])], ["t1"])
+        with self.assertNumQueries(0):
+            self.assertEqual([r.token for r in iter_username_tokens(["alice"])], ["t1"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            device.token = "t3"
+            device.save()
+        self.assertEqual([r.token for r in iter_username_tokens(["alice"])], ["t3"])
+
+    def test_admin_tokens_are_cached_until_a_device_changes(self):
+        UserDevice.objects.create(username="admin", uuid="phone", token="t1", is_dashboard_login=True)
+
+        self.assertEqual([r.token for r in admin_tokens()], ["t1"])
+        with self.assertNumQueries(0):
+            admin_tokens()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserDevice.objects.create(username="admin", uuid="tablet", token="t2", is_dashboard_login=True)
+        self.assertEqual(sorted(r.token for r in admin_tokens()), ["t1", "t2"])
+
+    @override_settings(FCM_MESSAGING_AUDIENCE_CACHE_TTL=0)
+    def test_cache_can_be_disabled(self):
+        UserDevice.objects.create(username="alice", uuid="phone", token="t1")
+        list(iter_username_tokens(["alice"]))
+        with self.assertNumQueries(1):
+            list(iter_username_tokens(["alice"]))
+
+
+@override_settings(ROOT_URLCONF="fcm_messaging.urls")
+class FirebaseConfigTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.dict("fcm_messaging.config._firebase_config", {"entry": None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_certificate(self):
+        return FCMCertificate.objects.create(
+            certificate_json={"project_id": "test-project"}, firebase_config={"apiKey": "key"}, vapid_key="vapid"
+        )
+
+    def test_config_is_served_with_validators(self):
+        self.create_certificate()
+        response = self.client.get("/config/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"firebase_config": {"apiKey": "key"}, "vapid_key": "vapid"})
+        self.assertIn("max-age=300", response["Cache-Control"])
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/config/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_saved_certificate_gets_a_new_etag_once_committed(self):
+        certificate = self.create_certificate()
+        etag = self.client.get("/config/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            certificate.vapid_key = "rotated"
+            certificate.save()
+        response = self.client.get("/config/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["vapid_key"], "rotated")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_missing_certificate_is_not_found(self):
+        self.assertEqual(self.client.get("/config/").status_code, 404)
+
+
+class DeliveryStatusTests(FakeFCMTestCase):
+    def test_deliveries_are_reported_per_username_and_device(self):
+        self.create_devices("alice", 2, platform="android")
+        send_message_usernames("t", "b", ["alice"])
+        success, detail = send_message_usernames("t", "b", ["alice"])
+
+        deliveries = detail["deliveries"]["alice"]
+        self.assertEqual(sorted(device["uuid"] for device in deliveries), ["alice-0", "alice-1"])
+        self.assertTrue(all(device["platform"] == "android" and device["message_id"] for device in deliveries))
+
+        first, last = FCMLog.objects.order_by("id")
+        deliveries = self.client.get("/delivery-status/", {"username": "alice"}).json()["deliveries"]
+        # the latest result of every device
+        self.assertEqual([(d["log_id"], d["success"]) for d in deliveries], [(last.pk, True), (last.pk, True)])
+
+        response = self.client.get("/delivery-status/", {"username": "alice", "log_id": first.pk, "limit": 1})
+        self.assertEqual([d["log_id"] for d in response.json()["deliveries"]], [first.pk])
+
+
+class AudienceNormalizerTests(TestCase):
+    def test_tokens_are_stripped_and_deduplicated(self):
+        normalizer = AudienceNormalizer()
+        tokens = list(normalizer.tokens([" a-1 ", "a-1", "", None, "bad token", "b:2"]))
+        self.assertEqual(tokens, ["a-1", "b:2"])
+        self.assertEqual(normalizer.removed, 4)
+
+    def test_recipients_of_a_token_already_seen_are_dropped(self):
+        recipients = [
+            Recipient("t1", "alice", "phone", None),
+            Recipient("t1", "bob", "phone", None),
+            Recipient("t2", "bob", "tablet", None),
+        ]
+        normalizer = AudienceNormalizer()
+        kept = [(recipient.token, recipient.username) for recipient in normalizer.recipients(recipients)]
+        self.assertEqual(kept, [("t1", "alice"), ("t2", "bob")])
+        self.assertEqual(normalizer.removed, 1)
+
+
+class FakeFCMServerTests(FakeFCMTestCase):
+    def test_topic_subscriptions_are_served(self):
+        tokens = make_tokens(3)
+        manage_topic("subscribe", "news", tokens)
+        success, detail = manage_topic("unsubscribe", "news", tokens)
+
+        self.assertTrue(success)
+        self.assertEqual(detail["success_count"], 3)
+        self.assertEqual(self.server.stats["requests"], 6)
+
+    def test_benchmark_reports_every_size(self):
+        out = StringIO()
+        call_command("fcm_benchmark", "--sizes", "1,20", "--repeat", "1", stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split("\t")[0] for line in lines[:3]], ["size", "1", "20"])
+        self.assertFalse(FCMLog.objects.exists())
+
+
+class MetricsTests(FakeFCMTestCase):
+    def setUp(self):
+        super().setUp()
+        # a backend of its own, the one of the process counts the sends of every test
+        patcher = mock.patch.dict("fcm_messaging.metrics._metrics", {"path": None, "backend": None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sends_are_counted_and_timed(self):
+        send_multicast(messaging.Notification(title="t", body="b"), make_tokens(3), app=self.app)
+        response = self.client.get("/metrics/")
+
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('fcm_messaging_tokens_total{outcome="sent"} 3', metrics)
+        self.assertIn('fcm_messaging_phase_seconds_count{phase="fcm_round_trip"} 1', metrics)
+
+    @override_settings(FCM_MESSAGING_METRICS=None)
+    def test_export_can_be_disabled(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 404)
+
+
+class SchedulingTests(FakeFCMTestCase):
+    def test_due_time_is_spread_by_the_jitter(self):
+        send_at = timezone.now() + timedelta(hours=1)
+        for _ in range(20):
+            notification = schedule_notification("admin", send_at, jitter=60, title="t", body="b")
+            self.assertTrue(send_at <= notification.due_at <= send_at + timedelta(seconds=60))
+
+    def test_only_due_notifications_are_claimed_and_sent(self):
+        now = timezone.now()
+        due = schedule_notification("tokens", now - timedelta(seconds=1), title="t", body="b", tokens=make_tokens(3))
+        schedule_notification("tokens", now + timedelta(hours=1), title="t", body="b", tokens=make_tokens(3))
+
+        claimed = claim_due_notifications(10)
+        self.assertEqual([n.pk for n in claimed], [due.pk])
+        self.assertEqual(claim_due_notifications(10), [])
+
+        notification = run_send_job(claimed[0])
+        self.assertEqual(notification.status, ScheduledNotification.Status.SUCCEEDED)
+        self.assertEqual((notification.success_count, notification.failure_count), (3, 0))
+
+    def test_abandoned_notifications_are_scheduled_again(self):
+        notification = schedule_notification("admin", timezone.now(), title="t", body="b")
+        self.assertEqual(len(claim_due_notifications(10)), 1)
+        ScheduledNotification.objects.filter(pk=notification.pk).update(
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+
+        claimed = claim_due_notifications(10)
+        self.assertEqual([(n.pk, n.attempts) for n in claimed], [(notification.pk, 2)])
+
+    def test_dispatcher_sends_due_notifications(self):
+        notification = schedule_notification("tokens", timezone.now(), title="t", body="b", tokens=make_tokens(2))
+
+        # the command would close the connection of the test transaction
+        with mock.patch("fcm_messaging.management.commands.fcm_dispatch_scheduled.close_old_connections"):
+            call_command("fcm_dispatch_scheduled", "--once", stdout=StringIO())
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, ScheduledNotification.Status.SUCCEEDED)
+        self.assertEqual(self.server.stats["messages"], 2)
+
+    def test_invalid_schedules_are_rejected(self):
+        for extra in [{"delay": "inf"}, {"delay": 1e12}, {"delay": -1}, {"delay": 10, "jitter": 1e12}, {}]:
+            data = {"kind": "token", "title": "t", "body": "b", "token": "x", **extra}
+            response = self.client.post("/scheduled-notifications/", data, content_type="application/json")
+            self.assertEqual(response.status_code, 400, extra)
+
+        data = {"kind": "token", "title": "t", "body": "b", "token": ["x"], "delay": 10}
+        response = self.client.post("/scheduled-notifications/", data, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        data = {"kind": "token", "title": "t", "body": "b", "token": "x", "delay": 10}
+        response = self.client.post("/scheduled-notifications/", data, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+
+class CampaignTests(TestCase):
+    def test_batches_are_spread_evenly_over_the_window(self):
+        start = datetime(2030, 1, 1, 12, tzinfo=dt_timezone.utc)
+        times = list(release_times(start, 3600, 4, dt_timezone.utc))
+        self.assertEqual(times, [start + timedelta(minutes=15 * i) for i in range(4)])
+
+    def test_quiet_hours_are_skipped(self):
+        start = datetime(2030, 1, 1, 21, 30, tzinfo=dt_timezone.utc)
+        quiet = parse_quiet_hours(["22:00", "08:00"])
+        times = list(release_times(start, 3600, 2, dt_timezone.utc, quiet))
+        self.assertEqual(times, [start, datetime(2030, 1, 2, 8, tzinfo=dt_timezone.utc)])
+
+    @override_settings(TIME_ZONE="UTC")
+    def test_batches_follow_the_timezone_of_every_user(self):
+        UserDevice.objects.create(username="paris", uuid="p", token="t1", timezone="Europe/Paris")
+        UserDevice.objects.create(username="tokyo", uuid="p", token="t2", timezone="Asia/Tokyo")
+        starts_at = datetime(2030, 6, 1, 9, tzinfo=dt_timezone.utc)
+
+        campaign = create_campaign("t", "b", ["paris", "tokyo"], starts_at, 600, by_timezone=True, quiet_hours=[])
+
+        due = {tuple(batch.payload["usernames"]): batch.due_at for batch in campaign.batches.all()}
+        # 09:00 local time in each timezone
+        self.assertEqual(due[("paris",)], datetime(2030, 6, 1, 7, tzinfo=dt_timezone.utc))
+        self.assertEqual(due[("tokyo",)], datetime(2030, 6, 1, 0, tzinfo=dt_timezone.utc))
+
+    def test_invalid_campaigns_are_rejected(self):
+        data = {"title": "t", "body": "b", "usernames": ["alice"], "window": 60}
+        with override_settings(ROOT_URLCONF="fcm_messaging.urls"):
+            for extra in [{"window": -1}, {"batch_size": 0}, {"window": "inf"}]:
+                response = self.client.post("/campaigns/", {**data, **extra}, content_type="application/json")
+                self.assertEqual(response.status_code, 400, extra)
+
+
+class TemplateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.template = NotificationTemplate.objects.create(
+            name="welcome", data={"screen": "home"}, android={"channel_id": "news"}
+        )
+        NotificationTemplateVariant.objects.create(template=self.template, locale="en", title="Hi $username", body="b")
+        NotificationTemplateVariant.objects.create(template=self.template, locale="fr", title="Salut", body="b")
+
+    def test_static_chunks_are_one_multicast_message(self):
+        bound = get_compiled_template(self.template.pk).bind({})
+        bound.locales = {"t1": "fr", "t2": "fr-CA"}
+
+        message = bound.build(["t1", "t2"], lambda token: {})
+        self.assertIsInstance(message, messaging.MulticastMessage)
+        self.assertEqual(message.notification.title, "Salut")
+        self.assertEqual(message.data, {"screen": "home"})
+        self.assertEqual(message.android.notification.channel_id, "news")
+
+    def test_variables_are_substituted_per_recipient(self):
+        bound = get_compiled_template(self.template.pk).bind({})
+        bound.locales = {"t2": "fr"}
+
+        messages = bound.build(["t1", "t2", "t3"], lambda token: {"username": f"user-{token}"})
+        self.assertEqual(
+            [(m.token, m.notification.title) for m in messages],
+            [("t1", "Hi user-t1"), ("t2", "Salut"), ("t3", "Hi user-t3")],
+        )
+
+    def test_compiled_template_is_reused_until_saved(self):
+        compiled = get_compiled_template(self.template.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(get_compiled_template(self.template.pk), compiled)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationTemplateVariant.objects.filter(locale="fr").update(title="Bonjour")
+            self.template.save()
+        self.assertEqual(get_compiled_template(self.template.pk).variant("fr").notification.title, "Bonjour")
+
+    def test_invalid_platform_overrides_are_rejected(self):
+        template = NotificationTemplate.objects.create(name="broken", android={"priority": "urgent"})
+        NotificationTemplateVariant.objects.create(template=template, locale="en", title="t", body="b")
+
+        with self.assertRaisesMessage(ValueError, "invalid platform overrides"):
+            get_compiled_template(template.pk)
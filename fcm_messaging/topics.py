@@ -0,0 +1,53 @@
+"""
+Local index of the topic (group) memberships managed through this app.
+FCM does not expose who is subscribed to a topic, so subscriptions are mirrored into TopicMembership.
+"""
+
+from django.db.models import F
+
+from .models import TopicMembership, UserDevice
+
+MEMBERSHIP_BATCH_SIZE = 1000
+
+
+def topic_name(topic):
+    """Topic name without the optional /topics/ prefix accepted by the Admin SDK."""
+    return topic[len("/topics/") :] if topic.startswith("/topics/") else topic
+
+
+def record_topic_memberships(action, topic, tokens):
+    """Mirrors a successful (un)subscription of `tokens` to `topic`, for the tokens of registered devices."""
+    topic = topic_name(topic)
+    for start in range(0, len(tokens), MEMBERSHIP_BATCH_SIZE):
+        chunk = tokens[start : start + MEMBERSHIP_BATCH_SIZE]
+        if action == "subscribe":
+            TopicMembership.objects.bulk_create(
+                [
+                    TopicMembership(device_id=device_id, topic=topic, synced_token=token)
+                    for device_id, token in UserDevice.objects.filter(token__in=chunk).values_list("id", "token")
+                ],
+                update_conflicts=True,
+                unique_fields=["device", "topic"],
+                update_fields=["synced_token", "updated_at"],
+            )
+        else:
+            TopicMembership.objects.filter(topic=topic, device__token__in=chunk).delete()
+
+
+def topic_audience_size(topic):
+    """Number of active devices subscribed to a topic."""
+    return TopicMembership.objects.filter(topic=topic_name(topic), device__is_active=True).count()
+
+
+def stale_topic_memberships():
+    """Memberships of active devices whose token changed since they were subscribed."""
+    return TopicMembership.objects.filter(device__is_active=True).exclude(synced_token=F("device__token"))
+
+
+def memberships_by_device(device_ids):
+    """The (topic, synced_token) memberships of the given devices, per device id."""
+    memberships = {}
+    rows = TopicMembership.objects.filter(device_id__in=device_ids).values_list("device_id", "topic", "synced_token")
+    for device_id, topic, token in rows:
+        memberships.setdefault(device_id, []).append((topic, token))
+    return memberships
@@ -0,0 +1,204 @@
+"""
+Tuning of the HTTP transport the Admin SDK uses for FCM.
+The messaging service of every Firebase app created by this plugin gets a connection pool, keep-alive,
+timeout and retry policy from FCM_MESSAGING_TRANSPORT, shared by all send and topic calls:
+
+    FCM_MESSAGING_TRANSPORT = {
+        "pool_size": 100,  # connections kept per host (sync) / in total (async)
+        "keepalive_expiry": 60,  # seconds an idle async connection is kept open
+        "http2": True,  # multiplex the async requests over HTTP/2
+        "timeout": 120,  # seconds, per request
+        "retries": None,  # retries on connection errors and on `retry_statuses`, see below
+        "retry_statuses": [500, 503],
+        "backoff_factor": 0.5,
+    }
+
+By default the transport only retries when the per-token retries of FCM_MESSAGING_RETRY are disabled
+(max_retries=0), with TRANSPORT_RETRIES retries. Retrying at both layers multiplied the attempts per token
+and ignored the send deadline that bounds the per-token retries.
+
+The SDK does not expose its HTTP clients, so they are replaced on its private messaging service. Every
+private attribute involved is looked up defensively: on an SDK release that moved it, the SDK's default
+transport is kept and a warning logged, and setup.py caps firebase-admin below its next major release.
+
+Only the async sends (aio.py) use HTTP/2. The sync sends go through the SDK's `requests` session, which
+speaks HTTP/1.1 only, so `http2` does not apply to them; `pool_size` is what bounds their concurrency.
+"""
+
+import asyncio
+import logging
+import weakref
+
+import httpx
+from django.conf import settings
+from firebase_admin import _http_client, _retry, messaging
+from requests.adapters import HTTPAdapter
+from urllib3.util import retry
+
+from .retry import retry_options
+
+FCM_HOST = "https://fcm.googleapis.com"
+
+# Transport retries used when the per-token retries are disabled
+TRANSPORT_RETRIES = 4
+
+DEFAULT_TRANSPORT = {
+    "pool_size": 100,
+    "keepalive_expiry": 60,
+    "http2": True,
+    "timeout": _http_client.DEFAULT_TIMEOUT_SECONDS,
+    "retries": None,
+    "retry_statuses": [500, 503],
+    "backoff_factor": 0.5,
+}
+
+logger = logging.getLogger(__name__)
+
+# Async transport installed by configure_transport and its request counter, per Firebase app
+_async_transports = weakref.WeakKeyDictionary()
+# Tasks closing replaced async clients from within a running event loop
+_closing_clients = set()
+
+
+def transport_options():
+    options = {**DEFAULT_TRANSPORT, **getattr(settings, "FCM_MESSAGING_TRANSPORT", {})}
+    if options["retries"] is None:
+        options["retries"] = 0 if retry_options()["max_retries"] else TRANSPORT_RETRIES
+    return options
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter reporting how many requests its connections served."""
+
+    def stats(self):
+        pools = [self.poolmanager.pools[key] for key in self.poolmanager.pools.keys()]
+        return {
+            "connections": sum(pool.num_connections for pool in pools),
+            "requests": sum(pool.num_requests for pool in pools),
+        }
+
+
+def configure_transport(app):
+    """
+    Applies FCM_MESSAGING_TRANSPORT to the messaging service of a Firebase app.
+    The timeout is passed as the httpTimeout option when the app is created, see utils.get_firebase_app.
+    """
+    options = transport_options()
+    service = messaging._get_messaging_service(app)
+    _configure_sync_transport(service, options)
+    _configure_async_transport(app, service, options)
+
+
+def _configure_sync_transport(service, options):
+    session = getattr(getattr(service, "_client", None), "session", None)
+    if session is None:
+        logger.warning("Unsupported firebase-admin messaging client, keeping its default sync transport.")
+        return
+
+    adapter = CountingHTTPAdapter(
+        pool_connections=options["pool_size"],
+        pool_maxsize=options["pool_size"],
+        max_retries=retry.Retry(
+            connect=options["retries"],
+            read=options["retries"],
+            status=options["retries"],
+            status_forcelist=options["retry_statuses"],
+            backoff_factor=options["backoff_factor"],
+            raise_on_status=False,
+            respect_retry_after_header=True,
+            allowed_methods=None,
+        ),
+    )
+    session.mount(FCM_HOST, adapter)
+
+
+def _configure_async_transport(app, service, options):
+    async_client = getattr(service, "_async_client", None)
+    replaced = getattr(async_client, "_async_client", None)
+    credential = getattr(service, "_credential", None)
+    if not isinstance(replaced, httpx.AsyncClient) or credential is None or not hasattr(async_client, "_headers"):
+        logger.warning("Unsupported firebase-admin async messaging client, keeping its default async transport.")
+        return
+
+    counter = {"requests": 0}
+
+    async def count_request(request):
+        counter["requests"] += 1
+
+    httpx_retry = _retry.HttpxRetry(
+        max_retries=options["retries"],
+        status_forcelist=options["retry_statuses"],
+        backoff_factor=options["backoff_factor"],
+        respect_retry_after_header=True,
+    )
+    limits = httpx.Limits(
+        max_connections=options["pool_size"],
+        max_keepalive_connections=options["pool_size"],
+        keepalive_expiry=options["keepalive_expiry"],
+    )
+    # HttpxRetryTransport always enables HTTP/2 on the transport it wraps
+    transport = _retry.HttpxRetryTransport(retry=httpx_retry, limits=limits)
+    if not options["http2"] and hasattr(transport, "_wrapped_transport"):
+        transport._wrapped_transport = httpx.AsyncHTTPTransport(retries=0, http2=False, limits=limits)
+
+    async_client._async_client = httpx.AsyncClient(
+        http2=options["http2"],
+        timeout=options["timeout"],
+        headers=async_client._headers,
+        auth=_http_client.GoogleAuthCredentialFlow(credential),
+        mounts={"http://": transport, "https://": transport},
+        event_hooks={"request": [count_request]},
+    )
+    async_client._transport = transport
+    _async_transports[app] = {"transport": transport, "counter": counter}
+    _close_async_client(replaced)
+
+
+def _close_async_client(client):
+    """
+    Closes an httpx.AsyncClient from sync code. The clients replaced by configure_transport never sent a
+    request, so there is no connection to wait for.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(client.aclose())
+        return
+    task = loop.create_task(client.aclose())
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+
+async def aclose_async_connections(app):
+    """
+    Closes the pooled async connections of a Firebase app. They are bound to the event loop that opened them,
+    so callers running every send on a new event loop (e.g. through async_to_sync) close them after each send.
+    The transport stays usable and opens new connections on the next send.
+    """
+    installed = _async_transports.get(app)
+    if installed is not None:
+        await installed["transport"].aclose()
+
+
+def _open_connections(transport):
+    pool = getattr(getattr(transport, "_wrapped_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    return len(connections) if connections is not None else None
+
+
+def transport_stats(app):
+    """Connection reuse of the FCM transport of a Firebase app: connections opened vs requests served."""
+    service = messaging._get_messaging_service(app)
+    session = getattr(getattr(service, "_client", None), "session", None)
+    adapter = session.get_adapter(FCM_HOST) if session is not None else None
+    sync_stats = adapter.stats() if isinstance(adapter, CountingHTTPAdapter) else {"connections": 0, "requests": 0}
+
+    installed = _async_transports.get(app)
+    async_stats = {
+        "open_connections": _open_connections(installed["transport"]) if installed else 0,
+        "requests": installed["counter"]["requests"] if installed else 0,
+    }
+
+    if sync_stats["connections"]:
+        sync_stats["reuse_ratio"] = round(sync_stats["requests"] / sync_stats["connections"], 2)
+    return {"sync": sync_stats, "async": async_stats}
@@ -1,16 +1,27 @@
 from django.urls import path
 
+from . import async_views
 from .views import (
+    CampaignDetailView,
+    CampaignView,
     CertificateUploadView,
+    DeliveryStatusView,
     DeviceGroupView,
     FirebaseConfigView,
     GetUserDeviceView,
+    MetricsView,
+    ScheduledNotificationDetailView,
+    ScheduledNotificationView,
+    SendJobStatusView,
     SendNotificationAdminView,
     SendNotificationGroupView,
+    SendNotificationTemplateView,
     SendNotificationToTokensView,
     SendNotificationToTokenView,
     SendNotificationToUsernamesView,
     SendNotificationToUsernameView,
+    TransportStatsView,
+    UserDeviceBulkView,
     UserDeviceDetailView,
 )
 
@@ -18,12 +29,56 @@ urlpatterns = [
     path("config/", FirebaseConfigView.as_view(), name="firebase-config"),
     path("certificate/", CertificateUploadView.as_view(), name="certificate-management"),
     path("devices/", GetUserDeviceView.as_view(), name="list-devices"),
+    path("devices/bulk/", UserDeviceBulkView.as_view(), name="bulk-register-devices"),
     path("device/", UserDeviceDetailView.as_view(), name="device-detail"),
     path("group/", DeviceGroupView.as_view(), name="device-group-management"),
     path("send-notification-admin/", SendNotificationAdminView.as_view(), name="send-notification-to-admin"),
     path("send-notification-group/", SendNotificationGroupView.as_view(), name="send-notification-to-group"),
+    path("send-notification-template/", SendNotificationTemplateView.as_view(), name="send-notification-template"),
     path("send-notification-token/", SendNotificationToTokenView.as_view(), name="send-notification-to-token"),
     path("send-notification-tokens/", SendNotificationToTokensView.as_view(), name="send-notification-to-tokens"),
     path("send-notification-username/", SendNotificationToUsernameView.as_view(), name="send-notification-to-username"),
-    path("send-notification-usernames/", SendNotificationToUsernamesView.as_view(), name="send-notification-to-usernames"),
+    path(
+        "send-notification-usernames/",
+        SendNotificationToUsernamesView.as_view(),
+        name="send-notification-to-usernames",
+    ),
+    path("send-jobs/<int:pk>/", SendJobStatusView.as_view(), name="send-job-status"),
+    path("scheduled-notifications/", ScheduledNotificationView.as_view(), name="schedule-notification"),
+    path(
+        "scheduled-notifications/<int:pk>/",
+        ScheduledNotificationDetailView.as_view(),
+        name="scheduled-notification-detail",
+    ),
+    path("transport-stats/", TransportStatsView.as_view(), name="transport-stats"),
+    path("delivery-status/", DeliveryStatusView.as_view(), name="delivery-status"),
+    path("campaigns/", CampaignView.as_view(), name="campaigns"),
+    path("campaigns/<int:pk>/", CampaignDetailView.as_view(), name="campaign-detail"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    # asyncio-native send views, for ASGI deployments
+    path(
+        "async/send-notification-admin/",
+        async_views.SendNotificationAdminView.as_view(),
+        name="async-send-notification-to-admin",
+    ),
+    path(
+        "async/send-notification-token/",
+        async_views.SendNotificationToTokenView.as_view(),
+        name="async-send-notification-to-token",
+    ),
+    path(
+        "async/send-notification-tokens/",
+        async_views.SendNotificationToTokensView.as_view(),
+        name="async-send-notification-to-tokens",
+    ),
+    path(
+        "async/send-notification-username/",
+        async_views.SendNotificationToUsernameView.as_view(),
+        name="async-send-notification-to-username",
+    ),
+    path(
+        "async/send-notification-usernames/",
+        async_views.SendNotificationToUsernamesView.as_view(),
+        name="async-send-notification-to-usernames",
+    ),
 ]
@@ -1,129 +1,628 @@
+import hashlib
 import json
+import logging
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 
 import firebase_admin
-from firebase_admin import messaging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from firebase_admin import exceptions, messaging
 from firebase_admin.messaging import BatchResponse
 
-from .models import FCMCertificate, FCMLog, UserDevice
+from .audience import AudienceNormalizer, admin_tokens, invalidate_audience_cache, iter_username_tokens
+from .message_templates import get_compiled_template
+from .metrics import increment, record_sends, timed, timed_iter
+from .models import FCMCertificate, FCMLog, FCMLogEntry, NotificationTemplate, UserDevice
+from .ratelimit import PRIORITY_BULK, PRIORITY_HIGH, RateLimitExceeded, acquire
+from .retry import retry_failed
+from .topics import record_topic_memberships
+from .transport import configure_transport, transport_options
+
+logger = logging.getLogger(__name__)
 
 # return format
 # success, message
 
+# FCM rejects multicast messages addressed to more than 500 tokens
+MULTICAST_MAX_TOKENS = 500
+# and topic management calls addressed to more than 1000
+TOPIC_MANAGEMENT_MAX_TOKENS = 1000
+# error of manage_topic when the audience has no token
+NO_TOPIC_TOKENS = "No valid tokens found."
+DEFAULT_SEND_WORKERS = 4
+
+# Per-token errors after which a token will never be deliverable again
+INVALID_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+# INVALID_ARGUMENT is only about the token when FCM names the token field, otherwise the message is invalid
+INVALID_TOKEN_FIELDS = ("message.token",)
+
+# FCM error codes of the messaging errors the Admin SDK reports with a more generic canonical code
+FCM_ERROR_CODES = {
+    messaging.UnregisteredError: "UNREGISTERED",
+    messaging.SenderIdMismatchError: "SENDER_ID_MISMATCH",
+    messaging.QuotaExceededError: "QUOTA_EXCEEDED",
+    messaging.ThirdPartyAuthError: "THIRD_PARTY_AUTH_ERROR",
+}
+PRUNE_BATCH_SIZE = 1000
+
+# Log rows are written off the request thread, in bulk_create batches of this size
+LOG_BATCH_SIZE = 1000
+_log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fcm-log")
+# Log entries queued for the log thread at most; past it, sends write their log inline
+MAX_PENDING_LOG_ENTRIES = 100000
+_pending_log_entries = {"count": 0}
+_pending_log_lock = threading.Lock()
+
+# Worker pool of the multicast chunks, see send_executor
+_send_executor = {"executor": None, "max_workers": None}
+_send_executor_lock = threading.Lock()
+
+FIREBASE_APP_NAME = "fcm_messaging"
+CERTIFICATE_FINGERPRINT_CACHE_KEY = "fcm_messaging:certificate_fingerprint"
+
+# process-wide Firebase app and the fingerprint of the certificate it was created from
+_firebase_app = {"app": None, "fingerprint": None, "stale": False}
+_firebase_app_lock = threading.Lock()
+# Seconds a Firebase app replaced by a certificate rotation stays usable for the sends still running on it
+RETIRED_APP_GRACE_PERIOD = 600
+
+# callback receiving the (success, failure) counts of every multicast chunk sent in this context
+_progress_callback = ContextVar("fcm_messaging_progress", default=None)
+
+
+def certificate_fingerprint(certificate_json):
+    """Stable hash of a service account certificate, used to detect certificate rotations."""
+    if isinstance(certificate_json, str):
+        certificate_json = json.loads(certificate_json)
+    return hashlib.sha256(json.dumps(certificate_json, sort_keys=True).encode()).hexdigest()
+
+
+def get_firebase_app():
+    """
+    Returns the Firebase app of this plugin as (app, error).
+    The app is cached per process and keyed on the certificate fingerprint, so the certificate is only
+    looked up again once `invalidate_firebase_app` reports a change (in this process or, through the
+    shared cache, in another one) or the published fingerprint left the cache. The app is then re-created
+    from the new certificate without a restart.
+    """
+    with timed("firebase_app"):
+        return _get_firebase_app()
+
+
+def _get_firebase_app():
+    app, fingerprint = _firebase_app["app"], _firebase_app["fingerprint"]
+    # a missing fingerprint may hide a rotation whose entry was evicted, so it counts as stale
+    if app is not None and not _firebase_app["stale"] and cache.get(CERTIFICATE_FINGERPRINT_CACHE_KEY) == fingerprint:
+        return app, None
+
+    with _firebase_app_lock:
+        cert_instance = FCMCertificate.objects.first()
+        if not cert_instance or not cert_instance.certificate_json:
+            return None, "No FCM certificate found or certificate JSON is missing."
+
+        try:
+            certificate_json = cert_instance.certificate_json
+            if isinstance(certificate_json, str):
+                certificate_json = json.loads(certificate_json)
+            new_fingerprint = certificate_fingerprint(certificate_json)
+
+            app = _firebase_app["app"]
+            if app is None or new_fingerprint != _firebase_app["fingerprint"]:
+                cred = firebase_admin.credentials.Certificate(certificate_json)
+                new_app = firebase_admin.initialize_app(
+                    cred,
+                    options={"httpTimeout": transport_options()["timeout"]},
+                    name=f"{FIREBASE_APP_NAME}-{new_fingerprint[:16]}",
+                )
+                configure_transport(new_app)
+                _firebase_app.update(app=new_app, fingerprint=new_fingerprint)
+                if app is not None:
+                    _retire_firebase_app(app)
+            _firebase_app["stale"] = False
+            cache.add(CERTIFICATE_FINGERPRINT_CACHE_KEY, new_fingerprint, timeout=None)
+            return _firebase_app["app"], None
+        except json.JSONDecodeError:
+            return None, "Invalid JSON format in FCM certificate."
+        except Exception as e:
+            return None, f"Failed to initialize Firebase: {str(e)}"
+
+
+def _retire_firebase_app(app):
+    """
+    Deletes a Firebase app replaced by a certificate rotation after RETIRED_APP_GRACE_PERIOD seconds rather
+    than right away, so the sends still running on it (chunk workers, retries) finish normally.
+    """
+    timer = threading.Timer(RETIRED_APP_GRACE_PERIOD, _delete_firebase_app, args=(app,))
+    timer.daemon = True
+    timer.start()
 
-def initialize_firebase_app():
-    """Initializes the Firebase app if it hasn't been already."""
-    if firebase_admin._apps:
-        return True, None
 
-    cert_instance = FCMCertificate.objects.first()
-    if not cert_instance or not cert_instance.certificate_json:
-        return False, "No FCM certificate found or certificate JSON is missing."
+def _delete_firebase_app(app):
+    try:
+        firebase_admin.delete_app(app)
+    except ValueError:
+        # already deleted
+        pass
+    except Exception:
+        logger.warning("Failed to delete the retired Firebase app %s", app.name, exc_info=True)
+
 
+@contextmanager
+def reporting_progress(callback):
+    """
+    Calls `callback(success_count, failure_count)` as the multicast chunks sent in this context complete,
+    before their failed tokens are retried, e.g. to update the counts of a job while it runs.
+    """
+    token = _progress_callback.set(callback)
     try:
-        cred = firebase_admin.credentials.Certificate(cert_instance.certificate_json)
-        firebase_admin.initialize_app(cred)
-        return True, None
-    except json.JSONDecodeError:
-        return False, "Invalid JSON format in FCM certificate."
-    except Exception as e:
-        return False, f"Failed to initialize Firebase: {str(e)}"
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+
+def _report_progress(response):
+    callback = _progress_callback.get()
+    if callback is not None:
+        callback(response.success_count, response.failure_count)
+
+
+def invalidate_firebase_app(fingerprint):
+    """
+    Publishes the fingerprint of a saved certificate (None if it is not valid JSON) so every process
+    re-creates its Firebase app. Called once the certificate is committed, see signals.py.
+    """
+    cache.set(CERTIFICATE_FINGERPRINT_CACHE_KEY, fingerprint, timeout=None)
+    # the default cache backend is not shared between processes, make sure this one reloads in any case
+    _firebase_app["stale"] = True
+
+
+def initialize_firebase_app():
+    """Initializes the Firebase app if it hasn't been already."""
+    app, message = get_firebase_app()
+    return app is not None, message
 
 
 def send_message_tokens(title, body, tokens):
     """Sends a notification to a list of FCM tokens."""
-    initialized, message = initialize_firebase_app()
-    if not initialized:
-        return initialized, message
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
     try:
-        # Build multicast message
-        multicast_message = messaging.MulticastMessage(
-            notification=messaging.Notification(title=title, body=body),
-            tokens=tokens,
-        )
+        normalizer = AudienceNormalizer()
+        response = send_multicast(messaging.Notification(title=title, body=body), normalizer.tokens(tokens), app=app)
+        response.removed = normalizer.removed
+
+        if not response.responses:
+            return False, "No valid tokens found"
 
-        # Send the message to all tokens at once
-        response = messaging.send_each_for_multicast(multicast_message)
-        success = log_fcm_response(tokens=tokens, message_title=title, message_body=body, response=response)
+        success = log_fcm_response(message_title=title, message_body=body, response=response)
+        prune_invalid_tokens(response.tokens, response)
         return success, format_batch_response(response)
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Failed to send notification to tokens")
         return False, "Notification sending failed"
 
 
 def send_message_token(title, body, token):
     """Sends a notification to a single FCM token."""
-    initialized, message = initialize_firebase_app()
-    if not initialized:
-        return initialized, message
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
     try:
         message = messaging.Message(
             notification=messaging.Notification(title=title, body=body),
             token=token,
         )
-        response = messaging.send(message)
-        success = log_fcm_response(tokens=token, message_title=title, message_body=body, response=response)
-        return success, response
-    except Exception as e:
-        print(e)
+        started = time.monotonic()
+        responses, retried = retry_failed(
+            [token], [_send_single(message, app)], lambda tokens: [_send_single(message, app)], started
+        )
+        response = MulticastResponse(responses, [token], retried=retried)
+        record_sends(response)
+        log_fcm_response(message_title=title, message_body=body, response=response)
+        prune_invalid_tokens([token], response)
+        if not response.responses[0].success:
+            return False, "Notification sending failed"
+        return True, response.responses[0].message_id
+    except Exception:
+        logger.exception("Failed to send notification to token")
         return False, "Notification sending failed"
 
 
+def send_message_topic(title, body, topic):
+    """Sends a notification to every device subscribed to a topic (group)."""
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
+    try:
+        message = messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            topic=topic,
+        )
+        with timed("rate_limit"):
+            if not acquire(1, PRIORITY_BULK):
+                raise RateLimitExceeded()
+        with timed("fcm_round_trip"):
+            return True, messaging.send(message, app=app)
+    except Exception as e:
+        return False, f"Failed to send message: {str(e)}"
+
+
 def send_message_usernames(title, body, usernames):
     """Sends a notification to a list of usernames."""
-    initialized, message = initialize_firebase_app()
-    if not initialized:
-        return initialized, message
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
     try:
-        user_devices = UserDevice.objects.filter(username__in=usernames)
-        tokens = [ud.token for ud in user_devices]
+        normalizer = AudienceNormalizer()
+        recipients = []
 
-        if not tokens:
-            return False, "No valid tokens found for the given usernames."
+        def tokens():
+            for recipient in normalizer.recipients(iter_username_tokens(usernames)):
+                recipients.append(recipient)
+                yield recipient.token
 
-        # Build multicast message
-        multicast_message = messaging.MulticastMessage(
-            notification=messaging.Notification(title=title, body=body),
-            tokens=tokens,
-        )
+        response = send_multicast(messaging.Notification(title=title, body=body), tokens(), app=app)
+        response.recipients = recipients
+        response.removed = normalizer.removed
+
+        if not response.responses:
+            return False, "No valid tokens found for the given usernames."
 
-        # Send the message to all tokens at once
-        response = messaging.send_each_for_multicast(multicast_message)
-        success = log_fcm_response(usernames=usernames, message_title=title, message_body=body, response=response)
+        success = log_fcm_response(message_title=title, message_body=body, response=response)
+        prune_invalid_tokens(response.tokens, response)
         return success, format_batch_response(response)
     except UserDevice.DoesNotExist:
         return False, "One or more users not found"
     except Exception:
+        logger.exception("Failed to send notification to usernames")
+        return False, "Notification sending failed"
+
+
+def send_message_template(template_id, tokens=None, usernames=None, context=None, variables=None):
+    """
+    Sends a NotificationTemplate (see message_templates.py) to a list of FCM tokens or usernames.
+    - context: variables of the whole send
+    - variables: variables of each recipient, keyed by username (by token for a token audience); the
+      username of a recipient of a username audience is also available as $username
+    """
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
+    try:
+        template = get_compiled_template(template_id)
+    except NotificationTemplate.DoesNotExist:
+        return False, "Notification template not found"
+    except ValueError as e:
+        return False, f"Invalid notification template: {str(e)}"
+
+    try:
+        normalizer = AudienceNormalizer()
+        variables = variables or {}
+        recipients = []
+        usernames_by_token = {}
+
+        def recipient_tokens():
+            for recipient in normalizer.recipients(iter_username_tokens(usernames)):
+                recipients.append(recipient)
+                usernames_by_token[recipient.token] = recipient.username
+                yield recipient.token
+
+        def variables_for(token):
+            username = usernames_by_token.get(token)
+            if username is None:
+                return variables.get(token, {})
+            return {"username": username, **variables.get(username, {})}
+
+        bound = template.bind(context)
+        audience = recipient_tokens() if usernames is not None else normalizer.tokens(tokens or [])
+        response = send_multicast(
+            None,
+            bound.track_locales(audience, MULTICAST_MAX_TOKENS),
+            app=app,
+            build=lambda chunk: bound.build(chunk, variables_for),
+        )
+        response.recipients = recipients if usernames is not None else None
+        response.removed = normalizer.removed
+
+        if not response.responses:
+            return False, "No valid tokens found"
+
+        variant = template.default_variant()
+        success = log_fcm_response(
+            message_title=variant.title.template, message_body=variant.body.template, response=response
+        )
+        prune_invalid_tokens(response.tokens, response)
+        return success, format_batch_response(response)
+    except Exception:
+        logger.exception("Failed to send notification template")
         return False, "Notification sending failed"
 
 
 def send_message_admin(title, body):
-    initialized, message = initialize_firebase_app()
-    if not initialized:
-        return initialized, message
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
     try:
-        user_devices = UserDevice.objects.filter(is_dashboard_login=True)
-        tokens = [ud.token for ud in user_devices]
-        usernames = [ud.username for ud in user_devices]
+        normalizer = AudienceNormalizer()
+        recipients = list(normalizer.recipients(admin_tokens()))
+        tokens = [recipient.token for recipient in recipients]
 
         if not tokens:
             return False, "No valid tokens found"
 
-        # Build multicast message
-        multicast_message = messaging.MulticastMessage(
-            notification=messaging.Notification(title=title, body=body),
-            tokens=tokens,
+        response = send_multicast(
+            messaging.Notification(title=title, body=body), tokens, app=app, priority=PRIORITY_HIGH
         )
-
-        # Send the message to all tokens at once
-        response = messaging.send_each_for_multicast(multicast_message)
-        success = log_fcm_response(usernames=usernames, message_title=title, message_body=body, response=response)
+        response.recipients = recipients
+        response.removed = normalizer.removed
+        success = log_fcm_response(message_title=title, message_body=body, response=response)
+        prune_invalid_tokens(tokens, response)
         return success, format_batch_response(response)
     except UserDevice.DoesNotExist:
         return False, "Users not found"
     except Exception:
+        logger.exception("Failed to send notification to admins")
         return False, "Notification sending failed"
 
 
+def chunked(items, size):
+    """Yields successive lists of at most `size` items from any iterable, consuming it lazily."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class MulticastResponse(BatchResponse):
+    """
+    A BatchResponse that also carries the tokens its responses line up with, how many sends were retried,
+    how many tokens the audience normalization removed and, for audiences resolved from usernames, the
+    audience.Recipient of every token.
+    """
+
+    def __init__(self, responses, tokens, retried=0, recipients=None, removed=0):
+        super().__init__(responses)
+        self.tokens = tokens
+        self.retried = retried
+        self.recipients = recipients
+        self.removed = removed
+
+
+def send_multicast(notification, tokens, app=None, priority=PRIORITY_BULK, build=None):
+    """
+    Sends a notification to any number of tokens.
+    `tokens` may be any iterable, e.g. a streaming audience query: it is consumed lazily in chunks of
+    MULTICAST_MAX_TOKENS (see dispatch_chunks). The per-chunk BatchResponses are merged back into a
+    single MulticastResponse whose responses line up with its `tokens`.
+    `build(chunk)` optionally replaces the notification: it returns the messages of a chunk, a
+    MulticastMessage or a list of Messages lining up with the chunk (see message_templates.py).
+    Tokens that failed with a transient error are then re-sent (see retry.retry_failed), so the
+    responses hold the final outcome per token. Every chunk waits for capacity in the `priority` lane of
+    the rate limiter (see ratelimit.acquire).
+    """
+    started = time.monotonic()
+
+    if build is None:
+
+        def build(chunk):
+            return messaging.MulticastMessage(notification=notification, tokens=chunk)
+
+    def send(tokens, on_result=None):
+        return dispatch_chunks(
+            tokens,
+            MULTICAST_MAX_TOKENS,
+            lambda chunk: _send_multicast_chunk(build, chunk, app, priority),
+            on_result=on_result,
+        )
+
+    def resend(tokens):
+        _, responses = send(tokens)
+        return [r for response in responses for r in response.responses]
+
+    sent_tokens, responses = send(timed_iter(tokens, "audience"), on_result=_report_progress)
+    response = merge_batch_responses(responses, sent_tokens)
+    responses, retried = retry_failed(sent_tokens, response.responses, resend, started)
+    response = MulticastResponse(responses, sent_tokens, retried=retried)
+    record_sends(response)
+    return response
+
+
+def dispatch_chunks(items, size, send_chunk, on_result=None):
+    """
+    Consumes `items` lazily in chunks of `size` and calls `send_chunk(chunk)` for each chunk as it comes in,
+    concurrently over the worker pool shared by every send of the process (see send_executor).
+    Returns the consumed items and the results of `send_chunk`, both in order. `on_result(result)` is
+    called in the calling thread as every result is collected.
+    """
+    executor, max_workers = send_executor()
+    dispatched = []
+    results = []
+    pending = deque()
+
+    def collect(future):
+        results.append(future.result())
+        if on_result is not None:
+            on_result(results[-1])
+
+    for chunk in chunked(items, size):
+        dispatched.extend(chunk)
+        pending.append(executor.submit(_run_chunk, send_chunk, chunk))
+        # Bound the chunks held in memory instead of draining the whole audience up front
+        if len(pending) >= 2 * max_workers:
+            collect(pending.popleft())
+    for future in pending:
+        collect(future)
+
+    return dispatched, results
+
+
+def send_executor():
+    """
+    Returns the worker pool of the chunk sends and its size. It is created on first use with
+    FCM_MESSAGING_SEND_WORKERS threads and shared by every send of the process, so concurrent sends do
+    not multiply the connections and threads in use.
+    """
+    with _send_executor_lock:
+        if _send_executor["executor"] is None:
+            max_workers = getattr(settings, "FCM_MESSAGING_SEND_WORKERS", DEFAULT_SEND_WORKERS)
+            _send_executor.update(
+                executor=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fcm-send"),
+                max_workers=max_workers,
+            )
+        return _send_executor["executor"], _send_executor["max_workers"]
+
+
+def _run_chunk(send_chunk, chunk):
+    try:
+        return send_chunk(chunk)
+    finally:
+        # the pool threads outlive the send, drop their connections broken or past CONN_MAX_AGE
+        close_old_connections()
+
+
+def _send_multicast_chunk(build, tokens, app, priority):
+    try:
+        with timed("build"):
+            message = build(tokens)
+        with timed("rate_limit"):
+            if not acquire(len(tokens), priority):
+                raise RateLimitExceeded()
+        with timed("fcm_round_trip"):
+            if isinstance(message, list):
+                return messaging.send_each(message, app=app)
+            return messaging.send_each_for_multicast(message, app=app)
+    except Exception as e:
+        # A failed chunk must not discard the results of the other chunks, report it per token instead
+        return BatchResponse([messaging.SendResponse(None, e) for _ in tokens])
+
+
+def _send_single(message, app):
+    """Sends one message in the high-priority lane and reports the outcome as a SendResponse."""
+    try:
+        with timed("rate_limit"):
+            if not acquire(1, PRIORITY_HIGH):
+                raise RateLimitExceeded()
+        with timed("fcm_round_trip"):
+            return messaging.SendResponse({"name": messaging.send(message, app=app)}, None)
+    except exceptions.FirebaseError as e:
+        return messaging.SendResponse(None, e)
+
+
+def merge_batch_responses(responses, tokens):
+    """Merges several BatchResponses into one, preserving the order of the individual responses."""
+    return MulticastResponse([r for response in responses for r in response.responses], tokens)
+
+
+def manage_topic(action, topic, tokens):
+    """
+    Subscribes (action="subscribe") or unsubscribes (action="unsubscribe") any number of tokens to a topic.
+    The tokens are sent in concurrent calls of TOPIC_MANAGEMENT_MAX_TOKENS, and the errors of the per-call
+    TopicManagementResponses are mapped back to the original tokens and logged through log_fcm_response.
+    Successful (un)subscriptions are mirrored into the local TopicMembership index.
+    """
+    app, message = get_firebase_app()
+    if app is None:
+        return False, message
+
+    manage = messaging.subscribe_to_topic if action == "subscribe" else messaging.unsubscribe_from_topic
+
+    def manage_chunk(chunk):
+        try:
+            return manage(chunk, topic, app=app)
+        except Exception as e:
+            return messaging.TopicManagementResponse({"results": [{"error": str(e)} for _ in chunk]})
+
+    tokens, responses = dispatch_chunks(tokens, TOPIC_MANAGEMENT_MAX_TOKENS, manage_chunk)
+    if not tokens:
+        return False, NO_TOPIC_TOKENS
+
+    response = merge_topic_management_responses(responses)
+    success = log_fcm_response(message_title=f"Topic {action}", message_body=topic, tokens=tokens, response=response)
+
+    failed = {e.index for e in response.errors}
+    record_topic_memberships(action, topic, [token for i, token in enumerate(tokens) if i not in failed])
+    return success, {
+        "success_count": response.success_count,
+        "failure_count": response.failure_count,
+        "errors": [{"index": e.index, "token": tokens[e.index], "reason": e.reason} for e in response.errors],
+    }
+
+
+def merge_topic_management_responses(responses):
+    """Merges several TopicManagementResponses into one, with error indexes relative to the merged tokens."""
+    results = []
+    for response in responses:
+        errors = {e.index: e.reason for e in response.errors}
+        results.extend(
+            {"error": errors[i]} if i in errors else {} for i in range(response.success_count + response.failure_count)
+        )
+    return messaging.TopicManagementResponse({"results": results})
+
+
+def prune_invalid_tokens(tokens, response):
+    """
+    Removes the devices whose token FCM reported as unregistered, invalid or owned by another sender
+    (see is_invalid_token_error).
+    - tokens: the tokens the BatchResponse responses line up with
+    - FCM_MESSAGING_PRUNE_TOKENS: "deactivate" (default) sets is_active=False, "delete" deletes the rows,
+      None disables pruning
+    All affected rows are handled with one bulk query per PRUNE_BATCH_SIZE tokens, and the audience cache of
+    their usernames is invalidated. Returns the number of pruned tokens.
+    """
+    action = getattr(settings, "FCM_MESSAGING_PRUNE_TOKENS", "deactivate")
+    if not action:
+        return 0
+
+    invalid_tokens = [token for token, r in zip(tokens, response.responses) if is_invalid_token_error(r.exception)]
+    if not invalid_tokens:
+        return 0
+
+    pruned = 0
+    usernames = set()
+    with timed("prune"):
+        # Bounded IN lists keep huge sends under the database parameter limits
+        for chunk in chunked(invalid_tokens, PRUNE_BATCH_SIZE):
+            devices = UserDevice.objects.filter(token__in=chunk)
+            if action == "delete":
+                _, deleted = devices.delete()
+                pruned += deleted.get(UserDevice._meta.label, 0)
+            else:
+                usernames.update(devices.filter(is_active=True).values_list("username", flat=True))
+                pruned += devices.filter(is_active=True).update(is_active=False)
+        # deleted rows go through the post_delete signal, bulk updates do not
+        if usernames:
+            transaction.on_commit(lambda: invalidate_audience_cache(usernames))
+    increment("pruned", pruned)
+    return pruned
+
+
+def is_invalid_token_error(exception):
+    """
+    Whether a send error means the token will never be deliverable again: UNREGISTERED, SENDER_ID_MISMATCH,
+    or INVALID_ARGUMENT when its details name the registration token (not e.g. a payload that is too large).
+    """
+    if isinstance(exception, INVALID_TOKEN_ERRORS):
+        return True
+    if not isinstance(exception, exceptions.InvalidArgumentError):
+        return False
+    try:
+        details = exception.http_response.json()["error"].get("details", [])
+    except Exception:
+        details = []
+    for detail in details:
+        for violation in detail.get("fieldViolations", []):
+            if violation.get("field") in INVALID_TOKEN_FIELDS:
+                return True
+    return "registration token" in str(exception).lower()
+
+
 # def send_message_username(title, body, username):
 #     """Sends a notification to a single username."""
 #     initialized, message = initialize_firebase_app()
@@ -152,9 +651,30 @@ def send_message_admin(title, body):
 #         return False, "Notification sending failed"
 
 
+def error_code(exception):
+    """FCM error code of a failed send, e.g. UNREGISTERED or UNAVAILABLE."""
+    for error_class, code in FCM_ERROR_CODES.items():
+        if isinstance(exception, error_class):
+            return code
+    return getattr(exception, "code", None) or "UNKNOWN"
+
+
+def delivery_map(recipients, responses):
+    """Outcome of every device grouped by username: {username: [{uuid, platform, message_id or error_code}]}."""
+    deliveries = {}
+    for recipient, r in zip(recipients, responses):
+        device = {"uuid": recipient.uuid, "platform": recipient.platform}
+        if r.success:
+            device["message_id"] = r.message_id
+        else:
+            device["error_code"] = error_code(r.exception)
+        deliveries.setdefault(recipient.username, []).append(device)
+    return deliveries
+
+
 def format_batch_response(response):
     if isinstance(response, BatchResponse):
-        return {
+        result = {
             "success_count": response.success_count,
             "failure_count": response.failure_count,
             "responses": [
@@ -162,6 +682,12 @@ def format_batch_response(response):
                 for r in response.responses
             ],
         }
+        if isinstance(response, MulticastResponse):
+            result["retried_count"] = response.retried
+            result["removed_count"] = response.removed
+            if response.recipients is not None:
+                result["deliveries"] = delivery_map(response.recipients, response.responses)
+        return result
     else:
         # Handle the case where the response is not a BatchResponse
         return {"message": "Notification sent successfully."}
@@ -171,22 +697,36 @@ def log_fcm_response(message_body, response, usernames=None, tokens=None, messag
     """
     Logs FCM responses for BatchResponse, TopicManagementResponse, or single send.
     - usernames: list of usernames, comma-separated string, or None
-    - tokens: list of FCM tokens, comma-separated string, or None
+    - tokens: list of FCM tokens, comma-separated string, or None (defaults to the tokens of a MulticastResponse)
     - message_title: notification title
     - message_body: notification body
     - response: FCM send result object
-    """
 
-    # Convert to comma-separated strings if lists/tuples
+    The send is stored as an FCMLog header row plus one FCMLogEntry per token. Usernames given as a list
+    lining up with the tokens are stored per entry, otherwise on the header. The recipients of a
+    MulticastResponse provide the tokens and the username, uuid and platform of every entry. The rows are
+    written by a background thread unless FCM_MESSAGING_ASYNC_LOG is False or MAX_PENDING_LOG_ENTRIES rows
+    are already queued for it, in which case the caller writes them; the return value (whether anything
+    was delivered) is computed right away.
+    """
+    recipients = getattr(response, "recipients", None) or []
+    if recipients:
+        tokens = [recipient.token for recipient in recipients]
+        usernames = [recipient.username for recipient in recipients]
+    if tokens is None:
+        tokens = getattr(response, "tokens", None)
+    if isinstance(tokens, str):
+        tokens = [t.strip() for t in tokens.split(",")]
+    tokens = list(tokens or [])
+
+    entry_usernames = None
     if isinstance(usernames, (list, tuple)):
-        usernames = ", ".join(usernames)
-    if isinstance(tokens, (list, tuple)):
-        tokens = ", ".join(tokens)
-
-    usernames = usernames or ""
-    tokens = tokens or ""
+        if tokens and len(usernames) == len(tokens):
+            entry_usernames, usernames = usernames, None
+        else:
+            usernames = ", ".join(usernames)
 
-    responses_list = []
+    results = []  # (success, message_id, error, error_code) per token
     success_count = 0
     failure_count = 0
 
@@ -196,33 +736,87 @@ def log_fcm_response(message_body, response, usernames=None, tokens=None, messag
         failure_count = response.failure_count
         for r in response.responses:
             if r.success:
-                responses_list.append({"success": True, "message_id": r.message_id})
+                results.append((True, r.message_id, None, None))
             else:
-                responses_list.append({"success": False, "error": str(r.exception)})
+                results.append((False, None, str(r.exception), error_code(r.exception)))
 
     # TopicManagementResponse (subscribe/unsubscribe to topics)
     elif isinstance(response, messaging.TopicManagementResponse):
         success_count = response.success_count
         failure_count = response.failure_count
-        responses_list = [{"index": e.index, "reason": e.reason} for e in response.errors]
+        errors = {e.index: e.reason for e in response.errors}
+        results = [
+            (i not in errors, None, errors.get(i), errors.get(i)) for i in range(success_count + failure_count)
+        ]
 
     # Single message (send())
     else:
         if isinstance(response, str):
             success_count = 1
-            responses_list.append({"success": True, "message_id": response})
+            results.append((True, response, None, None))
         else:
             failure_count = 1
-            responses_list.append({"success": False, "error": str(response)})
-
-    # Save log
-    FCMLog.objects.create(
-        usernames=usernames,
-        tokens=tokens,
+            results.append((False, None, str(response), None))
+
+    entries = [
+        FCMLogEntry(
+            token=tokens[i] if i < len(tokens) else None,
+            username=entry_usernames[i] if entry_usernames else None,
+            uuid=recipients[i].uuid if i < len(recipients) else None,
+            platform=recipients[i].platform if i < len(recipients) else None,
+            success=success,
+            message_id=message_id,
+            error=error,
+            error_code=code,
+        )
+        for i, (success, message_id, error, code) in enumerate(results)
+    ]
+    log = FCMLog(
+        usernames=usernames or "",
+        tokens="",
         message_title=message_title,
         message_body=message_body,
         success_count=success_count,
         failure_count=failure_count,
-        responses=responses_list,
+        responses=[],
     )
+
+    if getattr(settings, "FCM_MESSAGING_ASYNC_LOG", True) and _reserve_log_entries(len(entries) + 1):
+        _log_executor.submit(_write_fcm_log_in_background, log, entries)
+    else:
+        _write_fcm_log(log, entries)
     return success_count > 0
+
+
+def _reserve_log_entries(count):
+    """
+    Reserves room for `count` rows in the queue of the log thread, False when it is full. When logs are
+    written slower than sends are made, the sends slow down instead of the queue growing without bound.
+    """
+    with _pending_log_lock:
+        if _pending_log_entries["count"] and _pending_log_entries["count"] + count > MAX_PENDING_LOG_ENTRIES:
+            return False
+        _pending_log_entries["count"] += count
+        return True
+
+
+def _write_fcm_log(log, entries):
+    try:
+        with timed("log_write"), transaction.atomic():
+            log.save()
+            for entry in entries:
+                entry.log = log
+            FCMLogEntry.objects.bulk_create(entries, batch_size=LOG_BATCH_SIZE)
+    except Exception:
+        logger.exception("Failed to write FCM log")
+
+
+def _write_fcm_log_in_background(log, entries):
+    # the log thread outlives requests, so it expires its own connection like a request would
+    close_old_connections()
+    try:
+        _write_fcm_log(log, entries)
+    finally:
+        close_old_connections()
+        with _pending_log_lock:
+            _pending_log_entries["count"] -= len(entries) + 1
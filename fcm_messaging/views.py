@@ -1,21 +1,51 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import IntegrityError
-from firebase_admin import messaging
-from firebase_admin.messaging import TopicManagementResponse
+from django.db.models import Max, Subquery
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from fcm_messaging.audience import iter_username_tokens
+from fcm_messaging.campaigns import campaign_progress, cancel_campaign, create_campaign
+from fcm_messaging.config import get_firebase_config
+from fcm_messaging.devices import bulk_upsert_devices, update_topic_subscriptions
+from fcm_messaging.jobs import enqueue_send_job
+from fcm_messaging.metrics import get_metrics
+from fcm_messaging.scheduling import cancel_scheduled_notification, schedule_notification
+from fcm_messaging.topics import topic_audience_size
+from fcm_messaging.transport import transport_stats
 from fcm_messaging.utils import (
-    initialize_firebase_app,
+    NO_TOPIC_TOKENS,
+    get_firebase_app,
+    manage_topic,
     send_message_admin,
+    send_message_template,
     send_message_token,
     send_message_tokens,
+    send_message_topic,
     send_message_usernames,
 )
 
-from .models import FCMCertificate, UserDevice
-from .serializers import FCMCertificateSerializer, UserDeviceSerializer
+from .models import Campaign, FCMCertificate, FCMLogEntry, ScheduledNotification, SendJob, UserDevice
+from .serializers import (
+    CampaignSerializer,
+    FCMCertificateSerializer,
+    FCMLogEntrySerializer,
+    ScheduledNotificationSerializer,
+    SendJobSerializer,
+    UserDeviceRecordSerializer,
+    UserDeviceSerializer,
+)
 
 # APIs to test with Postman:
 
@@ -35,27 +65,153 @@ from .serializers import FCMCertificateSerializer, UserDeviceSerializer
 
 
 class FirebaseConfigView(APIView):
+    """
+    Public config clients bootstrap messaging with, served from the config cache (see config.py).
+    Responses carry ETag, Last-Modified and Cache-Control (max-age FCM_MESSAGING_CONFIG_MAX_AGE), and
+    conditional requests for an unchanged config get a 304.
+    """
+
+    default_max_age = 300
+
     def get(self, request):
-        try:
-            cert_instance = FCMCertificate.objects.get(pk=1)  # Assuming a single certificate with pk=1
-            response_data = {
-                "firebase_config": cert_instance.firebase_config,
-                "vapid_key": cert_instance.vapid_key,
-            }
-            return Response(response_data, status=status.HTTP_200_OK)
-        except FCMCertificate.DoesNotExist:
+        entry = get_firebase_config()
+        if entry is None:
             return Response({"error": "No FCM certificate found."}, status=status.HTTP_404_NOT_FOUND)
 
+        response = get_conditional_response(request, etag=entry["etag"], last_modified=entry["last_modified"])
+        if response is None:
+            response = Response(entry["data"], status=status.HTTP_200_OK)
+        response["ETag"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            response["Last-Modified"] = http_date(entry["last_modified"])
+        patch_cache_control(
+            response, public=True, max_age=getattr(settings, "FCM_MESSAGING_CONFIG_MAX_AGE", self.default_max_age)
+        )
+        return response
+
 
 # #########
 # CRUD for User and certificate
 
 
+# rows fetched per round trip of the server-side cursor of streamed listings
+EXPORT_CHUNK_SIZE = 2000
+
+
+def stream_queryset(request, queryset, render, start="", separator="", end=""):
+    """
+    Streaming content of `render(row)` for every row of a queryset, read from a server-side cursor.
+    Under ASGI the content is an async iterator: Django buffers the whole of a sync one before sending it.
+    """
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+
+        async def arows():
+            yield start
+            first = True
+            async for row in queryset.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+                yield render(row) if first else separator + render(row)
+                first = False
+            yield end
+
+        return arows()
+
+    def rows():
+        yield start
+        for i, row in enumerate(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)):
+            yield separator + render(row) if i else render(row)
+        yield end
+
+    return rows()
+
+
 class GetUserDeviceView(APIView):
+    """
+    Lists devices, by default as a single JSON list streamed from a server-side cursor.
+    Query params: platform, is_active, is_dashboard_login, fields (comma-separated subset of the device
+    fields), export=ndjson to stream newline-delimited JSON instead, and cursor (next_cursor of the previous
+    page) and/or limit to get one keyset-paginated page as {next_cursor, results} instead.
+    """
+
+    default_limit = 100
+    max_limit = 1000
+
     def get(self, request):
-        user_device_instances = UserDevice.objects.all()
-        serializer = UserDeviceSerializer(user_device_instances, many=True)
-        return Response(serializer.data)
+        params = request.query_params
+        queryset = UserDevice.objects.order_by("id")
+
+        if params.get("platform"):
+            queryset = queryset.filter(platform=params["platform"])
+        for name in ["is_active", "is_dashboard_login"]:
+            if params.get(name):
+                queryset = queryset.filter(**{name: params[name].lower() in ("true", "1")})
+
+        fields = None
+        if params.get("fields"):
+            fields = [f.strip() for f in params["fields"].split(",")]
+            unknown = set(fields) - set(UserDeviceSerializer.Meta.fields)
+            if unknown:
+                return Response(
+                    {"error": f"Unknown fields: {', '.join(sorted(unknown))}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            queryset = queryset.only("id", *fields)
+
+        def render(device):
+            return json.dumps(UserDeviceSerializer(device, fields=fields).data)
+
+        if params.get("export") == "ndjson":
+            rows = stream_queryset(request, queryset, lambda device: render(device) + "\n")
+            return StreamingHttpResponse(rows, content_type="application/x-ndjson")
+
+        if "cursor" not in params and "limit" not in params:
+            # the unpaginated list of every device, as before pagination, without holding it in memory
+            rows = stream_queryset(request, queryset, render, start="[", separator=",", end="]")
+            return StreamingHttpResponse(rows, content_type="application/json")
+
+        try:
+            cursor = int(params.get("cursor", 0))
+            limit = max(1, min(int(params.get("limit", self.default_limit)), self.max_limit))
+        except ValueError:
+            return Response({"error": "cursor and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # one extra row tells whether there is a next page
+        user_device_instances = list(queryset.filter(id__gt=cursor)[: limit + 1])
+        next_cursor = user_device_instances[limit - 1].id if len(user_device_instances) > limit else None
+        serializer = UserDeviceSerializer(user_device_instances[:limit], many=True, fields=fields)
+        return Response({"next_cursor": next_cursor, "results": serializer.data})
+
+
+class UserDeviceBulkView(APIView):
+    """Registers or updates up to `max_records` devices in one request, see devices.bulk_upsert_devices."""
+
+    max_records = 10000
+
+    def post(self, request):
+        records = request.data.get("devices") if isinstance(request.data, dict) else request.data
+        if not isinstance(records, list) or not records:
+            return Response({"error": "devices must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(records) > self.max_records:
+            return Response(
+                {"error": f"At most {self.max_records} devices can be registered at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = UserDeviceRecordSerializer(data=records, many=True)
+        if not serializer.is_valid():
+            # DRF < 3.18 reports one entry per record, later versions only the invalid ones keyed by index.
+            row_errors = serializer.errors
+            items = row_errors.items() if isinstance(row_errors, dict) else enumerate(row_errors)
+            errors = {int(index): error for index, error in sorted(items, key=lambda item: int(item[0])) if error}
+            return Response(
+                {"error": "Invalid devices.", "invalid_indexes": list(errors), "errors": errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            upserted, replaced = bulk_upsert_devices(serializer.validated_data)
+        except IntegrityError as e:
+            return Response({"error": f"Devices could not be registered: {str(e)}"}, status=status.HTTP_409_CONFLICT)
+        return Response({"upserted": upserted, "replaced": replaced}, status=status.HTTP_200_OK)
 
 
 class UserDeviceDetailView(APIView):
@@ -103,18 +259,30 @@ class UserDeviceDetailView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # optional IANA timezone name (used by campaigns) and locale (used by templated sends)
+        device_settings = {field: data[field] for field in ("timezone", "locale") if data.get(field)}
+        settings_serializer = UserDeviceRecordSerializer(data=device_settings, partial=True)
+        if not settings_serializer.is_valid():
+            return Response({"error": settings_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
             # Use get_or_create with the unique fields to handle existing or new devices
             user_device_instance, created = UserDevice.objects.get_or_create(
                 username=username,
                 uuid=uuid,
-                defaults={"token": token},  # Set default token if creating a new instance
+                defaults={"token": token, **device_settings},  # Set default token if creating a new instance
             )
 
-            # If the instance already existed, update its token if it changed
-            if not created and user_device_instance.token != token:
+            # If the instance already existed, update its token (and settings, when given) if they changed
+            settings_changed = any(getattr(user_device_instance, f) != v for f, v in device_settings.items())
+            if not created and (user_device_instance.token != token or settings_changed):
+                token_changed = user_device_instance.token != token
                 user_device_instance.token = token
+                for field, value in device_settings.items():
+                    setattr(user_device_instance, field, value)
                 user_device_instance.save()
+                if token_changed:
+                    update_topic_subscriptions(user_device_instance.pk, token)
 
             serializer = UserDeviceSerializer(user_device_instance)
             return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
@@ -160,8 +328,8 @@ class CertificateUploadView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def put(self, request):
-        instance, created = FCMCertificate.objects.get_or_create(pk=1)
-        if not instance and not created:  # Check if instance was actually created or if it was a retrieval
+        instance = FCMCertificate.objects.first()
+        if instance is None:
             return Response({"error": "No certificate found to update."}, status=status.HTTP_404_NOT_FOUND)
 
         serializer = FCMCertificateSerializer(instance, data=request.data)
@@ -172,8 +340,8 @@ class CertificateUploadView(APIView):
 
     def patch(self, request):
         # Assuming there should only ever be one certificate configured.
-        instance, created = FCMCertificate.objects.get_or_create(pk=1)
-        if not instance and not created:
+        instance = FCMCertificate.objects.first()
+        if instance is None:
             return Response({"error": "No certificate found to update."}, status=status.HTTP_404_NOT_FOUND)
 
         serializer = FCMCertificateSerializer(instance, data=request.data, partial=True)
@@ -189,6 +357,246 @@ class CertificateUploadView(APIView):
 ########################
 
 
+def use_async_send(request):
+    """A send is queued when the request asks for it with `"async": true` or FCM_MESSAGING_ASYNC_SEND is set."""
+    requested = request.data.get("async")
+    if requested is None:
+        return getattr(settings, "FCM_MESSAGING_ASYNC_SEND", False)
+    return requested in (True, "true", "1", 1)
+
+
+def enqueue_send_response(kind, **payload):
+    job = enqueue_send_job(kind, **payload)
+    return Response({"success": True, "job_id": job.id, "status": job.status}, status=status.HTTP_202_ACCEPTED)
+
+
+class TransportStatsView(APIView):
+    def get(self, request):
+        app, error_message = get_firebase_app()
+        if app is None:
+            return Response({"error": error_message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(transport_stats(app))
+
+
+class MetricsView(APIView):
+    """Send metrics of this process in the Prometheus text format, see metrics.py."""
+
+    def get(self, request):
+        backend = get_metrics()
+        if not hasattr(backend, "render"):
+            return Response({"error": "Metrics export is not enabled"}, status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(backend.render(), content_type=backend.content_type)
+
+
+class SendJobStatusView(APIView):
+    def get(self, request, pk):
+        try:
+            job = SendJob.objects.get(pk=pk)
+        except SendJob.DoesNotExist:
+            return Response({"error": "Send job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(SendJobSerializer(job).data)
+
+
+class ScheduledNotificationView(APIView):
+    """
+    Schedules a send. Body: kind (tokens, token, usernames, admin or group), title, body, the audience of
+    the kind (tokens, token, usernames or group_name), send_at (ISO 8601) or delay (seconds from now), and
+    optionally jitter (seconds the send may be spread over, defaults to FCM_MESSAGING_SCHEDULE_JITTER).
+    """
+
+    # request field and send function argument holding the audience of every kind
+    audience_fields = {
+        "tokens": ("tokens", "tokens"),
+        "token": ("token", "token"),
+        "usernames": ("usernames", "usernames"),
+        "admin": None,
+        "group": ("group_name", "topic"),
+    }
+    # upper bounds in seconds of delay and jitter
+    max_delay = 366 * 24 * 3600
+    max_jitter = 24 * 3600
+
+    def post(self, request):
+        kind = request.data.get("kind")
+        title = request.data.get("title")
+        body = request.data.get("body")
+
+        if kind not in self.audience_fields:
+            return Response(
+                {"error": f"kind must be one of {', '.join(self.audience_fields)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not all([title, body]):
+            return Response({"error": "title and body are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        payload = {"title": title, "body": body}
+        if self.audience_fields[kind]:
+            field, argument = self.audience_fields[kind]
+            audience = request.data.get(field)
+            if not audience:
+                return Response({"error": f"{field} is required."}, status=status.HTTP_400_BAD_REQUEST)
+            if kind in ("tokens", "usernames") and not isinstance(audience, list):
+                return Response({"error": f"{field} must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+            if kind in ("token", "group") and not isinstance(audience, str):
+                return Response({"error": f"{field} must be a string."}, status=status.HTTP_400_BAD_REQUEST)
+            payload[argument] = audience
+
+        try:
+            send_at = self.get_send_at(request)
+            jitter = request.data.get("jitter")
+            jitter = float(jitter) if jitter is not None else None
+            if jitter is not None and not 0 <= jitter <= self.max_jitter:
+                raise ValueError(f"jitter must be between 0 and {self.max_jitter} seconds.")
+            notification = schedule_notification(kind, send_at, jitter=jitter, **payload)
+        except (TypeError, ValueError, OverflowError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(ScheduledNotificationSerializer(notification).data, status=status.HTTP_201_CREATED)
+
+    def get_send_at(self, request):
+        send_at = request.data.get("send_at")
+        delay = request.data.get("delay")
+        if send_at:
+            return parse_request_datetime(send_at, "send_at")
+        if delay is not None:
+            delay = float(delay)
+            if not 0 <= delay <= self.max_delay:
+                raise ValueError(f"delay must be between 0 and {self.max_delay} seconds.")
+            return timezone.now() + timedelta(seconds=delay)
+        raise ValueError("send_at or delay is required.")
+
+
+def parse_request_datetime(value, field):
+    """Aware datetime of an ISO 8601 request value, naive values are in the current timezone."""
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError(f"{field} must be an ISO 8601 datetime.")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class ScheduledNotificationDetailView(APIView):
+    def get(self, request, pk):
+        try:
+            notification = ScheduledNotification.objects.get(pk=pk)
+        except ScheduledNotification.DoesNotExist:
+            return Response({"error": "Scheduled notification not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ScheduledNotificationSerializer(notification).data)
+
+    def delete(self, request, pk):
+        """Cancels the send, unless it is already being sent."""
+        if cancel_scheduled_notification(pk):
+            return Response({"success": True, "status": ScheduledNotification.Status.CANCELLED})
+        if not ScheduledNotification.objects.filter(pk=pk).exists():
+            return Response({"error": "Scheduled notification not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            {"error": "Only scheduled notifications that have not started can be cancelled."},
+            status=status.HTTP_409_CONFLICT,
+        )
+
+
+class CampaignView(APIView):
+    """
+    Starts a campaign. Body: title, body, usernames, window (seconds the send is spread over), and
+    optionally starts_at (ISO 8601, defaults to now), by_timezone, quiet_hours (["22:00", "08:00"], an empty
+    list for none, defaults to FCM_MESSAGING_QUIET_HOURS) and batch_size.
+    """
+
+    # largest value of the PositiveIntegerField the window is stored in, on every database
+    max_window = 2147483647
+
+    def post(self, request):
+        title = request.data.get("title")
+        body = request.data.get("body")
+        usernames = request.data.get("usernames")
+
+        if not all([usernames, title, body]):
+            return Response({"error": "usernames, title, and body are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(usernames, list):
+            return Response({"error": "usernames must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        quiet_hours = request.data.get("quiet_hours")
+        if quiet_hours is not None and (not isinstance(quiet_hours, list) or len(quiet_hours) not in (0, 2)):
+            return Response(
+                {"error": "quiet_hours must be a [start, end] pair of HH:MM times."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            window = int(request.data.get("window"))
+            batch_size = request.data.get("batch_size")
+            batch_size = int(batch_size) if batch_size is not None else None
+            if not 0 <= window <= self.max_window:
+                raise ValueError(f"window must be between 0 and {self.max_window} seconds.")
+            if batch_size is not None and batch_size < 1:
+                raise ValueError("batch_size must be at least 1.")
+            starts_at = request.data.get("starts_at")
+            starts_at = parse_request_datetime(starts_at, "starts_at") if starts_at else timezone.now()
+            campaign = create_campaign(
+                title,
+                body,
+                usernames,
+                starts_at,
+                window,
+                by_timezone=request.data.get("by_timezone") in (True, "true", "1", 1),
+                quiet_hours=quiet_hours,
+                batch_size=batch_size,
+            )
+        except (TypeError, ValueError, OverflowError) as e:
+            return Response({"error": f"Invalid campaign: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {**CampaignSerializer(campaign).data, "progress": campaign_progress(campaign)}
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class CampaignDetailView(APIView):
+    def get(self, request, pk):
+        try:
+            campaign = Campaign.objects.get(pk=pk)
+        except Campaign.DoesNotExist:
+            return Response({"error": "Campaign not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({**CampaignSerializer(campaign).data, "progress": campaign_progress(campaign)})
+
+    def delete(self, request, pk):
+        """Cancels the batches that were not released yet."""
+        try:
+            campaign = Campaign.objects.get(pk=pk)
+        except Campaign.DoesNotExist:
+            return Response({"error": "Campaign not found"}, status=status.HTTP_404_NOT_FOUND)
+        cancelled = cancel_campaign(campaign)
+        return Response({"cancelled_batches": cancelled, "progress": campaign_progress(campaign)})
+
+
+class DeliveryStatusView(APIView):
+    """
+    Latest delivery result of every (uuid, token) device of a user, newest first.
+    Query params: username, log_id (restricts the results to one send) and limit (number of devices).
+    """
+
+    default_limit = 50
+    max_limit = 1000
+
+    def get(self, request):
+        params = request.query_params
+        username = params.get("username")
+        if not username:
+            return Response({"error": "username is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = max(1, min(int(params.get("limit", self.default_limit)), self.max_limit))
+            log_id = int(params["log_id"]) if params.get("log_id") else None
+        except ValueError:
+            return Response({"error": "log_id and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = FCMLogEntry.objects.filter(username=username)
+        if log_id is not None:
+            entries = entries.filter(log_id=log_id)
+        # the newest entry of every device, grouped without ordering so that id is not part of the groups
+        latest_ids = entries.order_by().values("uuid", "token").annotate(latest_id=Max("id")).values("latest_id")
+        latest = FCMLogEntry.objects.filter(id__in=Subquery(latest_ids)).select_related("log").order_by("-id")
+        serializer = FCMLogEntrySerializer(latest[:limit], many=True)
+        return Response({"username": username, "deliveries": serializer.data})
+
+
 class SendNotificationToTokensView(APIView):
     def post(self, request):
         tokens = request.data.get("tokens")  # Expecting a list of tokens
@@ -207,6 +615,9 @@ class SendNotificationToTokensView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if use_async_send(request):
+            return enqueue_send_response("tokens", title=title, body=body, tokens=tokens)
+
         success, message = send_message_tokens(title, body, tokens)
 
         return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
@@ -224,6 +635,9 @@ class SendNotificationToTokenView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if use_async_send(request):
+            return enqueue_send_response("token", title=title, body=body, token=device_token)
+
         success, message = send_message_token(title, body, device_token)
 
         return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
@@ -247,11 +661,55 @@ class SendNotificationToUsernamesView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if use_async_send(request):
+            return enqueue_send_response("usernames", title=title, body=body, usernames=usernames)
+
         success, message = send_message_usernames(title, body, usernames)
 
         return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
 
 
+class SendNotificationTemplateView(APIView):
+    """
+    Sends a NotificationTemplate. Body: template_id, tokens or usernames, and optionally context (variables
+    of the whole send) and variables (variables of each recipient, keyed by username or token).
+    """
+
+    def post(self, request):
+        template_id = request.data.get("template_id")
+        tokens = request.data.get("tokens")
+        usernames = request.data.get("usernames")
+        context = request.data.get("context") or {}
+        variables = request.data.get("variables") or {}
+
+        if not template_id or not (tokens or usernames):
+            return Response(
+                {"success": False, "error": "template_id and tokens or usernames are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        audience = usernames if usernames else tokens
+        if not isinstance(audience, list):
+            return Response(
+                {"success": False, "error": f"{'usernames' if usernames else 'tokens'} must be a list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not isinstance(context, dict) or not isinstance(variables, dict):
+            return Response(
+                {"success": False, "error": "context and variables must be objects."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        payload = {"template_id": template_id, "context": context, "variables": variables}
+        payload["usernames" if usernames else "tokens"] = audience
+        if use_async_send(request):
+            return enqueue_send_response("template", **payload)
+
+        success, message = send_message_template(**payload)
+
+        return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
+
+
 class SendNotificationToUsernameView(APIView):
     def post(self, request):
         username = request.data.get("username")
@@ -264,6 +722,9 @@ class SendNotificationToUsernameView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if use_async_send(request):
+            return enqueue_send_response("usernames", title=title, body=body, usernames=[username])
+
         success, message = send_message_usernames(title, body, [username])
 
         return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
@@ -274,14 +735,28 @@ class SendNotificationToUsernameView(APIView):
 
 
 class DeviceGroupView(APIView):
+    def get(self, request):
+        group_name = request.query_params.get("group_name")
+        if not group_name:
+            return Response({"error": "group_name is required."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"group_name": group_name, "device_count": topic_audience_size(group_name)})
+
     def post(self, request):
         device_token = request.data.get("token")
+        tokens = request.data.get("tokens")  # or a list of tokens
+        usernames = request.data.get("usernames")  # or the devices of a list of usernames
         group_name = request.data.get("group_name")
         action = request.data.get("action")
 
-        if not device_token:
+        if not any([device_token, tokens, usernames]):
+            return Response(
+                {"error": "token, tokens or usernames is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if any(value is not None and not isinstance(value, list) for value in [tokens, usernames]):
             return Response(
-                {"error": "device_token is required."},
+                {"error": "tokens and usernames must be lists."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -297,32 +772,26 @@ class DeviceGroupView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        initialized, error_message = initialize_firebase_app()
-        if not initialized:
-            return Response({"error": error_message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if usernames:
+            tokens = (recipient.token for recipient in iter_username_tokens(usernames))
+        elif not tokens:
+            tokens = [device_token]
 
         try:
-            if action == "subscribe":
-                response = messaging.subscribe_to_topic(device_token, group_name)
-            else:
-                response = messaging.unsubscribe_from_topic(device_token, group_name)
-
-            if isinstance(response, TopicManagementResponse):
-                response_data = {
-                    "success_count": response.success_count,
-                    "failure_count": response.failure_count,
-                    "errors": [{"index": e.index, "reason": e.reason} for e in response.errors],
-                }
-            else:
-                response_data = {"message": "Operation successful", "result": str(response)}
-
-            return Response({"message": f"Device token has been {action}d to group {group_name}", "result": response_data})
+            success, response_data = manage_topic(action, group_name, tokens)
         except Exception as e:
             return Response(
                 {"error": f"Failed to {action} device token from group: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+        if response_data == NO_TOPIC_TOKENS:
+            # usernames without any active device
+            return Response({"error": response_data}, status=status.HTTP_404_NOT_FOUND)
+        if not isinstance(response_data, dict):
+            return Response({"error": response_data}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"message": f"Device token has been {action}d to group {group_name}", "result": response_data})
+
 
 class SendNotificationGroupView(APIView):
     def post(self, request):
@@ -336,28 +805,16 @@ class SendNotificationGroupView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Initialize Firebase app. This function is assumed to be defined elsewhere.
-        initialized, error_message = initialize_firebase_app()
-        if not initialized:
-            return Response(
-                {"status": "failed", "error": error_message},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-
-        try:
-            message = messaging.Message(
-                notification=messaging.Notification(title=title, body=body),
-                topic=group_name,
-            )
-
-            response = messaging.send(message)
-            return Response({"status": "success", "message_id": response}, status=status.HTTP_200_OK)
+        if use_async_send(request):
+            return enqueue_send_response("group", title=title, body=body, topic=group_name)
 
-        except Exception as e:
+        success, message = send_message_topic(title, body, group_name)
+        if not success:
             return Response(
-                {"status": "failed", "error": f"Failed to send message: {str(e)}"},
+                {"status": "failed", "error": message},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+        return Response({"status": "success", "message_id": message}, status=status.HTTP_200_OK)
 
 
 class SendNotificationAdminView(APIView):
@@ -371,6 +828,9 @@ class SendNotificationAdminView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if use_async_send(request):
+            return enqueue_send_response("admin", title=title, body=body)
+
         success, message = send_message_admin(title, body)
 
         return Response({"success": success, "detail": message}, status=status.HTTP_200_OK)
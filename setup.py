@@ -7,7 +7,7 @@ setup(
     include_package_data=True,
     install_requires=[
         "Django>=4.2.7",
-        "firebase-admin>=5.0.0",
+        "firebase-admin>=6.9.0,<8",
         "djangorestframework>=3.14.0",
     ],
     classifiers=[